@@ -0,0 +1,91 @@
+"""
+Cold-start import budget check for the Cloud Function module.
+
+Imports cloud-function/main.py in fresh interpreters under `python -X importtime`,
+takes the median cumulative import time of `main` and fails if it exceeds the budget.
+It also fails if any of the heavy client libraries are imported eagerly.
+
+Usage:
+    python bin/check_import_time.py [--budget-ms 500] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cloud-function')
+DEFAULT_BUDGET_MS = int(os.environ.get('IMPORT_TIME_BUDGET_MS', '500'))
+
+# Modules that must only be imported once an event actually needs them
+DEFERRED_MODULES = [
+    'google.cloud.storage',
+    'google.cloud.bigquery',
+    'google.cloud.secretmanager',
+    'sendgrid',
+    'requests',
+]
+
+PROBE = (
+    "import sys, main; "
+    "print(','.join(m for m in {deferred!r} if m in sys.modules))"
+)
+
+
+def measure_import_ms() -> tuple:
+    """Import main once in a fresh interpreter. Returns (cumulative ms, eagerly loaded modules)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(deferred=DEFERRED_MODULES)],
+        cwd=FUNCTION_DIR,
+        capture_output=True,
+        text=True,
+        env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'},
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing main failed:\n{result.stderr}")
+
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = [p.strip() for p in line[len('import time:'):].split('|')]
+        if len(parts) == 3 and parts[2] == 'main':
+            cumulative_us = int(parts[1])
+    if cumulative_us is None:
+        raise RuntimeError("Could not find 'main' in -X importtime output")
+
+    eager = [m for m in result.stdout.strip().split(',') if m]
+    return cumulative_us / 1000.0, eager
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help='Maximum median import time in ms')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters to sample')
+    args = parser.parse_args()
+
+    samples = []
+    eager = []
+    for _ in range(args.runs):
+        elapsed_ms, eager = measure_import_ms()
+        samples.append(elapsed_ms)
+
+    median_ms = statistics.median(samples)
+    print(f"main import time: median {median_ms:.1f} ms over {args.runs} runs "
+          f"(min {min(samples):.1f}, max {max(samples):.1f}), budget {args.budget_ms:.0f} ms")
+
+    failed = False
+    if eager:
+        print(f"FAIL: heavy modules imported at module load: {', '.join(eager)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"FAIL: import time {median_ms:.1f} ms exceeds budget {args.budget_ms:.0f} ms")
+        failed = True
+
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
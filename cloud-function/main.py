@@ -1,10 +1,25 @@
+from __future__ import annotations
+
+import atexit
+import codecs
+import csv
+import fcntl
+import fnmatch
+import hashlib
+import importlib
 import json
 import os
+import queue
+import random
 import re
+import threading
 import time
-from typing import Optional, Dict, Any
-from google.cloud import storage
-from google.cloud import bigquery
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple, Union
+from zoneinfo import ZoneInfo
 from google.cloud.exceptions import NotFound, GoogleCloudError, Forbidden
 from google.api_core import exceptions as api_exceptions
 from google.auth import default
@@ -12,11 +27,30 @@ from google.auth.exceptions import GoogleAuthError, RefreshError
 import logging
 from functools import wraps
 import functions_framework
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 import socket
-import requests
-from google.cloud import secretmanager
+
+if TYPE_CHECKING:
+    from google.auth.transport.requests import AuthorizedSession
+
+
+class _LazyModule:
+    """Module proxy that defers the real import until an attribute is first accessed"""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Heavy client libraries are imported on first use so that events rejected by
+# name (non-config files, our own processed/ moves) never pay for them.
+storage = _LazyModule('google.cloud.storage')
+bigquery = _LazyModule('google.cloud.bigquery')
+requests = _LazyModule('requests')
 
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -33,6 +67,141 @@ MAX_RETRIES = int(os.environ.get('MAX_RETRIES', '1'))
 RETRY_DELAY = int(os.environ.get('RETRY_DELAY', '5'))  # seconds
 MAX_FILE_SIZE_MB = int(os.environ.get('MAX_FILE_SIZE_MB', '1000'))
 TIMEOUT_SECONDS = int(os.environ.get('TIMEOUT_SECONDS', '540'))
+DEADLINE_RESERVE_SECONDS = int(os.environ.get('DEADLINE_RESERVE_SECONDS', '30'))  # kept for post-load stages
+RETRY_MAX_DELAY = int(os.environ.get('RETRY_MAX_DELAY', '60'))  # seconds
+ASYNC_LOAD_ENABLED = os.environ.get('ASYNC_LOAD_ENABLED', 'false').lower() == 'true'
+PENDING_JOBS_BUCKET = os.environ.get('PENDING_JOBS_BUCKET', '')
+PENDING_JOBS_PREFIX = os.environ.get('PENDING_JOBS_PREFIX', 'pending_loads/')
+MAX_SOURCE_URIS = int(os.environ.get('MAX_SOURCE_URIS', '10000'))  # BigQuery limit per load job
+MAX_PARALLEL_LOADS = int(os.environ.get('MAX_PARALLEL_LOADS', '4'))
+SCHEMA_BUCKET = os.environ.get('SCHEMA_BUCKET', '')
+SCHEMA_PATH = os.environ.get('SCHEMA_PATH', 'schemas').strip('/')
+SCHEMA_DIR = os.environ.get('SCHEMA_DIR', '')
+SCHEMA_CACHE_TTL_SECONDS = int(os.environ.get('SCHEMA_CACHE_TTL_SECONDS', '600'))
+MAX_BAD_RECORDS = int(os.environ.get('MAX_BAD_RECORDS', '10'))
+CSV_FULL_VALIDATION = os.environ.get('CSV_FULL_VALIDATION', 'false').lower() == 'true'  # else head/tail samples only
+CSV_VALIDATION_SAMPLE_MB = int(os.environ.get('CSV_VALIDATION_SAMPLE_MB', '4'))  # per end of each file when sampling
+CSV_VALIDATION_WORKERS = int(os.environ.get('CSV_VALIDATION_WORKERS', '4'))
+CSV_VALIDATION_CHUNK_MB = int(os.environ.get('CSV_VALIDATION_CHUNK_MB', '64'))
+CSV_VALIDATION_READ_MB = int(os.environ.get('CSV_VALIDATION_READ_MB', '4'))
+PARQUET_TRANSCODE_ENABLED = os.environ.get('PARQUET_TRANSCODE_ENABLED', 'false').lower() == 'true'
+PARQUET_STAGING_BUCKET = os.environ.get('PARQUET_STAGING_BUCKET', '')
+PARQUET_STAGING_PREFIX = os.environ.get('PARQUET_STAGING_PREFIX', 'staging/parquet/')
+PARQUET_BLOCK_SIZE_MB = int(os.environ.get('PARQUET_BLOCK_SIZE_MB', '16'))
+SPLIT_OVERSIZE_FILES = os.environ.get('SPLIT_OVERSIZE_FILES', 'true').lower() == 'true'
+MAX_SPLIT_FILE_SIZE_MB = int(os.environ.get('MAX_SPLIT_FILE_SIZE_MB', '51200'))  # largest file accepted for splitting
+SHARD_SIZE_MB = int(os.environ.get('SHARD_SIZE_MB', str(MAX_FILE_SIZE_MB)))
+SHARD_PREFIX = os.environ.get('SHARD_PREFIX', 'staging/shards/')
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', '8'))
+SHARD_UPLOAD_CHUNK_MB = int(os.environ.get('SHARD_UPLOAD_CHUNK_MB', '8'))  # resumable upload buffer per shard writer
+SHARD_MEMORY_BUDGET_MB = int(os.environ.get('SHARD_MEMORY_BUDGET_MB', '128'))  # buffers of all shard writers together
+SHARD_COPY_MBPS = float(os.environ.get('SHARD_COPY_MBPS', '40'))  # expected rate of one shard writer, for the time check
+COMPACT_SMALL_FILES = os.environ.get('COMPACT_SMALL_FILES', 'true').lower() == 'true'
+COMPACT_MIN_FILES = int(os.environ.get('COMPACT_MIN_FILES', '10'))  # compact only when at least this many are small
+COMPACT_MAX_FILE_KB = int(os.environ.get('COMPACT_MAX_FILE_KB', '1024'))
+COMPACT_COMPONENT_MB = int(os.environ.get('COMPACT_COMPONENT_MB', '32'))
+COMPACT_PREFIX = os.environ.get('COMPACT_PREFIX', 'staging/compacted/')
+COMPOSE_MAX_COMPONENTS = 32  # GCS limit per compose request
+MICRO_BATCH_WINDOW_SECONDS = int(os.environ.get('MICRO_BATCH_WINDOW_SECONDS', '0'))  # 0 disables micro-batching
+MICRO_BATCH_MAX_CONFIGS = int(os.environ.get('MICRO_BATCH_MAX_CONFIGS', '50'))
+MICRO_BATCH_POLL_SECONDS = 2
+MICRO_BATCH_BUCKET = os.environ.get('MICRO_BATCH_BUCKET', '')  # micro-batching is off unless set; never the trigger bucket
+MICRO_BATCH_PREFIX = os.environ.get('MICRO_BATCH_PREFIX', 'micro_batches/')
+MICRO_BATCH_DIR = os.environ.get('MICRO_BATCH_DIR', '')  # local stand-in for the GCS pending lists
+QUOTA_LEDGER_BUCKET = os.environ.get('QUOTA_LEDGER_BUCKET', '')
+QUOTA_LEDGER_PREFIX = os.environ.get('QUOTA_LEDGER_PREFIX', 'quota_ledger/')
+QUOTA_LEDGER_DIR = os.environ.get('QUOTA_LEDGER_DIR', '')  # local stand-in for the GCS quota ledger
+QUOTA_ENABLED = bool(QUOTA_LEDGER_BUCKET or QUOTA_LEDGER_DIR)
+TABLE_LOAD_JOBS_PER_DAY = int(os.environ.get('TABLE_LOAD_JOBS_PER_DAY', '1500'))  # BigQuery limit per table
+PROJECT_LOAD_JOBS_PER_DAY = int(os.environ.get('PROJECT_LOAD_JOBS_PER_DAY', '100000'))  # BigQuery limit per project
+QUOTA_RESERVE_JOBS = int(os.environ.get('QUOTA_RESERVE_JOBS', '50'))  # defer new work this close to a limit
+QUOTA_COALESCE_RATIO = float(os.environ.get('QUOTA_COALESCE_RATIO', '0.8'))  # micro-batch above this share of a limit
+QUOTA_COALESCE_WINDOW_SECONDS = int(os.environ.get('QUOTA_COALESCE_WINDOW_SECONDS', '120'))
+MAX_CONCURRENT_LOAD_JOBS = int(os.environ.get('MAX_CONCURRENT_LOAD_JOBS', '0'))  # project-wide; 0 means no limit
+QUOTA_SLOT_POLL_SECONDS = 5
+QUOTA_IN_FLIGHT_TTL_SECONDS = 6 * 3600  # in-flight entries older than this are assumed finished
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')  # BigQuery daily quotas reset at midnight Pacific time
+MAX_ACCEPTED_FILE_SIZE_MB = MAX_SPLIT_FILE_SIZE_MB if SPLIT_OVERSIZE_FILES else MAX_FILE_SIZE_MB
+LOAD_STATS_BUCKET = os.environ.get('LOAD_STATS_BUCKET', '')
+LOAD_STATS_PREFIX = os.environ.get('LOAD_STATS_PREFIX', 'load_stats/')
+LOAD_DEDUP_ENABLED = os.environ.get('LOAD_DEDUP_ENABLED', 'true').lower() == 'true'
+LOAD_LEDGER_BUCKET = os.environ.get('LOAD_LEDGER_BUCKET', '')  # dedup is off unless set; never the trigger bucket
+LOAD_LEDGER_PREFIX = os.environ.get('LOAD_LEDGER_PREFIX', 'load_ledger/')
+LOAD_LEDGER_DIR = os.environ.get('LOAD_LEDGER_DIR', '')  # local stand-in for the GCS ledger
+CHECKPOINT_BUCKET = os.environ.get('CHECKPOINT_BUCKET', '')  # checkpoints are off unless set; never the trigger bucket
+CHECKPOINT_PREFIX = os.environ.get('CHECKPOINT_PREFIX', 'checkpoints/')
+CHECKPOINT_DIR = os.environ.get('CHECKPOINT_DIR', '')  # local stand-in for GCS checkpoints
+CHECKPOINT_STAGES = ['validate', 'load', 'move_data', 'move_config', 'notify']
+MOVE_WORKERS = int(os.environ.get('MOVE_WORKERS', '8'))
+REWRITE_THRESHOLD_MB = int(os.environ.get('REWRITE_THRESHOLD_MB', '256'))  # use resumable rewrite above this size
+GCS_BATCH_SIZE = 100  # sub-requests per storage batch call
+ARCHIVE_MODE = os.environ.get('ARCHIVE_MODE', 'move').lower()  # 'move' to processed/ or 'tag' in place
+PROCESSED_MARKER_KEY = 'bq-loader-processed-at'
+PROCESSED_TABLE_KEY = 'bq-loader-table'
+PARTITION_SCOPED_OVERRIDE = os.environ.get('PARTITION_SCOPED_OVERRIDE', 'true').lower() == 'true'
+PARTITION_REPLACE_MAX = int(os.environ.get('PARTITION_REPLACE_MAX', '500'))  # partitions one load may overwrite
+PARTITION_DECORATOR_FORMATS = {'HOUR': '%Y%m%d%H', 'DAY': '%Y%m%d', 'MONTH': '%Y%m', 'YEAR': '%Y'}
+CREDENTIAL_REFRESH_MARGIN_SECONDS = int(os.environ.get('CREDENTIAL_REFRESH_MARGIN_SECONDS', '300'))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '32'))
+DATASET_CACHE_TTL_SECONDS = int(os.environ.get('DATASET_CACHE_TTL_SECONDS', '300'))
+DATASET_CACHE_MAX_ENTRIES = int(os.environ.get('DATASET_CACHE_MAX_ENTRIES', '128'))
+NOTIFY_ASYNC = os.environ.get('NOTIFY_ASYNC', 'true').lower() == 'true'
+NOTIFY_QUEUE_SIZE = int(os.environ.get('NOTIFY_QUEUE_SIZE', '100'))
+NOTIFY_DRAIN_SECONDS = float(os.environ.get('NOTIFY_DRAIN_SECONDS', '10'))
+SENDGRID_SEND_URL = 'https://api.sendgrid.com/v3/mail/send'
+SENDGRID_TIMEOUT_SECONDS = 10
+NOTIFY_DIGEST_WINDOW_SECONDS = int(os.environ.get('NOTIFY_DIGEST_WINDOW_SECONDS', '300'))
+NOTIFY_DEDUP_SECONDS = int(os.environ.get('NOTIFY_DEDUP_SECONDS', '3600'))
+NOTIFY_RATE_PER_MINUTE = int(os.environ.get('NOTIFY_RATE_PER_MINUTE', '20'))
+NOTIFY_OUTBOX_DIR = os.environ.get('NOTIFY_OUTBOX_DIR', '')  # write messages here instead of calling SendGrid
+# Digests still open when a request ends are kept here until run_scheduled_maintenance sends them;
+# without either they are sent before the request returns
+NOTIFY_DIGEST_BUCKET = os.environ.get('NOTIFY_DIGEST_BUCKET', '')
+NOTIFY_DIGEST_PREFIX = os.environ.get('NOTIFY_DIGEST_PREFIX', 'notify_digests/')
+NOTIFY_DIGEST_DIR = os.environ.get('NOTIFY_DIGEST_DIR', '')  # local stand-in for persisted digests
+
+# Process-wide GCP client registry, reused across warm invocations
+_client_lock = threading.Lock()
+_credentials = None
+_credentials_project_id = None
+_http_session = None
+_storage_client = None
+_bq_client = None
+_client_stats = {'created': 0, 'reused': 0, 'credential_refreshes': 0}
+
+# Background notification dispatcher, kept across warm invocations
+_notify_lock = threading.Lock()
+_notify_queue: 'queue.Queue[Dict[str, Any]]' = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+_notify_worker: Optional[threading.Thread] = None
+_sendgrid_session = None
+_notify_stats = {'enqueued': 0, 'sent': 0, 'failed': 0, 'sent_inline': 0, 'max_queue_depth': 0,
+                 'total_send_ms': 0.0, 'max_send_ms': 0.0, 'total_wait_ms': 0.0,
+                 'deduplicated': 0, 'digested': 0, 'rate_limited': 0, 'digests_sent': 0}
+
+# Notification digests keyed by (recipients, category), recent message fingerprints and the send rate bucket
+_digest_lock = threading.Lock()
+_digests: Dict[Tuple[Tuple[str, ...], str], Dict[str, Any]] = {}
+_recent_fingerprints: 'OrderedDict[str, float]' = OrderedDict()
+_rate_tokens = float(NOTIFY_RATE_PER_MINUTE)
+_rate_updated_at = time.monotonic()
+
+# Per-invocation GCS metadata cache and API call counter
+_blob_cache_lock = threading.Lock()
+_blob_metadata_cache: Dict[str, Optional[storage.Blob]] = {}
+_gcs_call_count = 0
+_invocation_deadline: Optional[float] = None
+
+# Retry counters, kept across warm invocations
+_retry_lock = threading.Lock()
+_retry_stats = {'attempts': 0, 'retries': 0, 'skipped_for_deadline': 0, 'exhausted': 0, 'sleep_seconds': 0.0, 'by_class': {}}
+
+# Dataset metadata cache (TTL + LRU), kept across warm invocations
+_dataset_cache_lock = threading.Lock()
+_dataset_cache: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+
+# Parsed table schemas from the schema registry, kept across warm invocations
+_schema_cache_lock = threading.Lock()
+_schema_cache: Dict[str, Tuple[float, Optional[List[bigquery.SchemaField]], Optional[Dict[str, Any]]]] = {}
 
 
 def _get_secret(project_id: str, secret_id: str) -> str:
@@ -40,6 +209,7 @@ def _get_secret(project_id: str, secret_id: str) -> str:
     global _secret_client
     try:
         if _secret_client is None:
+            from google.cloud import secretmanager
             _secret_client = secretmanager.SecretManagerServiceClient()
         name = f"projects/{project_id}/secrets/{secret_id}/versions/latest"
         secret_value = _secret_client.access_secret_version(request={"name": name}).payload.data.decode("UTF-8")
@@ -65,7 +235,7 @@ def _load_secrets(project_id: Optional[str] = None) -> None:
     
     if not project_id:
         try:
-            _, project_id = default()
+            _, project_id = get_gcp_credentials()
         except Exception as e:
             return 'OK'
     
@@ -117,6 +287,13 @@ class QuotaExceededError(Exception):
     pass
 
 
+class QuotaDeferredError(QuotaExceededError):
+    """Raised when a load is held back because it would exceed the load-job quota"""
+    def __init__(self, message: str, until_reset: bool = False):
+        super().__init__(message)
+        self.until_reset = until_reset  # only the next daily reset can admit it
+
+
 class MemoryLimitError(Exception):
     """Raised when memory limits are exceeded"""
     pass
@@ -137,53 +314,293 @@ class SecretError(Exception):
 
 
 
-def retry_on_failure(max_retries: int = MAX_RETRIES, delay: int = RETRY_DELAY):
-    """Decorator to retry function calls on failure"""
+def _credentials_need_refresh(credentials) -> bool:
+    """Check if credentials are missing a token or close to expiry"""
+    if not getattr(credentials, 'token', None):
+        return True
+    expiry = getattr(credentials, 'expiry', None)
+    if expiry is None:
+        return False
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return expiry - now <= timedelta(seconds=CREDENTIAL_REFRESH_MARGIN_SECONDS)
+
+
+def get_gcp_credentials():
+    """Return cached default credentials and project, refreshing only when close to expiry"""
+    global _credentials, _credentials_project_id
+    with _client_lock:
+        try:
+            if _credentials is None:
+                _credentials, _credentials_project_id = default()
+            if _credentials_need_refresh(_credentials):
+                from google.auth.transport.requests import Request as AuthRequest
+                _credentials.refresh(AuthRequest())
+                _client_stats['credential_refreshes'] += 1
+        except RefreshError as e:
+            raise GoogleAuthError(f"Failed to refresh expired credentials: {str(e)}")
+        except GoogleAuthError as e:
+            raise GoogleAuthError(f"Failed to authenticate with GCP: {str(e)}")
+        return _credentials, _credentials_project_id
+
+
+def _get_http_session(credentials) -> AuthorizedSession:
+    """Return a shared authorized HTTP session with a pooled connection adapter"""
+    global _http_session
+    if _http_session is None:
+        from google.auth.transport.requests import AuthorizedSession
+        from requests.adapters import HTTPAdapter
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        _http_session = session
+    return _http_session
+
+
+def get_storage_client(project_id: Optional[str] = None) -> storage.Client:
+    """Return the process-wide storage client, creating it on first use"""
+    global _storage_client
+    credentials, default_project = get_gcp_credentials()
+    with _client_lock:
+        if _storage_client is None:
+            try:
+                _storage_client = storage.Client(
+                    project=project_id or default_project,
+                    credentials=credentials,
+                    _http=_get_http_session(credentials)
+                )
+            except Exception as e:
+                raise ConnectionError(f"Failed to initialize storage client: {str(e)}")
+            _client_stats['created'] += 1
+        else:
+            _client_stats['reused'] += 1
+        return _storage_client
+
+
+def get_bigquery_client(project_id: Optional[str] = None) -> bigquery.Client:
+    """Return the process-wide BigQuery client, creating it on first use"""
+    global _bq_client
+    credentials, default_project = get_gcp_credentials()
+    with _client_lock:
+        if _bq_client is None:
+            try:
+                _bq_client = bigquery.Client(
+                    project=project_id or default_project,
+                    credentials=credentials,
+                    _http=_get_http_session(credentials)
+                )
+            except Exception as e:
+                raise ConnectionError(f"Failed to initialize BigQuery client: {str(e)}")
+            _client_stats['created'] += 1
+        else:
+            _client_stats['reused'] += 1
+        return _bq_client
+
+
+def get_client_stats() -> Dict[str, int]:
+    """Return counts of clients created versus reused by this instance"""
+    with _client_lock:
+        return dict(_client_stats)
+
+
+def reset_clients() -> None:
+    """Drop cached credentials and clients so the next call rebuilds them"""
+    global _credentials, _credentials_project_id, _http_session, _storage_client, _bq_client
+    with _client_lock:
+        if _http_session is not None:
+            _http_session.close()
+        _credentials = None
+        _credentials_project_id = None
+        _http_session = None
+        _storage_client = None
+        _bq_client = None
+
+
+
+def reset_invocation_state() -> None:
+    """Clear per-invocation caches and counters and start the invocation deadline"""
+    global _gcs_call_count, _invocation_deadline
+    with _blob_cache_lock:
+        _blob_metadata_cache.clear()
+        _gcs_call_count = 0
+        _invocation_deadline = time.monotonic() + TIMEOUT_SECONDS
+
+
+def remaining_time() -> float:
+    """Seconds left before the function times out, less the reserve for post-load stages"""
+    if _invocation_deadline is None:
+        return float('inf')
+    return _invocation_deadline - time.monotonic() - DEADLINE_RESERVE_SECONDS
+
+
+def count_gcs_call(calls: int = 1) -> None:
+    """Record GCS API calls made during the current invocation"""
+    global _gcs_call_count
+    with _blob_cache_lock:
+        _gcs_call_count += calls
+
+
+def get_gcs_call_count() -> int:
+    """Return the number of GCS API calls made during the current invocation"""
+    with _blob_cache_lock:
+        return _gcs_call_count
+
+
+def get_blob_metadata(storage_client: storage.Client, bucket_name: str, file_path: str) -> Optional[storage.Blob]:
+    """Fetch blob metadata once per invocation. Returns None if the object does not exist."""
+    key = f"gs://{bucket_name}/{file_path}"
+    with _blob_cache_lock:
+        if key in _blob_metadata_cache:
+            return _blob_metadata_cache[key]
+    count_gcs_call()
+    blob = storage_client.bucket(bucket_name).get_blob(file_path)
+    with _blob_cache_lock:
+        _blob_metadata_cache[key] = blob
+    return blob
+
+
+def cache_blob_metadata(bucket_name: str, blob: storage.Blob) -> None:
+    """Seed the metadata cache with a blob already returned by a list call"""
+    with _blob_cache_lock:
+        _blob_metadata_cache[f"gs://{bucket_name}/{blob.name}"] = blob
+
+
+def invalidate_blob_metadata(bucket_name: str, file_path: str) -> None:
+    """Drop a cached metadata snapshot after the object has been changed"""
+    with _blob_cache_lock:
+        _blob_metadata_cache.pop(f"gs://{bucket_name}/{file_path}", None)
+
+
+def _dataset_cache_key(dataset_id: str, project_id: str) -> str:
+    return f"{project_id}.{dataset_id}"
+
+
+def _get_dataset_cache_entry(dataset_id: str, project_id: str) -> Optional[Dict[str, Any]]:
+    """Return a fresh cache entry for the dataset, evicting it if the TTL has passed"""
+    key = _dataset_cache_key(dataset_id, project_id)
+    with _dataset_cache_lock:
+        entry = _dataset_cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['fetched_at'] > DATASET_CACHE_TTL_SECONDS:
+            del _dataset_cache[key]
+            return None
+        _dataset_cache.move_to_end(key)
+        return entry
+
+
+def get_cached_dataset(bq_client: bigquery.Client, dataset_id: str, project_id: str) -> bigquery.Dataset:
+    """Fetch dataset metadata, served from the TTL cache when possible"""
+    entry = _get_dataset_cache_entry(dataset_id, project_id)
+    if entry is not None:
+        return entry['dataset']
+    try:
+        dataset = bq_client.get_dataset(bq_client.dataset(dataset_id, project=project_id))
+    except (NotFound, Forbidden):
+        invalidate_dataset_cache(dataset_id, project_id)
+        raise
+    key = _dataset_cache_key(dataset_id, project_id)
+    with _dataset_cache_lock:
+        _dataset_cache[key] = {
+            'dataset': dataset,
+            'location': dataset.location,
+            'access_verified': False,
+            'fetched_at': time.monotonic(),
+        }
+        _dataset_cache.move_to_end(key)
+        while len(_dataset_cache) > DATASET_CACHE_MAX_ENTRIES:
+            _dataset_cache.popitem(last=False)
+    return dataset
+
+
+def mark_dataset_access_verified(dataset_id: str, project_id: str) -> None:
+    """Record that table listing succeeded for a cached dataset"""
+    with _dataset_cache_lock:
+        entry = _dataset_cache.get(_dataset_cache_key(dataset_id, project_id))
+        if entry is not None:
+            entry['access_verified'] = True
+
+
+def invalidate_dataset_cache(dataset_id: str, project_id: str) -> None:
+    """Drop cached metadata for a dataset, e.g. after NotFound or Forbidden"""
+    with _dataset_cache_lock:
+        _dataset_cache.pop(_dataset_cache_key(dataset_id, project_id), None)
+
+
+def classify_error(error: Exception) -> str:
+    """Classify an error for retrying: 'quota', 'server', 'network' or 'fatal'"""
+    if isinstance(error, (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted)):
+        return 'quota'
+    if isinstance(error, (GoogleCloudError, api_exceptions.GoogleAPICallError)) and is_quota_error(error):
+        return 'quota'
+    if isinstance(error, (api_exceptions.InternalServerError, api_exceptions.BadGateway,
+                          api_exceptions.ServiceUnavailable, api_exceptions.GatewayTimeout)):
+        return 'server'
+    if isinstance(error, (ConnectionError, TimeoutError, socket.timeout, requests.exceptions.RequestException)):
+        return 'network'
+    return 'fatal'
+
+
+def _record_retry(stat: str, error_class: Optional[str] = None, slept: float = 0.0) -> None:
+    with _retry_lock:
+        _retry_stats[stat] += 1
+        _retry_stats['sleep_seconds'] += slept
+        if error_class:
+            _retry_stats['by_class'][error_class] = _retry_stats['by_class'].get(error_class, 0) + 1
+
+
+def get_retry_stats() -> Dict[str, Any]:
+    """Return retry counters and total time spent sleeping between attempts"""
+    with _retry_lock:
+        stats = dict(_retry_stats, by_class=dict(_retry_stats['by_class']))
+    stats['sleep_seconds'] = round(stats['sleep_seconds'], 2)
+    return stats
+
+
+def retry_on_failure(max_retries: int = MAX_RETRIES, delay: int = RETRY_DELAY, max_delay: int = RETRY_MAX_DELAY):
+    """
+    Decorator to retry function calls on transient failures with full-jitter backoff.
+    Quota errors back off twice as long. A retry is skipped if the backoff plus another attempt
+    as long as the last one would not fit in the invocation's remaining time.
+    """
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
-            last_exception = None
             for attempt in range(max_retries):
+                started = time.monotonic()
+                _record_retry('attempts')
                 try:
                     return func(*args, **kwargs)
-                except (GoogleCloudError, ConnectionError, TimeoutError, api_exceptions.InternalServerError, api_exceptions.ServiceUnavailable) as e:
-                    if is_quota_error(e):
-                        wait_time = delay * (2 ** attempt) * 2  
-                        logger.warning(
-                            f"Quota error on attempt {attempt + 1} for {func.__name__}: {str(e)}. "
-                            f"Retrying in {wait_time} seconds..."
-                        )
-                    elif is_network_error(e):
-                        wait_time = delay * (2 ** attempt)  
-                        logger.warning(
-                            f"Network error on attempt {attempt + 1} for {func.__name__}: {str(e)}. "
-                            f"Retrying in {wait_time} seconds..."
-                        )
-                    else:
-                        wait_time = delay * (2 ** attempt)
-                        logger.warning(
-                            f"Attempt {attempt + 1} failed for {func.__name__}: {str(e)}. "
-                            f"Retrying in {wait_time} seconds..."
-                        )
-                    
-                    last_exception = e
-                    if attempt < max_retries - 1:
-                        time.sleep(wait_time)
-                    else:
+                except Exception as e:
+                    error_class = classify_error(e)
+                    if error_class == 'fatal':
+                        logger.error(f"Non-retryable error in {func.__name__}: {str(e)}")
+                        raise
+                    if attempt >= max_retries - 1:
+                        _record_retry('exhausted', error_class)
                         logger.error(f"All {max_retries} attempts failed for {func.__name__}")
-                        if is_quota_error(e):
-                            logger.error(f"Quota exceeded after {max_retries} attempts: {str(e)}")
+                        if error_class == 'quota':
                             raise QuotaExceededError(f"All retries failed for {func.__name__}: {str(e)}")
-                except (PermissionError, ConfigValidationError, FileNotFoundError, DataLoadError, 
-                        TableConflictError, InvalidCSVFormatError, MemoryLimitError, Forbidden, NotFound, SecretError) as e:
-                    logger.error(f"Non-retryable error in {func.__name__}: {str(e)}")
-                    raise e 
-                except Exception as e:
-                    logger.error(f"Unexpected error in {func.__name__}: {str(e)}")
-                    raise e 
-            if last_exception:
-                logger.error(f"All retries exhausted for {func.__name__}: {str(last_exception)}")
-                raise last_exception
+                        raise
+
+                    base = delay * 2 if error_class == 'quota' else delay
+                    wait_time = random.uniform(0, min(max_delay, base * (2 ** attempt)))
+                    attempt_seconds = time.monotonic() - started
+                    if wait_time + attempt_seconds > remaining_time():
+                        _record_retry('skipped_for_deadline', error_class)
+                        logger.error(
+                            f"Not retrying {func.__name__} after {error_class} error: {remaining_time():.0f}s left, "
+                            f"next attempt needs about {wait_time + attempt_seconds:.0f}s"
+                        )
+                        if error_class == 'quota':
+                            raise QuotaExceededError(f"Out of time to retry {func.__name__}: {str(e)}")
+                        raise
+
+                    logger.warning(
+                        f"{error_class.capitalize()} error on attempt {attempt + 1} for {func.__name__}: {str(e)}. "
+                        f"Retrying in {wait_time:.1f} seconds..."
+                    )
+                    _record_retry('retries', error_class, slept=wait_time)
+                    time.sleep(wait_time)
             raise DataLoadError(f"{func.__name__} failed after all retries without a specific exception.")
         return wrapper
     return decorator
@@ -211,6 +628,43 @@ def validate_dataset_name(dataset_id: str) -> bool:
     return re.match(pattern, dataset_id) is not None
 
 
+def validate_file_location(file_location: Union[str, List[str]]) -> bool:
+    """Validate a file_location value: a GCS URI or a list of GCS URIs"""
+    locations = file_location if isinstance(file_location, list) else [file_location]
+    if not locations or not all(loc and isinstance(loc, str) for loc in locations):
+        raise ConfigValidationError("file_location must be a non-empty string or list of strings")
+    
+    for location in locations:
+        if not validate_gcs_uri(location):
+            raise ConfigValidationError(f"Invalid GCS URI format for file_location: {location}")
+    return True
+
+
+def validate_targets(targets: List[Dict[str, Any]]) -> bool:
+    """Validate the (file, table) targets of a multi-table config"""
+    if not isinstance(targets, list) or not targets:
+        raise ConfigValidationError("targets must be a non-empty list")
+    
+    seen_tables = set()
+    for target in targets:
+        if not isinstance(target, dict) or not target.get('tablename'):
+            raise ConfigValidationError("Each target must be an object with a tablename")
+        validate_file_location(target.get('file_location'))
+        
+        dataset_id = target.get('dataset')
+        if dataset_id is not None and not validate_dataset_name(dataset_id):
+            raise ConfigValidationError(f"Invalid dataset name format: {dataset_id}")
+        for flag in ('override', 'is_header'):
+            if not isinstance(target.get(flag, True), bool):
+                raise ConfigValidationError(f"{flag} must be a boolean in target {target['tablename']}")
+        
+        table_key = (dataset_id, validate_table_name(target['tablename']))
+        if table_key in seen_tables:
+            raise ConfigValidationError(f"Table {target['tablename']} appears in more than one target")
+        seen_tables.add(table_key)
+    return True
+
+
 def validate_config(config: Dict[str, Any]) -> bool:
     """Validate config file structure and values"""
     # required_fields = ['file_location', 'dataset', 'email']
@@ -220,6 +674,7 @@ def validate_config(config: Dict[str, Any]) -> bool:
     #     raise ConfigValidationError(f"Missing required fields in config: {', '.join(missing_fields)}")
     
     email = config.get('email')
+    email_list = []
 
     if email:
         email_list = [e.strip() for e in str(email).split(',') if e.strip()]
@@ -233,12 +688,11 @@ def validate_config(config: Dict[str, Any]) -> bool:
     if not validate_dataset_name(dataset_id):
         raise ConfigValidationError(f"Invalid dataset name format: {dataset_id}")
     
-    file_location = config.get('file_location')
-    if not file_location or not isinstance(file_location, str):
-        raise ConfigValidationError("file_location must be a non-empty string")
-    
-    if not validate_gcs_uri(file_location):
-        raise ConfigValidationError(f"Invalid GCS URI format for file_location: {file_location}")
+    targets = config.get('targets')
+    if targets is not None:
+        validate_targets(targets)
+    else:
+        validate_file_location(config.get('file_location'))
     
     override = config.get('override', True)
     if not isinstance(override, bool):
@@ -248,14 +702,50 @@ def validate_config(config: Dict[str, Any]) -> bool:
     if not isinstance(is_header, bool):
         raise ConfigValidationError("is_header must be a boolean")
     
+    async_load = config.get('async_load', ASYNC_LOAD_ENABLED)
+    if not isinstance(async_load, bool):
+        raise ConfigValidationError("async_load must be a boolean")
+    
+    full_validation = config.get('full_validation', CSV_FULL_VALIDATION)
+    if not isinstance(full_validation, bool):
+        raise ConfigValidationError("full_validation must be a boolean")
+    
+    transcode = config.get('transcode_parquet', PARQUET_TRANSCODE_ENABLED)
+    if not isinstance(transcode, bool):
+        raise ConfigValidationError("transcode_parquet must be a boolean")
+    
+    force_reload = config.get('force_reload', False)
+    if not isinstance(force_reload, bool):
+        raise ConfigValidationError("force_reload must be a boolean")
+    
+    for merge_keys in [config.get('merge_keys')] + [t.get('merge_keys') for t in (targets or [])]:
+        if merge_keys is not None and (
+            not isinstance(merge_keys, list) or not merge_keys
+            or not all(isinstance(k, str) and re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', k) for k in merge_keys)
+        ):
+            raise ConfigValidationError("merge_keys must be a non-empty list of column names")
+    
+    for schema in [config.get('schema')] + [t.get('schema') for t in (targets or [])]:
+        if schema is not None and not isinstance(schema, (str, list)):
+            raise ConfigValidationError("schema must be a registry name or a list of field definitions")
+    
+    for table_options in [config.get('table_options')] + [t.get('table_options') for t in (targets or [])]:
+        parse_table_options(table_options)
+    
+    batch_window = config.get('batch_window_seconds', MICRO_BATCH_WINDOW_SECONDS)
+    if isinstance(batch_window, bool) or not isinstance(batch_window, int) or batch_window < 0:
+        raise ConfigValidationError("batch_window_seconds must be a non-negative integer")
+    batch_max = config.get('batch_max_configs', MICRO_BATCH_MAX_CONFIGS)
+    if isinstance(batch_max, bool) or not isinstance(batch_max, int) or batch_max < 1:
+        raise ConfigValidationError("batch_max_configs must be a positive integer")
+    
     return True
 
 
 def check_dataset_exists(bq_client: bigquery.Client, dataset_id: str, project_id: str) -> bool:
     """Check if BigQuery dataset exists"""
     try:
-        dataset_ref = bq_client.dataset(dataset_id, project=project_id)
-        bq_client.get_dataset(dataset_ref)
+        get_cached_dataset(bq_client, dataset_id, project_id)
         return True
     except NotFound:
         raise ConfigValidationError(f"Dataset {dataset_id} does not exist in project {project_id}")
@@ -269,7 +759,9 @@ def check_dataset_exists(bq_client: bigquery.Client, dataset_id: str, project_id
 def check_file_size(blob: storage.Blob, max_size_mb: int = MAX_FILE_SIZE_MB) -> bool:
     """Validate file size is within limits"""
     try:
-        blob.reload()
+        if blob.size is None:
+            count_gcs_call()
+            blob.reload()
         size_mb = blob.size / (1024 * 1024)
         if size_mb > max_size_mb:
             raise FileProcessingError(f"File size {size_mb:.2f} MB exceeds maximum allowed size {max_size_mb} MB")
@@ -298,12 +790,12 @@ def check_bucket_exists(storage_client: storage.Client, bucket_name: str) -> boo
 def check_file_permissions(storage_client: storage.Client, bucket_name: str, file_path: str) -> bool:
     """Check if file is accessible and has read permissions"""
     try:
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_path)
-        if not blob.exists():
+        blob = get_blob_metadata(storage_client, bucket_name, file_path)
+        if blob is None:
             raise FileNotFoundError(f"File not found: gs://{bucket_name}/{file_path}")
-        blob.reload()
         return True
+    except FileNotFoundError:
+        raise
     except Forbidden:
         raise PermissionError(f"Permission denied accessing file: gs://{bucket_name}/{file_path}")
     except NotFound:
@@ -313,13 +805,18 @@ def check_file_permissions(storage_client: storage.Client, bucket_name: str, fil
         raise FileProcessingError(f"Error checking file permissions: {str(e)}")
 
 
+def is_marked_processed(blob: Optional[storage.Blob]) -> bool:
+    """Check whether an object carries the processed marker written by tag archival"""
+    return blob is not None and PROCESSED_MARKER_KEY in (blob.metadata or {})
+
+
 def check_file_already_processed(storage_client: storage.Client, bucket_name: str, file_path: str) -> bool:
-    """Check if file has already been processed (exists in processed folder)"""
+    """Check if file has already been processed (exists in processed folder or is tagged as processed)"""
     try:
+        if is_marked_processed(get_blob_metadata(storage_client, bucket_name, file_path)):
+            return True
         processed_path = f"processed/{os.path.basename(file_path)}"
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(processed_path)
-        return blob.exists()
+        return get_blob_metadata(storage_client, bucket_name, processed_path) is not None
     except Exception as e:
         logger.warning(f"Error checking if file already processed: {str(e)}")
         return False
@@ -329,9 +826,16 @@ def check_file_already_processed(storage_client: storage.Client, bucket_name: st
 def check_bigquery_permissions(bq_client: bigquery.Client, dataset_id: str, project_id: str) -> bool:
     """Check if we have necessary BigQuery permissions"""
     try:
-        dataset_ref = bq_client.dataset(dataset_id, project=project_id)
-        bq_client.get_dataset(dataset_ref)
-        list(bq_client.list_tables(dataset_ref, max_results=1))
+        entry = _get_dataset_cache_entry(dataset_id, project_id)
+        if entry is not None and entry['access_verified']:
+            return True
+        dataset = get_cached_dataset(bq_client, dataset_id, project_id)
+        try:
+            list(bq_client.list_tables(dataset.reference, max_results=1))
+        except (NotFound, Forbidden):
+            invalidate_dataset_cache(dataset_id, project_id)
+            raise
+        mark_dataset_access_verified(dataset_id, project_id)
         return True
     except Forbidden:
         raise PermissionError(f"Insufficient permissions for dataset {dataset_id} in project {project_id}")
@@ -409,11 +913,70 @@ def validate_gcs_uri(uri: str) -> bool:
     return True
 
 
+def parse_gcs_uri(uri: str) -> Tuple[str, str]:
+    """Split a GCS URI into bucket name and object path"""
+    if uri.startswith('gs://'):
+        uri = uri[5:]
+    parts = uri.split('/', 1)
+    if not parts or not parts[0]:
+        raise ConfigValidationError("Invalid file_location format: missing bucket name")
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+
+def is_multi_source(file_location: Union[str, List[str]]) -> bool:
+    """Check if file_location names a list, prefix or wildcard rather than a single folder"""
+    return isinstance(file_location, list) or '*' in file_location
+
+
+def expand_source_uris(storage_client: storage.Client, file_location: Union[str, List[str]]) -> List[storage.Blob]:
+    """
+    Resolve a list of URIs, prefixes (entries ending in '/') and '*' wildcards to concrete objects.
+    Config files, anything under processed/ and objects tagged as processed are never matched.
+    """
+    specs = file_location if isinstance(file_location, list) else [file_location]
+    matched: Dict[str, storage.Blob] = {}
+
+    for spec in specs:
+        bucket_name, path = parse_gcs_uri(spec)
+        if '*' in path:
+            prefix, pattern = path.split('*', 1)[0], path
+        elif not path or path.endswith('/'):
+            prefix, pattern = path, None
+        else:
+            blob = get_blob_metadata(storage_client, bucket_name, path)
+            if blob is None:
+                raise FileNotFoundError(f"Data file not found: gs://{bucket_name}/{path}")
+            if is_marked_processed(blob):
+                raise FileNotFoundError(f"Data file already processed: gs://{bucket_name}/{path}")
+            matched[f"gs://{bucket_name}/{path}"] = blob
+            continue
+
+        count_gcs_call()
+        for blob in storage_client.list_blobs(bucket_name, prefix=prefix):
+            name = blob.name
+            if name.endswith('/') or name.lower().endswith('_config.json') or "processed/" in name.lower():
+                continue
+            if name.startswith((LOAD_LEDGER_PREFIX, PENDING_JOBS_PREFIX, LOAD_STATS_PREFIX, PARQUET_STAGING_PREFIX, CHECKPOINT_PREFIX, SHARD_PREFIX, COMPACT_PREFIX, MICRO_BATCH_PREFIX,
+                                QUOTA_LEDGER_PREFIX)):
+                continue  # this function's own bookkeeping objects
+            if pattern and not fnmatch.fnmatchcase(name, pattern):
+                continue
+            if is_marked_processed(blob):
+                continue
+            cache_blob_metadata(bucket_name, blob)
+            matched[f"gs://{bucket_name}/{name}"] = blob
+
+    if len(matched) > MAX_SOURCE_URIS:
+        raise ConfigValidationError(
+            f"file_location matched {len(matched)} files, more than the {MAX_SOURCE_URIS} allowed in one load job"
+        )
+    return [matched[uri] for uri in sorted(matched)]
+
+
 def validate_dataset_location(bq_client: bigquery.Client, dataset_id: str, project_id: str, expected_location: str = None) -> bool:
     """Validate dataset location matches expected location"""
     try:
-        dataset_ref = bq_client.dataset(dataset_id, project=project_id)
-        dataset = bq_client.get_dataset(dataset_ref)
+        dataset = get_cached_dataset(bq_client, dataset_id, project_id)
         
         if expected_location and dataset.location.lower() != expected_location.lower():
             logger.warning(
@@ -435,6 +998,7 @@ def validate_csv_basic_format(blob: storage.Blob) -> bool:
         if sample_size == 0:
             raise InvalidCSVFormatError("CSV file is empty")
         
+        count_gcs_call()
         sample = blob.download_as_bytes(start=0, end=sample_size)
         sample_text = sample.decode('utf-8', errors='ignore')
         
@@ -460,198 +1024,3297 @@ def validate_csv_basic_format(blob: storage.Blob) -> bool:
         return False
 
 
-@retry_on_failure()
-def load_data_to_bigquery(
-    bq_client: bigquery.Client,
-    gcs_uri: str,
-    dataset_id: str,
-    table_name: str,
-    project_id: str,
-    is_header: bool,
-    override: bool,
-    timeout: int = TIMEOUT_SECONDS
-) -> bigquery.LoadJob:
-    """Load data from GCS to BigQuery with retry logic"""
+def _local_schema_dirs() -> List[str]:
+    """Directories searched for registry schemas: SCHEMA_DIR, then schemas/ beside or above this module"""
+    if SCHEMA_DIR:
+        return [SCHEMA_DIR]
+    here = os.path.dirname(os.path.abspath(__file__))
+    return [os.path.join(here, 'schemas'), os.path.join(here, '..', 'schemas')]
+
+
+def parse_schema(fields: List[Dict[str, Any]]) -> List[bigquery.SchemaField]:
+    """Convert a JSON schema definition (the format used in schemas/) into SchemaFields"""
+    if not isinstance(fields, list) or not fields:
+        raise ConfigValidationError("Schema must be a non-empty list of field definitions")
     try:
-        check_dataset_exists(bq_client, dataset_id, project_id)
-        check_bigquery_permissions(bq_client, dataset_id, project_id)
-        
-        table_ref = bq_client.dataset(dataset_id, project=project_id).table(table_name)
+        return [bigquery.SchemaField.from_api_repr(field) for field in fields]
+    except (KeyError, TypeError, ValueError, AttributeError) as e:
+        raise ConfigValidationError(f"Invalid schema definition: {str(e)}")
 
-        if override:
-            try:
-                bq_client.delete_table(table_ref, not_found_ok=True)
-                logger.info(f"Deleted existing table {dataset_id}.{table_name} for replacement (override=True)")
-            except Exception as e:
-                logger.warning(f"Could not delete table {dataset_id}.{table_name} before replacement: {str(e)}. Will use WRITE_TRUNCATE instead.")
 
-        skip_leading_rows = 1 if is_header else 0
-        
-        job_config = bigquery.LoadJobConfig(
-            source_format=bigquery.SourceFormat.CSV,
-            skip_leading_rows=skip_leading_rows,
-            autodetect=True,
-            write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE if override else bigquery.WriteDisposition.WRITE_APPEND,
-            max_bad_records=10,
-            ignore_unknown_values=False,
-            allow_quoted_newlines=True,
-            allow_jagged_rows=False,
-        )
-        
-        logger.info(f"Starting BigQuery load job for {gcs_uri} -> {dataset_id}.{table_name}")
-        
-        load_job = bq_client.load_table_from_uri(
-            gcs_uri,
-            table_ref,
-            job_config=job_config
+def parse_table_options(raw: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Convert a table_options block into LoadJobConfig attributes:
+    time_partitioning {type, field, expiration_days}, range_partitioning {field, start, end, interval}
+    and clustering_fields (up to 4 columns).
+    """
+    if raw is None:
+        return None
+    if not isinstance(raw, dict):
+        raise ConfigValidationError("table_options must be an object")
+    unknown = set(raw) - {'time_partitioning', 'range_partitioning', 'clustering_fields'}
+    if unknown:
+        raise ConfigValidationError(f"Unknown table_options: {sorted(unknown)}")
+    column = r'^[A-Za-z_][A-Za-z0-9_]*$'
+    options = {}
+
+    time_partitioning = raw.get('time_partitioning')
+    if time_partitioning is not None:
+        if not isinstance(time_partitioning, dict):
+            raise ConfigValidationError("time_partitioning must be an object")
+        partition_type = str(time_partitioning.get('type', 'DAY')).upper()
+        if partition_type not in PARTITION_DECORATOR_FORMATS:
+            raise ConfigValidationError(f"time_partitioning type must be one of {list(PARTITION_DECORATOR_FORMATS)}")
+        field = time_partitioning.get('field')
+        if field is not None and not (isinstance(field, str) and re.match(column, field)):
+            raise ConfigValidationError("time_partitioning field must be a column name")
+        expiration_days = time_partitioning.get('expiration_days')
+        if expiration_days is not None and (
+            isinstance(expiration_days, bool) or not isinstance(expiration_days, (int, float)) or expiration_days <= 0
+        ):
+            raise ConfigValidationError("time_partitioning expiration_days must be a positive number")
+        options['time_partitioning'] = bigquery.TimePartitioning(
+            type_=partition_type,
+            field=field,
+            expiration_ms=int(expiration_days * 86400 * 1000) if expiration_days else None,
         )
-        
-        logger.info(f"BigQuery job ID: {load_job.job_id}")
-        
-        try:
-            load_job.result(timeout=timeout)
-        except (TimeoutError, Exception) as e:
-            try:
-                bq_client.cancel_job(load_job.job_id)
-                logger.warning(f"Cancelled BigQuery job {load_job.job_id} due to timeout or error: {str(e)}")
-            except Exception as cancel_e:
-                logger.error(f"Failed to cancel job {load_job.job_id}: {str(cancel_e)}")
-            raise DataLoadError(f"BigQuery load job exceeded timeout of {timeout} seconds or failed: {str(e)}")
-        
-        load_job.reload()
-        
-        if load_job.state != 'DONE':
-            raise DataLoadError(f"BigQuery job {load_job.job_id} did not complete. State: {load_job.state}")
-        
-        if load_job.error_result:
-            error_message = load_job.error_result.get('message', 'Unknown error')
-            error_details = json.dumps(load_job.error_result, indent=2)
-            logger.error(f"BigQuery job failed: {error_message}")
-            logger.error(f"Error details: {error_details}")
-            
-            if load_job.errors:
-                logger.error(f"Job errors: {json.dumps(load_job.errors, indent=2)}")
-            
-            if is_quota_error(Exception(error_message)):
-                raise QuotaExceededError(f"BigQuery quota exceeded: {error_message}")
-            elif is_schema_mismatch_error(Exception(error_message)):
-                raise InvalidCSVFormatError(
-                    f"Schema mismatch in BigQuery load job {load_job.job_id}: {error_message}. "
-                    f"Please check CSV format and column types."
-                )
-            
-            raise DataLoadError(f"BigQuery load job {load_job.job_id} failed: {error_message}")
-        
-        bad_records = 0
-        if hasattr(load_job, 'output_rows') and load_job.output_rows is not None:
-            if hasattr(load_job, 'statistics') and hasattr(load_job.statistics, 'load') and hasattr(load_job.statistics.load, 'bad_records'):
-                bad_records = load_job.statistics.load.bad_records
-        
-        logger.info(
-            f"Load completed. Rows loaded: {load_job.output_rows}, "
-            f"Bad records: {bad_records}"
+
+    range_partitioning = raw.get('range_partitioning')
+    if range_partitioning is not None:
+        if time_partitioning is not None:
+            raise ConfigValidationError("Only one of time_partitioning and range_partitioning can be set")
+        if not isinstance(range_partitioning, dict) or not (
+            isinstance(range_partitioning.get('field'), str) and re.match(column, range_partitioning['field'])
+        ):
+            raise ConfigValidationError("range_partitioning needs a field column name")
+        bounds = [range_partitioning.get(k) for k in ('start', 'end', 'interval')]
+        if not all(isinstance(b, int) and not isinstance(b, bool) for b in bounds) or bounds[2] <= 0 or bounds[0] >= bounds[1]:
+            raise ConfigValidationError("range_partitioning needs integer start < end and a positive interval")
+        options['range_partitioning'] = bigquery.RangePartitioning(
+            field=range_partitioning['field'],
+            range_=bigquery.PartitionRange(start=bounds[0], end=bounds[1], interval=bounds[2]),
         )
-        
-        if bad_records > 0:
-            logger.warning(f"Warning: {bad_records} bad records were skipped during load")
-        
-        return load_job
-        
-    except (NotFound, Forbidden, GoogleCloudError, api_exceptions.ResourceExhausted) as e:
-        logger.error(f"BigQuery operation failed: {str(e)}")
-        if is_quota_error(e):
-            raise QuotaExceededError(f"BigQuery quota exceeded: {str(e)}")
-        elif isinstance(e, Forbidden):
-            raise PermissionError(f"Permission denied for BigQuery operation: {str(e)}")
-        elif isinstance(e, NotFound):
-            raise ConfigValidationError(f"BigQuery resource not found: {str(e)}")
-        else:
-            raise DataLoadError(f"Google Cloud error during BigQuery load: {str(e)}")
-    except Exception as e:
-        logger.error(f"Unexpected error during BigQuery load: {str(e)}")
-        raise DataLoadError(f"Unexpected error during BigQuery load: {str(e)}")
 
+    clustering_fields = raw.get('clustering_fields')
+    if clustering_fields is not None:
+        if (
+            not isinstance(clustering_fields, list) or not 0 < len(clustering_fields) <= 4
+            or not all(isinstance(c, str) and re.match(column, c) for c in clustering_fields)
+        ):
+            raise ConfigValidationError("clustering_fields must be a list of 1 to 4 column names")
+        options['clustering_fields'] = clustering_fields
 
-def move_file_safely(
+    return options or None
+
+
+def table_options_of(table: Optional[bigquery.Table]) -> Optional[Dict[str, Any]]:
+    """Partitioning and clustering of an existing table, in the form produced by parse_table_options"""
+    if table is None:
+        return None
+    options = {
+        'time_partitioning': table.time_partitioning,
+        'range_partitioning': table.range_partitioning,
+        'clustering_fields': table.clustering_fields,
+    }
+    return {k: v for k, v in options.items() if v} or None
+
+
+def _read_registry_schema(storage_client: storage.Client, name: str) -> Optional[Union[List[Dict[str, Any]], Dict[str, Any]]]:
+    """Read a raw schema definition from a gs:// URI, the local registry or SCHEMA_BUCKET"""
+    if name.startswith('gs://'):
+        bucket_name, path = parse_gcs_uri(name)
+    else:
+        for directory in _local_schema_dirs():
+            local_path = os.path.join(directory, name)
+            if os.path.isfile(local_path):
+                with open(local_path) as f:
+                    return json.load(f)
+        if not SCHEMA_BUCKET:
+            return None
+        bucket_name, path = SCHEMA_BUCKET, f"{SCHEMA_PATH}/{name}" if SCHEMA_PATH else name
+
+    blob = get_blob_metadata(storage_client, bucket_name, path)
+    if blob is None:
+        return None
+    count_gcs_call()
+    return json.loads(blob.download_as_text())
+
+
+def load_registry_entry(
     storage_client: storage.Client,
-    bucket_name: str,
-    source_path: str,
-    dest_bucket: str,
-    dest_path: str,
-    operation_name: str
-) -> None:
-    """Safely move file with error handling"""
+    name: str
+) -> Tuple[Optional[List[bigquery.SchemaField]], Optional[Dict[str, Any]]]:
+    """
+    Return (schema, table_options) registered under name, cached in memory; (None, None) if there is none.
+    Table options live beside the schema as <name>.options.json so the schema file stays a plain field list.
+    """
+    with _schema_cache_lock:
+        cached = _schema_cache.get(name)
+        if cached is not None and time.monotonic() - cached[0] <= SCHEMA_CACHE_TTL_SECONDS:
+            return cached[1], cached[2]
+    options_name = f"{name[:-len('.json')] if name.endswith('.json') else name}.options.json"
     try:
-        bucket = storage_client.bucket(bucket_name)
-        source_blob = bucket.blob(source_path)
-        dest_bucket = storage_client.bucket(dest_bucket)
+        raw = _read_registry_schema(storage_client, name)
+        raw_options = _read_registry_schema(storage_client, options_name)
+    except json.JSONDecodeError as e:
+        raise ConfigValidationError(f"Schema {name} or {options_name} is not valid JSON: {str(e)}")
+    schema = parse_schema(raw) if raw is not None else None
+    options = parse_table_options(raw_options)
+    with _schema_cache_lock:
+        _schema_cache[name] = (time.monotonic(), schema, options)
+    return schema, options
 
-        if not source_blob.exists():
-            logger.warning(f"Source file does not exist: {source_path}, skipping move")
-            return
-        
-        # Copy to destination
-        try:
-            dest_blob = bucket.copy_blob(source_blob, dest_bucket, dest_path)
-        except Forbidden:
-            raise PermissionError(f"Permission denied copying file to {dest_path}")
-        except (ConnectionError, TimeoutError, GoogleCloudError) as e:
-            raise FileProcessingError(f"Network error copying file: {str(e)}")
-        
-        if not dest_blob.exists():
-            raise FileProcessingError(f"Failed to copy file to {dest_path} - destination not found")
-        
-        # Delete source file
-        try:
-            source_blob.delete()
-        except Forbidden:
-            logger.warning(f"Permission denied deleting source file: {source_path}")
-        except (ConnectionError, TimeoutError, GoogleCloudError) as e:
-            logger.warning(f"Network error deleting source file: {str(e)}")
-        except Exception as e:
-            logger.warning(f"Error deleting source file: {str(e)}")
-        
-        logger.info(f"Successfully moved file for {operation_name}: {source_path} -> {dest_path}")
-        
-    except Exception as e:
-        logger.error(f"Error moving file {source_path} to {dest_path}: {str(e)}")
-        raise FileProcessingError(f"Failed to move file: {str(e)}")
 
+def load_registry_schema(storage_client: storage.Client, name: str) -> Optional[List[bigquery.SchemaField]]:
+    """Return the parsed schema registered under name, cached in memory. Returns None if there is none."""
+    return load_registry_entry(storage_client, name)[0]
 
-@retry_on_failure(max_retries=1, delay=5)
-def send_email_notifications(to_email: list, subject: str, content: str, is_error: bool = False, project_id: Optional[str] = None) -> None:
+
+def resolve_table_schema(
+    storage_client: storage.Client,
+    table_name: str,
+    config_schema: Optional[Union[str, List[Dict[str, Any]]]] = None
+) -> Optional[List[bigquery.SchemaField]]:
     """
-    Send email notification about the Cloud Function execution status.
+    Resolve the explicit schema for a load: an inline 'schema' list or a registry name from the config,
+    otherwise <table_name>.json from the registry. Returns None when autodetect should be used.
     """
-    if not EMAIL_ENABLED:
-        logger.info("Skipping email send (EMAIL_ENABLED is False).")
-        return
-    
-    if not to_email:
-        logger.warning("Skipping email send (no recipient email provided).")
-        return
+    if isinstance(config_schema, list):
+        return parse_schema(config_schema)
+    if isinstance(config_schema, str):
+        schema = load_registry_schema(storage_client, config_schema)
+        if schema is None:
+            raise ConfigValidationError(f"Schema {config_schema} not found in schema registry")
+        return schema
+    return load_registry_schema(storage_client, f"{table_name}.json")
 
-    try:
-        _load_secrets(project_id)
-    except SecretError as e:
-        logger.error(f"Secret validation failed: {str(e)}")
-        raise SecretError("Secret validation failed from Secret Manager")
+
+def resolve_table_options(
+    storage_client: storage.Client,
+    table_name: str,
+    config_options: Optional[Dict[str, Any]] = None,
+    config_schema: Optional[Union[str, List[Dict[str, Any]]]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Resolve partitioning and clustering for a load: 'table_options' from the config,
+    otherwise those declared by the registry entry that supplies the schema.
+    """
+    if config_options is not None:
+        return parse_table_options(config_options)
+    if isinstance(config_schema, list):
+        return None
+    return load_registry_entry(storage_client, config_schema or f"{table_name}.json")[1]
+
+
+def _iter_range_lines(blob: storage.Blob, start: int, end: int, stop_event: threading.Event):
+    """
+    Stream (offset, line) pairs for the records that start within [start, end) of the blob.
+    A range that does not start at 0 skips the partial record owned by the previous range.
+    Reads are bounded to CSV_VALIDATION_READ_MB at a time.
+    """
+    read_size = CSV_VALIDATION_READ_MB * 1024 * 1024
+    size = blob.size
+    pos = start - 1 if start > 0 else 0
+    skip_first = start > 0
+    buffer = b''
+    buffer_offset = pos
+
+    while pos < size:
+        if stop_event.is_set():
+            return
+        read_end = min(pos + read_size, size) - 1
+        count_gcs_call()
+        buffer += blob.download_as_bytes(
+            start=pos, end=read_end, checksum=None, if_generation_match=blob.generation
+        )
+        pos = read_end + 1
+
+        line_start = 0
+        while True:
+            newline = buffer.find(b'\n', line_start)
+            if newline == -1:
+                break
+            offset = buffer_offset + line_start
+            line = buffer[line_start:newline + 1]
+            line_start = newline + 1
+            if skip_first:
+                skip_first = False
+                continue
+            if offset >= end:
+                return
+            yield offset, line
+        buffer = buffer[line_start:]
+        buffer_offset += line_start
+
+    if buffer and not skip_first and buffer_offset < end:
+        yield buffer_offset, buffer
+
+
+def _validate_csv_range(
+    blob: storage.Blob,
+    start: int,
+    end: int,
+    expected_columns: int,
+    is_header: bool,
+    stop_event: threading.Event
+) -> Dict[str, Any]:
+    """Parse one byte range of a CSV blob. Returns row and bad-row counts and any quoting error."""
+    result = {'rows': 0, 'bad_rows': 0, 'samples': [], 'quote_error': None}
+
+    def decoded_lines():
+        for offset, raw in _iter_range_lines(blob, start, end, stop_event):
+            if offset == 0 and raw.startswith(codecs.BOM_UTF8):
+                raw = raw[len(codecs.BOM_UTF8):]
+            try:
+                yield raw.decode('utf-8')
+            except UnicodeDecodeError as e:
+                stop_event.set()
+                raise InvalidCSVFormatError(
+                    f"CSV file encoding error in gs://{blob.bucket.name}/{blob.name} "
+                    f"near byte {offset + e.start}: not valid UTF-8"
+                )
+
+    reader = csv.reader(decoded_lines(), strict=True)
+    skip_header = is_header and start == 0
+    try:
+        for row in reader:
+            if skip_header:
+                skip_header = False
+                continue
+            if not row:
+                continue
+            result['rows'] += 1
+            if len(row) != expected_columns:
+                result['bad_rows'] += 1
+                if len(result['samples']) < 3:
+                    result['samples'].append(f"expected {expected_columns} columns, found {len(row)}")
+    except csv.Error as e:
+        result['quote_error'] = str(e)
+    return result
+
+
+def _read_csv_header(blob: storage.Blob) -> List[str]:
+    """Read and parse the first record of a CSV blob"""
+    count_gcs_call()
+    sample = blob.download_as_bytes(start=0, end=min(blob.size, 65536) - 1, checksum=None)
+    if sample.startswith(codecs.BOM_UTF8):
+        sample = sample[len(codecs.BOM_UTF8):]
+    first_line = sample.split(b'\n', 1)[0]
+    try:
+        return next(csv.reader([first_line.decode('utf-8').rstrip('\r')]), [])
+    except UnicodeDecodeError as e:
+        raise InvalidCSVFormatError(f"CSV header encoding error in {blob.name}: {str(e)}")
+
+
+def validate_csv_files(
+    blobs: List[storage.Blob],
+    schema: Optional[List[bigquery.SchemaField]] = None,
+    is_header: bool = True,
+    full: bool = True
+) -> Optional[int]:
+    """
+    Validate the given CSV blobs before any load job is submitted.
+    Each blob is split into newline-aligned byte ranges that are streamed concurrently
+    and checked for encoding, quoting, column count and the header against the schema.
+    With full=False only the header and the first and last CSV_VALIDATION_SAMPLE_MB of each blob are read.
+    Returns the number of data rows for reconciliation against load_job.output_rows, or None when sampled.
+    """
+    chunk_size = CSV_VALIDATION_CHUNK_MB * 1024 * 1024
+    sample_size = CSV_VALIDATION_SAMPLE_MB * 1024 * 1024
+    expected = {}
+    tasks = []
+    for blob in blobs:
+        header = _read_csv_header(blob)
+        if schema is not None:
+            expected[blob.name] = len(schema)
+            if is_header:
+                field_names = [field.name.lower() for field in schema]
+                header_names = [name.strip().lower() for name in header]
+                if header_names != field_names:
+                    raise InvalidCSVFormatError(
+                        f"Header of {blob.name} {header} does not match schema columns {[f.name for f in schema]}"
+                    )
+        else:
+            expected[blob.name] = len(header)
+        if not full and blob.size > 2 * sample_size:
+            tasks.extend([(blob, 0, sample_size), (blob, blob.size - sample_size, blob.size)])
+            continue
+        for start in range(0, blob.size, chunk_size):
+            tasks.append((blob, start, min(start + chunk_size, blob.size)))
+
+    def run_ranges(range_tasks, stop_event):
+        workers = max(1, min(CSV_VALIDATION_WORKERS, len(range_tasks)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_validate_csv_range, blob, start, end, expected[blob.name], is_header, stop_event)
+                for blob, start, end in range_tasks
+            ]
+            return [(task[0], future.result()) for task, future in zip(range_tasks, futures)]
+
+    stop_event = threading.Event()
+    per_blob: Dict[str, Dict[str, Any]] = {}
+    for blob, result in run_ranges(tasks, stop_event):
+        totals = per_blob.setdefault(blob.name, {'blob': blob, 'rows': 0, 'bad_rows': 0, 'samples': [], 'quote_error': None, 'ranges': 0})
+        totals['rows'] += result['rows']
+        totals['bad_rows'] += result['bad_rows']
+        totals['samples'].extend(result['samples'])
+        totals['quote_error'] = totals['quote_error'] or result['quote_error']
+        totals['ranges'] += 1
+
+    # Quoted newlines can straddle a range boundary; confirm suspicious files with one sequential pass.
+    # The pass may use half of the invocation's remaining time. A file it cannot finish in that time
+    # (a sampled 50 GB blob, say) is not rejected on the range findings but left to BigQuery's own
+    # max_bad_records and quoting checks.
+    for name, totals in per_blob.items():
+        if totals['ranges'] > 1 and (totals['quote_error'] or totals['bad_rows'] > MAX_BAD_RECORDS):
+            blob = totals['blob']
+            budget = remaining_time() / 2
+            logger.info(f"Re-validating {name} sequentially (up to {budget:.0f}s) to rule out quoted newlines across ranges")
+            confirm_stop = threading.Event()
+            timer = threading.Timer(budget, confirm_stop.set) if budget != float('inf') else None
+            if budget <= 0:
+                confirm_stop.set()
+            elif timer is not None:
+                timer.daemon = True
+                timer.start()
+            try:
+                _, result = run_ranges([(blob, 0, blob.size)], confirm_stop)[0]
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            if confirm_stop.is_set():
+                logger.warning(
+                    f"Could not re-validate {name} within {budget:.0f}s; leaving its {totals['bad_rows']} suspect rows "
+                    f"to BigQuery's max_bad_records check"
+                )
+                totals.update(bad_rows=0, quote_error=None)
+                continue
+            totals.update(rows=result['rows'], bad_rows=result['bad_rows'], samples=result['samples'], quote_error=result['quote_error'])
+
+    total_rows = 0
+    total_bad = 0
+    for name, totals in per_blob.items():
+        if totals['quote_error']:
+            raise InvalidCSVFormatError(f"Malformed quoting in {name}: {totals['quote_error']}")
+        total_rows += totals['rows']
+        total_bad += totals['bad_rows']
+        if totals['bad_rows']:
+            logger.warning(f"{totals['bad_rows']} rows with the wrong column count in {name}: {totals['samples']}")
+
+    if total_bad > MAX_BAD_RECORDS:
+        raise InvalidCSVFormatError(
+            f"{total_bad} rows have an inconsistent column count, more than the {MAX_BAD_RECORDS} allowed"
+        )
+    if not full:
+        logger.info(f"CSV validation passed on samples of {len(blobs)} file(s), {total_bad} bad rows")
+        return None
+    logger.info(f"CSV validation passed: {total_rows} rows in {len(blobs)} file(s), {total_bad} bad rows")
+    return total_rows
+
+
+def reconcile_row_count(load_job: bigquery.LoadJob, expected_rows: Optional[int]) -> None:
+    """Log a warning when the rows loaded differ from the rows counted by the pre-validator"""
+    if expected_rows is None or load_job.output_rows is None:
+        return
+    if load_job.output_rows != expected_rows:
+        logger.warning(
+            f"Row count mismatch for job {load_job.job_id}: validator counted {expected_rows} rows, "
+            f"BigQuery loaded {load_job.output_rows}"
+        )
+
+
+def _arrow_schema(schema: List[bigquery.SchemaField]):
+    """Map a BigQuery schema to the equivalent pyarrow schema for Parquet output"""
+    import pyarrow as pa
+
+    types = {
+        'STRING': pa.string(),
+        'INTEGER': pa.int64(),
+        'INT64': pa.int64(),
+        'FLOAT': pa.float64(),
+        'FLOAT64': pa.float64(),
+        'NUMERIC': pa.decimal128(38, 9),
+        'BOOLEAN': pa.bool_(),
+        'BOOL': pa.bool_(),
+        'DATE': pa.date32(),
+        'DATETIME': pa.timestamp('us'),
+        'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+        'TIME': pa.time64('us'),
+        'BYTES': pa.binary(),
+    }
+    fields = []
+    for field in schema:
+        arrow_type = types.get(field.field_type.upper())
+        if arrow_type is None:
+            raise ConfigValidationError(f"Column {field.name} of type {field.field_type} cannot be transcoded to Parquet")
+        fields.append(pa.field(field.name, arrow_type, nullable=field.mode != 'REQUIRED'))
+    return pa.schema(fields)
+
+
+def transcode_csv_to_parquet(
+    storage_client: storage.Client,
+    source_bucket: str,
+    source_path: str,
+    schema: Optional[List[bigquery.SchemaField]],
+    is_header: bool
+) -> Dict[str, Any]:
+    """
+    Stream a CSV object from GCS in blocks of PARQUET_BLOCK_SIZE_MB and write a typed Parquet object
+    under PARQUET_STAGING_PREFIX. Returns the staging location and conversion statistics.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ConfigValidationError("Parquet transcoding requires the pyarrow package")
+
+    source_blob = get_blob_metadata(storage_client, source_bucket, source_path)
+    if source_blob is None:
+        raise FileNotFoundError(f"Data file not found: gs://{source_bucket}/{source_path}")
+
+    staging_bucket = PARQUET_STAGING_BUCKET or source_bucket
+    staging_path = f"{PARQUET_STAGING_PREFIX}{source_path.rsplit('.', 1)[0]}.{source_blob.generation}.parquet"
+    staging_blob = storage_client.bucket(staging_bucket).blob(staging_path)
+
+    target_schema = _arrow_schema(schema) if schema is not None else None
+    if target_schema is not None:
+        read_options = pa_csv.ReadOptions(
+            block_size=PARQUET_BLOCK_SIZE_MB * 1024 * 1024,
+            column_names=target_schema.names,
+            skip_rows=1 if is_header else 0
+        )
+        convert_options = pa_csv.ConvertOptions(
+            column_types={field.name: field.type for field in target_schema},
+            strings_can_be_null=True
+        )
+    else:
+        read_options = pa_csv.ReadOptions(
+            block_size=PARQUET_BLOCK_SIZE_MB * 1024 * 1024,
+            autogenerate_column_names=not is_header
+        )
+        convert_options = pa_csv.ConvertOptions(strings_can_be_null=True)
+    parse_options = pa_csv.ParseOptions(newlines_in_values=True)
+
+    started = time.monotonic()
+    rows = 0
+    count_gcs_call(2)
+    try:
+        with source_blob.open('rb', chunk_size=PARQUET_BLOCK_SIZE_MB * 1024 * 1024) as reader, \
+                staging_blob.open('wb', content_type='application/vnd.apache.parquet') as writer:
+            batches = pa_csv.open_csv(reader, read_options=read_options, parse_options=parse_options, convert_options=convert_options)
+            output_schema = target_schema or batches.schema
+            with pq.ParquetWriter(writer, output_schema, compression='snappy') as parquet_writer:
+                for batch in batches:
+                    table = pa.Table.from_batches([batch])
+                    if target_schema is not None:
+                        table = table.cast(target_schema)
+                    parquet_writer.write_table(table)
+                    rows += batch.num_rows
+    except Exception as e:
+        # Closing the writer commits whatever was written, so drop the partial object
+        delete_staging_files(storage_client, [[staging_bucket, staging_path]])
+        if isinstance(e, (pa.ArrowInvalid, pa.ArrowTypeError)):
+            raise InvalidCSVFormatError(f"Could not transcode gs://{source_bucket}/{source_path} to Parquet: {str(e)}")
+        raise
+
+    output_blob = get_blob_metadata(storage_client, staging_bucket, staging_path)
+    stats = {
+        'source': f"gs://{source_bucket}/{source_path}",
+        'bucket': staging_bucket,
+        'path': staging_path,
+        'uri': f"gs://{staging_bucket}/{staging_path}",
+        'rows': rows,
+        'input_bytes': source_blob.size,
+        'output_bytes': output_blob.size if output_blob is not None else None,
+        'conversion_seconds': round(time.monotonic() - started, 3),
+    }
+    logger.info(f"Transcoded to Parquet: {json.dumps(stats)}")
+    return stats
+
+
+def _count_quotes(blob: storage.Blob, start: int, end: int) -> int:
+    """Number of quote characters in [start, end) of the blob, read CSV_VALIDATION_READ_MB at a time"""
+    read_size = CSV_VALIDATION_READ_MB * 1024 * 1024
+    quotes = 0
+    pos = start
+    while pos < end:
+        read_end = min(pos + read_size, end) - 1
+        count_gcs_call()
+        quotes += blob.download_as_bytes(
+            start=pos, end=read_end, checksum=None, if_generation_match=blob.generation
+        ).count(b'"')
+        pos = read_end + 1
+    return quotes
+
+
+def _record_start_after(blob: storage.Blob, offset: int, quote_parity: int) -> int:
+    """
+    Offset of the first record that starts at or after offset. quote_parity is the parity of the
+    quote count before offset; a newline only ends a record outside quotes (even parity).
+    """
+    read_size = 1024 * 1024
+    pos = offset
+    parity = quote_parity
+    while pos < blob.size:
+        read_end = min(pos + read_size, blob.size) - 1
+        count_gcs_call()
+        data = blob.download_as_bytes(start=pos, end=read_end, checksum=None, if_generation_match=blob.generation)
+        index = 0
+        while True:
+            newline = data.find(b'\n', index)
+            if newline < 0:
+                parity ^= data.count(b'"', index) & 1
+                break
+            parity ^= data.count(b'"', index, newline) & 1
+            if parity == 0:
+                return pos + newline + 1
+            index = newline + 1
+        pos = read_end + 1
+    return blob.size
+
+
+def plan_csv_shards(blob: storage.Blob, shard_bytes: int) -> List[Tuple[int, int]]:
+    """
+    Split a CSV blob into record-aligned byte ranges of about shard_bytes. Quote characters are counted
+    per range in parallel so that newlines inside quoted fields are never used as boundaries.
+    """
+    nominal = list(range(shard_bytes, blob.size, shard_bytes))
+    if not nominal:
+        return [(0, blob.size)]
+    edges = [0] + nominal
+    with ThreadPoolExecutor(max_workers=max(1, min(SHARD_WORKERS, len(nominal)))) as executor:
+        quote_counts = list(executor.map(lambda i: _count_quotes(blob, edges[i], edges[i + 1]), range(len(nominal))))
+        parities = [sum(quote_counts[:i + 1]) & 1 for i in range(len(nominal))]
+        starts = list(executor.map(lambda i: _record_start_after(blob, nominal[i], parities[i]), range(len(nominal))))
+    starts = sorted(set([0] + [start for start in starts if start < blob.size]))
+    return list(zip(starts, starts[1:] + [blob.size]))
+
+
+def _write_shard(
+    storage_client: storage.Client,
+    blob: storage.Blob,
+    shard_path: str,
+    start: int,
+    end: int,
+    header: bytes
+) -> None:
+    """Stream one byte range of blob into a new object, prefixed with the header line"""
+    read_size = CSV_VALIDATION_READ_MB * 1024 * 1024
+    count_gcs_call()
+    with storage_client.bucket(blob.bucket.name).blob(shard_path).open(
+        'wb', content_type='text/csv', chunk_size=SHARD_UPLOAD_CHUNK_MB * 1024 * 1024
+    ) as writer:
+        writer.write(header)
+        pos = start
+        while pos < end:
+            if remaining_time() <= 0:
+                raise DataLoadError(f"Ran out of time writing {shard_path}")
+            read_end = min(pos + read_size, end) - 1
+            count_gcs_call()
+            writer.write(blob.download_as_bytes(
+                start=pos, end=read_end, checksum=None, if_generation_match=blob.generation
+            ))
+            pos = read_end + 1
+
+
+def split_csv_object(
+    storage_client: storage.Client,
+    source_bucket: str,
+    source_path: str,
+    is_header: bool
+) -> List[List[str]]:
+    """
+    Split a CSV object larger than SHARD_SIZE_MB into record-aligned shards under SHARD_PREFIX,
+    written in parallel. Every shard after the first gets a copy of the header line so all of them
+    load with the same skip_leading_rows. Returns [bucket, path] pairs of the shards.
+    A split that cannot finish in the invocation's remaining time is refused up front; one that runs
+    out of time anyway deletes the shards it wrote.
+    """
+    blob = get_blob_metadata(storage_client, source_bucket, source_path)
+    if blob is None:
+        raise FileNotFoundError(f"Data file not found: gs://{source_bucket}/{source_path}")
+
+    # Each writer holds its upload chunk plus a downloaded read and its copy in the buffer
+    writer_mb = SHARD_UPLOAD_CHUNK_MB + 2 * CSV_VALIDATION_READ_MB
+    max_workers = max(1, min(SHARD_WORKERS, SHARD_MEMORY_BUDGET_MB // writer_mb))
+    size_mb = blob.size / (1024 * 1024)
+    estimate = size_mb / (SHARD_COPY_MBPS * max_workers)
+    if estimate > remaining_time():
+        raise DataLoadError(
+            f"Splitting gs://{source_bucket}/{source_path} ({size_mb:.0f} MB) needs about {estimate:.0f}s "
+            f"but only {remaining_time():.0f}s remain; raise the function timeout or upload smaller files"
+        )
+
+    started = time.monotonic()
+    ranges = plan_csv_shards(blob, SHARD_SIZE_MB * 1024 * 1024)
+    header = b''
+    if is_header:
+        header_end = _record_start_after(blob, 0, 0)
+        count_gcs_call()
+        header = blob.download_as_bytes(start=0, end=header_end - 1, checksum=None, if_generation_match=blob.generation)
+        if header.startswith(codecs.BOM_UTF8):
+            header = header[len(codecs.BOM_UTF8):]
+        if not header.endswith(b'\n'):
+            header += b'\n'
+
+    shard_dir = f"{SHARD_PREFIX}{source_path.rsplit('.', 1)[0]}.{blob.generation}"
+    shards = [[source_bucket, f"{shard_dir}/shard-{i:05d}.csv"] for i in range(len(ranges))]
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(ranges))) as executor:
+            futures = [
+                executor.submit(_write_shard, storage_client, blob, path, start, end, header if i > 0 else b'')
+                for i, ((_, path), (start, end)) in enumerate(zip(shards, ranges))
+            ]
+            for future in futures:
+                future.result()
+    except BaseException:
+        delete_staging_files(storage_client, shards)
+        raise
+
+    logger.info(
+        f"Split gs://{source_bucket}/{source_path} ({blob.size / (1024 * 1024):.0f} MB) into {len(shards)} shards "
+        f"in {time.monotonic() - started:.1f}s"
+    )
+    return shards
+
+
+def compose_objects(storage_client: storage.Client, bucket_name: str, paths: List[str], dest_path: str) -> None:
+    """
+    Concatenate objects of one bucket into dest_path server-side. More than COMPOSE_MAX_COMPONENTS
+    sources are composed as a tree of intermediate objects, which are removed afterwards.
+    """
+    bucket = storage_client.bucket(bucket_name)
+
+    def compose(group: List[str], path: str) -> None:
+        destination = bucket.blob(path)
+        destination.content_type = 'text/csv'
+        count_gcs_call()
+        destination.compose([bucket.blob(source) for source in group])
+
+    intermediates = []
+    level = 0
+    while len(paths) > COMPOSE_MAX_COMPONENTS:
+        groups = _chunks(paths, COMPOSE_MAX_COMPONENTS)
+        next_paths = [f"{dest_path}.part{level}-{i:05d}" if len(group) > 1 else group[0] for i, group in enumerate(groups)]
+        with ThreadPoolExecutor(max_workers=max(1, min(MOVE_WORKERS, len(groups)))) as executor:
+            futures = [executor.submit(compose, group, path) for group, path in zip(groups, next_paths) if len(group) > 1]
+            for future in futures:
+                future.result()
+        intermediates.extend(path for group, path in zip(groups, next_paths) if len(group) > 1)
+        paths = next_paths
+        level += 1
+    compose(paths, dest_path)
+    delete_staging_files(storage_client, [[bucket_name, path] for path in intermediates])
+
+
+def _split_csv_header(data: bytes) -> Tuple[bytes, bytes]:
+    """Split CSV bytes into the header record and the rest, ignoring newlines inside quotes"""
+    index = 0
+    parity = 0
+    while True:
+        newline = data.find(b'\n', index)
+        if newline < 0:
+            return data, b''
+        parity ^= data.count(b'"', index, newline) & 1
+        if parity == 0:
+            return data[:newline + 1], data[newline + 1:]
+        index = newline + 1
+
+
+def compact_small_files(
+    storage_client: storage.Client,
+    source_files: List[List[str]],
+    is_header: bool
+) -> Tuple[List[List[str]], List[List[str]]]:
+    """
+    Merge CSV files up to COMPACT_MAX_FILE_KB into one object per bucket under COMPACT_PREFIX so they
+    load as a single source. Later files lose their header; files that already start clean and end in a
+    newline are composed as they are, the rest are rewritten into components of about COMPACT_COMPONENT_MB,
+    downloaded and uploaded one at a time.
+    Returns (sources to load, staging objects written).
+    """
+    small: Dict[str, List[storage.Blob]] = {}
+    for b, p in source_files:
+        blob = get_blob_metadata(storage_client, b, p)
+        if blob is not None and blob.size and blob.size <= COMPACT_MAX_FILE_KB * 1024:
+            small.setdefault(b, []).append(blob)
+    small = {b: blobs for b, blobs in small.items() if len(blobs) >= COMPACT_MIN_FILES}
+    if not COMPACT_SMALL_FILES or not small:
+        return source_files, []
+
+    def download(blob: storage.Blob) -> bytes:
+        count_gcs_call()
+        return blob.download_as_bytes(checksum=None, if_generation_match=blob.generation)
+
+    component_bytes = COMPACT_COMPONENT_MB * 1024 * 1024
+    sources, staging_files = [], []
+    compacted = {(b, blob.name) for b, blobs in small.items() for blob in blobs}
+    for bucket_name, blobs in small.items():
+        started = time.monotonic()
+        digest = hashlib.sha256('\n'.join(f"{blob.name}#{blob.generation}" for blob in blobs).encode()).hexdigest()[:32]
+        dest_path = f"{COMPACT_PREFIX}{digest}.csv"
+
+        # Only one component's worth of files is held in memory at a time
+        groups, group, group_size = [], [], 0
+        for blob in blobs:
+            if group and group_size + blob.size > component_bytes:
+                groups.append(group)
+                group, group_size = [], 0
+            group.append(blob)
+            group_size += blob.size
+        if group:
+            groups.append(group)
+
+        header = None
+        compose_paths, component_paths, skipped = [], [], []
+        with ThreadPoolExecutor(max_workers=max(1, min(MOVE_WORKERS, len(blobs)))) as executor:
+            for group in groups:
+                batch = []
+                for blob, original in zip(group, executor.map(download, group)):
+                    data = original
+                    if is_header:
+                        file_header, data = _split_csv_header(original)
+                        if file_header.startswith(codecs.BOM_UTF8):
+                            file_header = file_header[len(codecs.BOM_UTF8):]
+                        if header is None:
+                            header = file_header if file_header.endswith(b'\n') else file_header + b'\n'
+                            batch.append(header)
+                        elif file_header.rstrip(b'\r\n') != header.rstrip(b'\r\n'):
+                            logger.warning(f"Header of gs://{bucket_name}/{blob.name} differs; loading it separately")
+                            skipped.append([bucket_name, blob.name])
+                            continue
+                    elif data.startswith(codecs.BOM_UTF8):
+                        data = data[len(codecs.BOM_UTF8):]
+                    if not data:
+                        continue
+                    if not data.endswith(b'\n'):
+                        data += b'\n'
+                    if data is original:
+                        compose_paths.append(blob.name)  # clean header-less file, no rewrite needed
+                        continue
+                    batch.append(data)
+                if batch:
+                    path = f"{dest_path}.component-{len(component_paths):05d}"
+                    count_gcs_call()
+                    storage_client.bucket(bucket_name).blob(path).upload_from_string(b''.join(batch), content_type='text/csv')
+                    component_paths.append(path)
+                del batch
+
+        if not component_paths and not compose_paths:
+            sources.extend([bucket_name, blob.name] for blob in blobs)  # header-only files, nothing to merge
+            continue
+        compose_objects(storage_client, bucket_name, component_paths + compose_paths, dest_path)
+        delete_staging_files(storage_client, [[bucket_name, path] for path in component_paths])
+
+        sources.append([bucket_name, dest_path])
+        sources.extend(skipped)
+        staging_files.append([bucket_name, dest_path])
+        logger.info(
+            f"Compacted {len(blobs) - len(skipped)} small files in gs://{bucket_name} into {dest_path} "
+            f"({len(component_paths)} rewritten components, {len(compose_paths)} composed as-is) "
+            f"in {time.monotonic() - started:.1f}s"
+        )
+
+    sources.extend([b, p] for b, p in source_files if (b, p) not in compacted)
+    return sources, staging_files
+
+
+def prepare_load_sources(
+    storage_client: storage.Client,
+    source_files: List[List[str]],
+    schema: Optional[List[bigquery.SchemaField]],
+    is_header: bool,
+    transcode: bool
+) -> Dict[str, Any]:
+    """
+    Return the URIs and source format to load, transcoding the CSV files to Parquet when requested.
+    Many small CSV files are first compacted into one object; CSV files over MAX_FILE_SIZE_MB are split
+    into shards that are loaded together in one job.
+    """
+    input_bytes = 0
+    for b, p in source_files:
+        blob = get_blob_metadata(storage_client, b, p)
+        input_bytes += blob.size if blob is not None and blob.size else 0
+    source_files, compacted = compact_small_files(storage_client, source_files, is_header)
+
+    oversize = set()
+    for b, p in source_files:
+        blob = get_blob_metadata(storage_client, b, p)
+        if SPLIT_OVERSIZE_FILES and blob is not None and blob.size and blob.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            oversize.add((b, p))
+
+    # Objects written so far are removed if a later step fails; callers own them once returned
+    written = list(compacted)
+    try:
+        if not transcode:
+            uris = []
+            for b, p in source_files:
+                if (b, p) in oversize:
+                    file_shards = split_csv_object(storage_client, b, p, is_header)
+                    uris.extend(f"gs://{sb}/{sp}" for sb, sp in file_shards)
+                    written.extend(file_shards)
+                else:
+                    uris.append(f"gs://{b}/{p}")
+            return {
+                'uris': uris,
+                'source_format': 'CSV',
+                'staging_files': written,
+                'input_bytes': input_bytes,
+                'transcode': None,
+            }
+
+        results = []
+        for b, p in source_files:
+            results.append(transcode_csv_to_parquet(storage_client, b, p, schema, is_header))
+            written.append([results[-1]['bucket'], results[-1]['path']])
+    except BaseException:
+        delete_staging_files(storage_client, written)
+        raise
+    return {
+        'uris': [r['uri'] for r in results],
+        'source_format': 'PARQUET',
+        'staging_files': written,
+        'input_bytes': input_bytes,
+        'transcode': {
+            'files': len(results),
+            'input_bytes': sum(r['input_bytes'] for r in results),
+            'output_bytes': sum(r['output_bytes'] or 0 for r in results),
+            'conversion_seconds': round(sum(r['conversion_seconds'] for r in results), 3),
+        },
+    }
+
+
+def delete_staging_files(storage_client: storage.Client, staging_files: List[List[str]]) -> None:
+    """Remove intermediate objects written for a load once it has finished or failed"""
+    for staging_bucket, staging_path in staging_files:
+        try:
+            count_gcs_call()
+            storage_client.bucket(staging_bucket).blob(staging_path).delete()
+        except NotFound:
+            pass  # never written, or already removed
+        except Exception as e:
+            logger.warning(f"Could not delete staging file gs://{staging_bucket}/{staging_path}: {str(e)}")
+
+
+def record_load_stats(storage_client: storage.Client, full_table_id: str, load_context: Dict[str, Any], load_job: bigquery.LoadJob) -> None:
+    """
+    Keep per-table load timings in LOAD_STATS_BUCKET so CSV and Parquet loads can be compared.
+    Logs the estimated saving of a Parquet load against the table's average CSV load rate.
+    """
+    if not LOAD_STATS_BUCKET or not load_job.started or not load_job.ended:
+        return
+    load_seconds = (load_job.ended - load_job.started).total_seconds()
+    input_gb = max(load_context.get('input_bytes') or 0, 1) / (1024 ** 3)
+    source_format = load_context.get('source_format', 'CSV')
+    transcode = load_context.get('transcode')
+
+    blob = storage_client.bucket(LOAD_STATS_BUCKET).blob(f"{LOAD_STATS_PREFIX}{full_table_id}.json")
+    try:
+        count_gcs_call()
+        blob.reload()
+        count_gcs_call()
+        stats = json.loads(blob.download_as_text())
+        generation = blob.generation
+    except NotFound:
+        stats = {}
+        generation = 0
+
+    entry = stats.setdefault(source_format, {'loads': 0, 'seconds_per_gb': 0.0})
+    entry['seconds_per_gb'] = (entry['seconds_per_gb'] * entry['loads'] + load_seconds / input_gb) / (entry['loads'] + 1)
+    entry['loads'] += 1
+
+    if transcode:
+        total_seconds = transcode['conversion_seconds'] + load_seconds
+        csv_entry = stats.get('CSV')
+        savings = None
+        if csv_entry and csv_entry['loads']:
+            savings = round(csv_entry['seconds_per_gb'] * input_gb - total_seconds, 3)
+        stats['last_transcode'] = {**transcode, 'load_seconds': load_seconds, 'estimated_savings_seconds': savings}
+        logger.info(
+            f"Parquet load for {full_table_id}: conversion {transcode['conversion_seconds']}s, load {load_seconds:.1f}s, "
+            f"{transcode['input_bytes']} -> {transcode['output_bytes']} bytes, estimated savings vs CSV: {savings}s"
+        )
+
+    try:
+        count_gcs_call()
+        blob.upload_from_string(json.dumps(stats), content_type='application/json', if_generation_match=generation)
+    except Exception as e:
+        logger.warning(f"Could not record load stats for {full_table_id}: {str(e)}")
+
+
+def verify_load_job(load_job: bigquery.LoadJob) -> bigquery.LoadJob:
+    """Check a finished load job for errors and log its row counts"""
+    load_job.reload()
+    
+    if load_job.state != 'DONE':
+        raise DataLoadError(f"BigQuery job {load_job.job_id} did not complete. State: {load_job.state}")
+    
+    if load_job.error_result:
+        error_message = load_job.error_result.get('message', 'Unknown error')
+        error_details = json.dumps(load_job.error_result, indent=2)
+        logger.error(f"BigQuery job failed: {error_message}")
+        logger.error(f"Error details: {error_details}")
+        
+        if load_job.errors:
+            logger.error(f"Job errors: {json.dumps(load_job.errors, indent=2)}")
+        
+        if is_quota_error(Exception(error_message)):
+            raise QuotaExceededError(f"BigQuery quota exceeded: {error_message}")
+        elif is_schema_mismatch_error(Exception(error_message)):
+            raise InvalidCSVFormatError(
+                f"Schema mismatch in BigQuery load job {load_job.job_id}: {error_message}. "
+                f"Please check CSV format and column types."
+            )
+        
+        raise DataLoadError(f"BigQuery load job {load_job.job_id} failed: {error_message}")
+    
+    bad_records = 0
+    if hasattr(load_job, 'output_rows') and load_job.output_rows is not None:
+        if hasattr(load_job, 'statistics') and hasattr(load_job.statistics, 'load') and hasattr(load_job.statistics.load, 'bad_records'):
+            bad_records = load_job.statistics.load.bad_records
+    
+    logger.info(
+        f"Load completed. Rows loaded: {load_job.output_rows}, "
+        f"Bad records: {bad_records}"
+    )
+    
+    if bad_records > 0:
+        logger.warning(f"Warning: {bad_records} bad records were skipped during load")
+    
+    return load_job
+
+
+def deterministic_job_id(storage_client: storage.Client, source_files: List[List[str]], full_table_id: str, salt: str = '') -> str:
+    """Derive a load job ID from the source objects' bucket, name and generation and the target table"""
+    parts = []
+    for bucket_name, file_path in source_files:
+        blob = get_blob_metadata(storage_client, bucket_name, file_path)
+        parts.append(f"{bucket_name}/{file_path}#{blob.generation if blob is not None else ''}")
+    digest = hashlib.sha256("|".join(sorted(parts) + [full_table_id, salt]).encode()).hexdigest()[:40]
+    return f"gcs_load_{re.sub(r'[^A-Za-z0-9_]', '_', full_table_id)}_{digest}"
+
+
+def find_existing_load_job(bq_client: bigquery.Client, job_id: str, project_id: str, location: Optional[str]) -> Optional[bigquery.LoadJob]:
+    """Return the job with this ID, or None if it was never submitted"""
+    try:
+        return bq_client.get_job(job_id, project=project_id, location=location)
+    except NotFound:
+        return None
+
+
+def _quota_paths(project_id: str, full_table_id: str) -> Tuple[str, str, str]:
+    """Ledger paths for today's table count, today's project count and the project's in-flight jobs"""
+    day = datetime.now(QUOTA_TIMEZONE).date().isoformat()
+    return (
+        f"{QUOTA_LEDGER_PREFIX}{day}/{project_id}.{full_table_id}.json",
+        f"{QUOTA_LEDGER_PREFIX}{day}/{project_id}.json",
+        f"{QUOTA_LEDGER_PREFIX}in_flight/{project_id}.json",
+    )
+
+
+def _read_json_record(bucket_name: str, directory: str, path: str) -> Dict[str, Any]:
+    """Read one JSON record from directory or GCS; empty if it is missing or unreadable"""
+    try:
+        if directory:
+            local_path = os.path.join(directory, path)
+            if not os.path.exists(local_path):
+                return {}
+            with open(local_path) as f:
+                return json.loads(f.read() or '{}')
+        blob = get_storage_client().bucket(bucket_name).blob(path)
+        count_gcs_call()
+        return json.loads(blob.download_as_text())
+    except NotFound:
+        return {}
+    except Exception as e:
+        logger.warning(f"Could not read {path}: {str(e)}")
+        return {}
+
+
+def _read_quota_record(path: str) -> Dict[str, Any]:
+    return _read_json_record(QUOTA_LEDGER_BUCKET, QUOTA_LEDGER_DIR, path)
+
+
+def _update_json_record(bucket_name: str, directory: str, path: str, mutate) -> Optional[Dict[str, Any]]:
+    """
+    Read-modify-write one JSON record under a file lock in directory, or a GCS generation precondition.
+    Returns the new record, or None if it could not be written.
+    """
+    try:
+        if directory:
+            local_path = os.path.join(directory, path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                record = json.loads(f.read() or '{}')
+                mutate(record)
+                f.seek(0)
+                f.truncate()
+                json.dump(record, f)
+            return record
+        bucket = get_storage_client().bucket(bucket_name)
+        for _ in range(10):
+            blob = bucket.blob(path)
+            try:
+                count_gcs_call()
+                blob.reload()
+                count_gcs_call()
+                record = json.loads(blob.download_as_text(if_generation_match=blob.generation))
+                generation = blob.generation
+            except NotFound:
+                record, generation = {}, 0
+            mutate(record)
+            try:
+                count_gcs_call()
+                bucket.blob(path).upload_from_string(
+                    json.dumps(record), content_type='application/json', if_generation_match=generation
+                )
+                return record
+            except api_exceptions.PreconditionFailed:
+                time.sleep(random.uniform(0, 0.2))
+        logger.warning(f"Gave up updating {path} after repeated write conflicts")
+    except Exception as e:
+        logger.warning(f"Could not update {path}: {str(e)}")
+    return None
+
+
+def _update_quota_record(path: str, mutate) -> Optional[Dict[str, Any]]:
+    """Update one quota ledger record. The ledger never blocks a load on its own."""
+    return _update_json_record(QUOTA_LEDGER_BUCKET, QUOTA_LEDGER_DIR, path, mutate)
+
+
+def quota_admission(project_id: str, full_table_id: str) -> str:
+    """
+    Decide how to take new work for a table from today's ledger counts: 'admit', 'coalesce' once a
+    daily limit is QUOTA_COALESCE_RATIO used, or 'defer' within QUOTA_RESERVE_JOBS of it.
+    """
+    if not QUOTA_ENABLED:
+        return 'admit'
+    table_path, project_path, _ = _quota_paths(project_id, full_table_id)
+    table = _read_quota_record(table_path)
+    table_jobs = table.get('jobs', 0)
+    project_jobs = _read_quota_record(project_path).get('jobs', 0)
+    if (
+        table.get('exhausted')
+        or table_jobs >= TABLE_LOAD_JOBS_PER_DAY - QUOTA_RESERVE_JOBS
+        or project_jobs >= PROJECT_LOAD_JOBS_PER_DAY - QUOTA_RESERVE_JOBS
+    ):
+        decision = 'defer'
+    elif table_jobs >= TABLE_LOAD_JOBS_PER_DAY * QUOTA_COALESCE_RATIO or project_jobs >= PROJECT_LOAD_JOBS_PER_DAY * QUOTA_COALESCE_RATIO:
+        decision = 'coalesce'
+    else:
+        return 'admit'
+    logger.warning(
+        f"Load-job quota for {full_table_id}: {table_jobs}/{TABLE_LOAD_JOBS_PER_DAY} table, "
+        f"{project_jobs}/{PROJECT_LOAD_JOBS_PER_DAY} project jobs today; {decision}"
+    )
+    return decision
+
+
+def acquire_load_slot(project_id: str, full_table_id: str, slot_id: str) -> None:
+    """
+    Admit one load-job submission: refuse it near the daily limits, wait for a free slot when
+    MAX_CONCURRENT_LOAD_JOBS is set, then count it against today's table and project totals.
+    """
+    if not QUOTA_ENABLED:
+        return
+    if quota_admission(project_id, full_table_id) == 'defer':
+        raise QuotaDeferredError(
+            f"Load into {full_table_id} deferred: today's load-job quota is nearly used; "
+            f"it resets at midnight Pacific time",
+            until_reset=True
+        )
+    table_path, project_path, in_flight_path = _quota_paths(project_id, full_table_id)
+
+    if MAX_CONCURRENT_LOAD_JOBS:
+        admitted = {}
+
+        def take_slot(record: Dict[str, Any]) -> None:
+            now = datetime.now(timezone.utc)
+            jobs = {
+                k: v for k, v in record.get('jobs', {}).items()
+                if (now - datetime.fromisoformat(v)).total_seconds() < QUOTA_IN_FLIGHT_TTL_SECONDS
+            }
+            admitted['ok'] = slot_id in jobs or len(jobs) < MAX_CONCURRENT_LOAD_JOBS
+            if admitted['ok']:
+                jobs[slot_id] = now.isoformat()
+            record['jobs'] = jobs
+
+        while True:
+            if _update_quota_record(in_flight_path, take_slot) is None:
+                raise QuotaDeferredError(f"Load into {full_table_id} deferred: the quota ledger could not be updated")
+            if admitted['ok']:
+                break
+            if remaining_time() < QUOTA_SLOT_POLL_SECONDS:
+                raise QuotaDeferredError(
+                    f"Load into {full_table_id} deferred: {MAX_CONCURRENT_LOAD_JOBS} load jobs are already running"
+                )
+            logger.info(f"Waiting for a load-job slot ({MAX_CONCURRENT_LOAD_JOBS} running) for {full_table_id}")
+            time.sleep(QUOTA_SLOT_POLL_SECONDS)
+
+    def count_job(record: Dict[str, Any]) -> None:
+        record['jobs'] = record.get('jobs', 0) + 1
+
+    if _update_quota_record(table_path, count_job) is None:
+        release_load_slot(project_id, slot_id)
+        raise QuotaDeferredError(f"Load into {full_table_id} deferred: the quota ledger could not be updated")
+    if _update_quota_record(project_path, count_job) is None:
+        release_load_slot(project_id, slot_id, full_table_id, refund_table=True)
+        raise QuotaDeferredError(f"Load into {full_table_id} deferred: the quota ledger could not be updated")
+
+
+def release_load_slot(
+    project_id: str,
+    slot_id: str,
+    full_table_id: Optional[str] = None,
+    refund_table: bool = False,
+    refund_project: bool = False
+) -> None:
+    """Free the concurrency slot of a finished load job, optionally taking back counts for a job never created"""
+    if not QUOTA_ENABLED:
+        return
+    table_path, project_path, in_flight_path = _quota_paths(project_id, full_table_id or '')
+
+    def uncount_job(record: Dict[str, Any]) -> None:
+        record['jobs'] = max(0, record.get('jobs', 0) - 1)
+
+    if refund_table:
+        _update_quota_record(table_path, uncount_job)
+    if refund_project:
+        _update_quota_record(project_path, uncount_job)
+    if MAX_CONCURRENT_LOAD_JOBS:
+        _update_quota_record(in_flight_path, lambda record: record.get('jobs', {}).pop(slot_id, None))
+
+
+def is_table_quota_error(error: Exception) -> bool:
+    """Check if an error is BigQuery's per-table daily load quota, which no retry today can get past"""
+    error_str = str(error).lower()
+    return 'quota' in error_str and ('per table' in error_str or 'quota for imports' in error_str)
+
+
+def mark_table_quota_exhausted(project_id: str, full_table_id: str) -> None:
+    """Record that BigQuery rejected a load for the table's daily quota so later work is deferred at once"""
+    if not QUOTA_ENABLED:
+        return
+    table_path, _, _ = _quota_paths(project_id, full_table_id)
+    _update_quota_record(table_path, lambda record: record.update(exhausted=True))
+    logger.error(f"Daily load-job quota exhausted for {full_table_id}; deferring loads until it resets")
+
+
+def _deferred_config_path(bucket_name: str, config_file_name: str) -> str:
+    return f"{QUOTA_LEDGER_PREFIX}deferred/{hashlib.sha256(f'{bucket_name}/{config_file_name}'.encode()).hexdigest()[:32]}.json"
+
+
+def next_quota_reset() -> datetime:
+    """Start of the next quota day (midnight Pacific time), in UTC"""
+    tomorrow = datetime.now(QUOTA_TIMEZONE).date() + timedelta(days=1)
+    return datetime(tomorrow.year, tomorrow.month, tomorrow.day, tzinfo=QUOTA_TIMEZONE).astimezone(timezone.utc)
+
+
+def defer_config(bucket_name: str, config_file_name: str, full_table_id: str, until_reset: bool) -> Optional[str]:
+    """
+    Record a config held back by the load-job quota so run_scheduled_maintenance replays it: after the
+    daily reset, or on its next run when the deferral was not about a daily limit.
+    Returns when it becomes due (ISO, UTC), or None if it could not be recorded.
+    """
+    if not QUOTA_ENABLED:
+        return None
+    now = datetime.now(timezone.utc)
+    replay_after = (next_quota_reset() if until_reset else now).isoformat()
+    saved = _update_quota_record(_deferred_config_path(bucket_name, config_file_name), lambda record: record.update(
+        bucket=bucket_name, config_file_name=config_file_name, full_table_id=full_table_id,
+        deferred_at=now.isoformat(), replay_after=replay_after
+    ))
+    if saved is None:
+        return None
+    logger.info(f"Deferred gs://{bucket_name}/{config_file_name}; it will be replayed after {replay_after}")
+    return replay_after
+
+
+def replay_deferred_configs() -> int:
+    """
+    Re-fire every deferred config that is due by rewriting it in place: the new generation triggers
+    process_config_file again. Configs removed since they were deferred are forgotten. Returns the number replayed.
+    """
+    if not QUOTA_ENABLED:
+        return 0
+    prefix = f"{QUOTA_LEDGER_PREFIX}deferred/"
+    storage_client = get_storage_client()
+    try:
+        if QUOTA_LEDGER_DIR:
+            directory = os.path.join(QUOTA_LEDGER_DIR, prefix)
+            paths = [f"{prefix}{name}" for name in sorted(os.listdir(directory))] if os.path.isdir(directory) else []
+        else:
+            count_gcs_call()
+            paths = [blob.name for blob in storage_client.list_blobs(QUOTA_LEDGER_BUCKET, prefix=prefix)]
+    except Exception as e:
+        logger.warning(f"Could not list deferred configs: {str(e)}")
+        return 0
+
+    now = datetime.now(timezone.utc)
+    replayed = 0
+    for path in paths:
+        record = _read_quota_record(path)
+        if not record.get('replay_after') or datetime.fromisoformat(record['replay_after']) > now:
+            continue
+        try:
+            # Drop the record first: the replayed config writes a new one if it is deferred again
+            if QUOTA_LEDGER_DIR:
+                os.remove(os.path.join(QUOTA_LEDGER_DIR, path))
+            else:
+                count_gcs_call()
+                storage_client.bucket(QUOTA_LEDGER_BUCKET).blob(path).delete()
+        except (FileNotFoundError, NotFound):
+            continue  # claimed by another run
+        config_blob = get_blob_metadata(storage_client, record['bucket'], record['config_file_name'])
+        if config_blob is None:
+            logger.info(f"Deferred config gs://{record['bucket']}/{record['config_file_name']} is gone; not replaying it")
+            continue
+        try:
+            _copy_object(storage_client, config_blob, record['bucket'], record['config_file_name'])
+            invalidate_blob_metadata(record['bucket'], record['config_file_name'])
+            replayed += 1
+            logger.info(f"Replayed deferred config gs://{record['bucket']}/{record['config_file_name']}")
+        except Exception as e:
+            logger.warning(f"Could not replay gs://{record['bucket']}/{record['config_file_name']}: {str(e)}")
+            _update_quota_record(path, lambda current: None if current else current.update(record))
+    return replayed
+
+
+def wait_for_load_job(bq_client: bigquery.Client, load_job: bigquery.LoadJob, timeout: int, cancel_on_timeout: bool = True) -> bigquery.LoadJob:
+    """Wait for a load job within the invocation's remaining time and verify it"""
+    wait_seconds = max(1, min(timeout, remaining_time()))
+    try:
+        load_job.result(timeout=wait_seconds)
+    except Exception as e:
+        if classify_error(e) != 'fatal' and load_job.done():
+            raise  # the job itself failed transiently; resubmit
+        if cancel_on_timeout:
+            try:
+                bq_client.cancel_job(load_job.job_id, location=load_job.location)
+                logger.warning(f"Cancelled BigQuery job {load_job.job_id} due to timeout or error: {str(e)}")
+            except Exception as cancel_e:
+                logger.error(f"Failed to cancel job {load_job.job_id}: {str(cancel_e)}")
+        raise DataLoadError(f"BigQuery load job exceeded timeout of {wait_seconds:.0f} seconds or failed: {str(e)}")
+    
+    return verify_load_job(load_job)
+
+
+@retry_on_failure()
+def _run_load_job(
+    bq_client: bigquery.Client,
+    gcs_uri: Union[str, List[str]],
+    table_ref: bigquery.TableReference,
+    job_config: bigquery.LoadJobConfig,
+    timeout: int,
+    wait: bool,
+    job_id: Optional[str] = None,
+    location: Optional[str] = None
+) -> bigquery.LoadJob:
+    """
+    Submit one load job and wait for it. This is the only step retried on transient errors.
+    Each submission is admitted and counted by the quota ledger under its final job ID; attaching to
+    an existing job is not counted. A per-table quota rejection is not retried.
+    """
+    project_id = table_ref.project
+    full_table_id = f"{table_ref.dataset_id}.{table_ref.table_id}"
+
+    def submit(submit_job_id: str) -> bigquery.LoadJob:
+        acquire_load_slot(project_id, full_table_id, submit_job_id)
+        try:
+            return bq_client.load_table_from_uri(
+                gcs_uri,
+                table_ref,
+                job_config=job_config,
+                job_id=submit_job_id,
+                location=location
+            )
+        except api_exceptions.Conflict:
+            # No job was created by this request
+            release_load_slot(project_id, submit_job_id, full_table_id, refund_table=True, refund_project=True)
+            raise
+        except Exception:
+            # A rejected request may still count against BigQuery's quota, so only the slot is freed
+            release_load_slot(project_id, submit_job_id)
+            raise
+
+    owned_job_id = None
+    try:
+        try:
+            load_job = submit(job_id or f"gcs_load_{uuid.uuid4().hex}")
+            owned_job_id = load_job.job_id
+        except api_exceptions.Conflict:
+            # Same sources and table already submitted: attach to that job unless it failed
+            load_job = bq_client.get_job(job_id, project=project_id, location=location)
+            if load_job.state == 'DONE' and load_job.error_result:
+                load_job = submit(f"{job_id}_{time.time_ns()}")
+                owned_job_id = load_job.job_id
+            else:
+                logger.info(f"BigQuery job {job_id} already exists ({load_job.state}); attaching to it")
+        
+        logger.info(f"BigQuery job ID: {load_job.job_id}")
+        
+        if not wait:
+            return load_job  # the slot is freed when the pending job completes
+        
+        try:
+            return wait_for_load_job(bq_client, load_job, timeout)
+        finally:
+            if owned_job_id:
+                release_load_slot(project_id, owned_job_id)
+                owned_job_id = None
+    except Exception as e:
+        if owned_job_id:
+            release_load_slot(project_id, owned_job_id)
+        if is_table_quota_error(e):
+            mark_table_quota_exhausted(table_ref.project, full_table_id)
+            raise QuotaDeferredError(
+                f"BigQuery rejected the load into {full_table_id} for its daily quota: {str(e)}", until_reset=True
+            )
+        raise
+
+
+@retry_on_failure()
+def _run_query(
+    bq_client: bigquery.Client,
+    sql: str,
+    location: Optional[str],
+    timeout: int,
+    job_id: Optional[str] = None
+) -> bigquery.QueryJob:
+    """Run a query and wait for it. With job_id, a query already submitted under that ID is waited on instead."""
+    try:
+        query_job = bq_client.query(sql, location=location, job_id=job_id)
+    except api_exceptions.Conflict:
+        query_job = bq_client.get_job(job_id, location=location)
+        if query_job.state == 'DONE' and query_job.error_result:
+            query_job = bq_client.query(sql, location=location, job_id=f"{job_id}_{time.time_ns()}")
+        else:
+            logger.info(f"Query job {job_id} already exists ({query_job.state}); waiting for it")
+    query_job.result(timeout=max(1, min(timeout, remaining_time())))
+    return query_job
+
+
+def staging_step_applied(bq_client: bigquery.Client, job_id: Optional[str], project_id: str, location: Optional[str]) -> bool:
+    """True when the post-load query submitted under this deterministic ID has already succeeded"""
+    if not job_id:
+        return False
+    query_job = find_existing_load_job(bq_client, job_id, project_id, location)
+    return query_job is not None and query_job.state == 'DONE' and not query_job.error_result
+
+
+def build_merge_sql(target: str, staging: str, columns: List[str], merge_keys: List[str]) -> str:
+    """MERGE statement that updates rows matching on the key columns and inserts the rest"""
+    on = " AND ".join(f"T.`{k}` = S.`{k}`" for k in merge_keys)
+    updates = ", ".join(f"`{c}` = S.`{c}`" for c in columns if c not in merge_keys)
+    insert_columns = ", ".join(f"`{c}`" for c in columns)
+    insert_values = ", ".join(f"S.`{c}`" for c in columns)
+    sql = f"MERGE {target} T\nUSING {staging} S\nON {on}\n"
+    if updates:
+        sql += f"WHEN MATCHED THEN UPDATE SET {updates}\n"
+    sql += f"WHEN NOT MATCHED THEN INSERT ({insert_columns}) VALUES ({insert_values})"
+    return sql
+
+
+def merge_staging_table(
+    bq_client: bigquery.Client,
+    staging_ref: bigquery.TableReference,
+    table_ref: bigquery.TableReference,
+    merge_keys: List[str],
+    location: Optional[str],
+    timeout: int,
+    job_id: Optional[str] = None
+) -> None:
+    """
+    MERGE a loaded staging table into the target on the key columns, then drop the staging table.
+    With job_id the MERGE runs at most once: a MERGE that already succeeded under it is not repeated.
+    """
+    target = f"`{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`"
+    staging = f"`{staging_ref.project}.{staging_ref.dataset_id}.{staging_ref.table_id}`"
+    try:
+        if staging_step_applied(bq_client, job_id, table_ref.project, location):
+            logger.info(f"MERGE {job_id} into {target} already succeeded")
+            return
+        try:
+            columns = [field.name for field in bq_client.get_table(staging_ref).schema]
+        except NotFound:
+            if staging_step_applied(bq_client, job_id, table_ref.project, location):
+                return  # another invocation merged and dropped it meanwhile
+            raise
+        missing = [k for k in merge_keys if k not in columns]
+        if missing:
+            raise ConfigValidationError(f"merge_keys not found in the loaded data: {missing}")
+        try:
+            bq_client.get_table(table_ref)
+        except NotFound:
+            bq_client.copy_table(staging_ref, table_ref, location=location).result(timeout=max(1, min(timeout, remaining_time())))
+            logger.info(f"Target {target} did not exist; created it from the staging table")
+            return
+        query_job = _run_query(bq_client, build_merge_sql(target, staging, columns, merge_keys), location, timeout, job_id)
+        logger.info(f"MERGE into {target} on {merge_keys}: {query_job.num_dml_affected_rows} rows affected")
+    finally:
+        try:
+            bq_client.delete_table(staging_ref, not_found_ok=True)
+            logger.info(f"Dropped staging table {staging}")
+        except Exception as e:
+            logger.warning(f"Could not drop staging table {staging}; it expires on its own: {str(e)}")
+
+
+def get_partition_column(table: Optional[bigquery.Table]) -> Optional[Tuple[str, str]]:
+    """(field, type) when the target exists and is time-partitioned on a column, else None"""
+    if table is None:
+        return None
+    partitioning = table.time_partitioning
+    if partitioning is None or not partitioning.field or partitioning.type_ not in PARTITION_DECORATOR_FORMATS:
+        return None
+    return partitioning.field, partitioning.type_
+
+
+def partition_bounds(partition_type: str, start: Any) -> Tuple[Any, Any]:
+    """[start, end) of the partition that begins at a truncated DATE, DATETIME or TIMESTAMP value"""
+    if partition_type == 'HOUR':
+        return start, start + timedelta(hours=1)
+    if partition_type == 'DAY':
+        return start, start + timedelta(days=1)
+    if partition_type == 'MONTH':
+        return start, start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start, start.replace(year=start.year + 1)
+
+
+def partition_predicate(field: str, field_type: str, partition_type: str, starts: List[Any]) -> str:
+    """
+    WHERE clause matching the given partitions by typed ranges on the partition column,
+    so BigQuery prunes the DELETE to those partitions. None stands for the NULL partition.
+    """
+    def literal(value: Any) -> str:
+        if field_type == 'DATE':
+            return f"DATE '{value.isoformat()}'"
+        if field_type == 'DATETIME':
+            return f"DATETIME '{value.strftime('%Y-%m-%d %H:%M:%S')}'"
+        return f"TIMESTAMP '{value.astimezone(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')}+00'"
+
+    clauses = []
+    for start in starts:
+        if start is None:
+            clauses.append(f"`{field}` IS NULL")
+        else:
+            lower, upper = partition_bounds(partition_type, start)
+            clauses.append(f"(`{field}` >= {literal(lower)} AND `{field}` < {literal(upper)})")
+    return " OR ".join(clauses)
+
+
+def replace_partitions(
+    bq_client: bigquery.Client,
+    staging_ref: bigquery.TableReference,
+    table_ref: bigquery.TableReference,
+    partition: Tuple[str, str],
+    location: Optional[str],
+    timeout: int,
+    job_id: Optional[str] = None
+) -> List[str]:
+    """
+    Overwrite only the target partitions present in a loaded staging table, then drop the staging table.
+    The DELETE and INSERT run as one transaction, so readers see either the old or the new partitions.
+    With job_id the transaction runs at most once: one that already succeeded under it is not repeated.
+    """
+    field, partition_type = partition
+    staging = f"`{staging_ref.project}.{staging_ref.dataset_id}.{staging_ref.table_id}`"
+    try:
+        if staging_step_applied(bq_client, job_id, table_ref.project, location):
+            logger.info(f"Partition replacement {job_id} already succeeded")
+            return []
+        try:
+            staging_types = {f.name: f.field_type for f in bq_client.get_table(staging_ref).schema}
+        except NotFound:
+            if staging_step_applied(bq_client, job_id, table_ref.project, location):
+                return []  # another invocation replaced the partitions and dropped it meanwhile
+            raise
+        field_type = staging_types.get(field)
+        if field_type not in ('DATE', 'DATETIME', 'TIMESTAMP'):
+            raise DataLoadError(
+                f"Partition column '{field}' is missing from the loaded data or is not a DATE, DATETIME or TIMESTAMP "
+                f"(got {field_type})"
+            )
+        columns = [f.name for f in bq_client.get_table(table_ref).schema if f.name in staging_types]
+
+        rows = _run_query(
+            bq_client, f"SELECT DISTINCT {field_type}_TRUNC(`{field}`, {partition_type}) FROM {staging}", location, timeout
+        ).result()
+        starts = sorted((row[0] for row in rows), key=lambda value: (value is not None, value))
+        if len(starts) > PARTITION_REPLACE_MAX:
+            raise DataLoadError(
+                f"Data spans {len(starts)} partitions of {table_ref.table_id}; "
+                f"at most {PARTITION_REPLACE_MAX} can be replaced in one load"
+            )
+        partitions = [
+            '__NULL__' if start is None else start.strftime(PARTITION_DECORATOR_FORMATS[partition_type])
+            for start in starts
+        ]
+
+        select = ", ".join(f"`{c}`" for c in columns)
+        target = f"`{table_ref.project}.{table_ref.dataset_id}.{table_ref.table_id}`"
+        if starts:
+            sql = (
+                f"BEGIN TRANSACTION;\n"
+                f"DELETE FROM {target} WHERE {partition_predicate(field, field_type, partition_type, starts)};\n"
+                f"INSERT INTO {target} ({select}) SELECT {select} FROM {staging};\n"
+                f"COMMIT TRANSACTION;"
+            )
+            _run_query(bq_client, sql, location, timeout, job_id)
+        logger.info(f"Replaced {len(partitions)} partition(s) of {table_ref.dataset_id}.{table_ref.table_id} on {field}: {partitions[:10]}")
+        return partitions
+    finally:
+        try:
+            bq_client.delete_table(staging_ref, not_found_ok=True)
+            logger.info(f"Dropped staging table {staging}")
+        except Exception as e:
+            logger.warning(f"Could not drop staging table {staging}; it expires on its own: {str(e)}")
+
+
+def load_data_to_bigquery(
+    bq_client: bigquery.Client,
+    gcs_uri: Union[str, List[str]],
+    dataset_id: str,
+    table_name: str,
+    project_id: str,
+    is_header: bool,
+    override: bool,
+    timeout: int = TIMEOUT_SECONDS,
+    wait: bool = True,
+    schema: Optional[List[bigquery.SchemaField]] = None,
+    source_format: str = 'CSV',
+    job_id: Optional[str] = None,
+    merge_keys: Optional[List[str]] = None,
+    table_options: Optional[Dict[str, Any]] = None
+) -> bigquery.LoadJob:
+    """
+    Load data from GCS to BigQuery. Dataset checks and table replacement run once; only the job is retried.
+    With wait=False the job is only submitted.
+    An explicit schema disables autodetect. Parquet sources carry their own typed schema.
+    With a deterministic job_id, a job already running or finished for the same sources is reused.
+    With merge_keys the data is loaded into a staging table and MERGEd into the target (override is ignored).
+    Overriding a column-partitioned table replaces only the partitions present in the data, via a staging table.
+    table_options (partitioning, clustering) apply whenever the load creates the table; a replaced table
+    keeps its existing ones unless others are declared.
+    """
+    try:
+        check_dataset_exists(bq_client, dataset_id, project_id)
+        check_bigquery_permissions(bq_client, dataset_id, project_id)
+        
+        table_ref = bq_client.dataset(dataset_id, project=project_id).table(table_name)
+        location = get_cached_dataset(bq_client, dataset_id, project_id).location
+        try:
+            existing_table = bq_client.get_table(table_ref)
+        except NotFound:
+            existing_table = None
+        staging_ref = None
+        partition = None
+        if override and not merge_keys and PARTITION_SCOPED_OVERRIDE:
+            partition = get_partition_column(existing_table)
+        if existing_table is None:
+            create_options = table_options
+        elif merge_keys or partition:
+            create_options = None  # only the throwaway staging table is created
+        elif override:
+            create_options = table_options or table_options_of(existing_table)
+        else:
+            create_options = None
+            if table_options and table_options_of(existing_table) is None:
+                logger.warning(
+                    f"{dataset_id}.{table_name} exists without partitioning or clustering; "
+                    f"table_options only apply when the table is created"
+                )
+        if merge_keys or partition:
+            staging_ref = bq_client.dataset(dataset_id, project=project_id).table(
+                f"{table_name}__staging_{(job_id or uuid.uuid4().hex)[-12:]}"
+            )
+            override = True  # the staging table is always replaced
+            wait = True
+
+        load_job = None
+        if job_id:
+            existing_job = find_existing_load_job(bq_client, job_id, project_id, location)
+            if existing_job is not None and existing_job.state == 'DONE' and existing_job.error_result:
+                logger.info(f"Earlier BigQuery job {job_id} failed; submitting a new job")
+                job_id = f"{job_id}_{time.time_ns()}"
+            elif existing_job is not None:
+                logger.info(f"BigQuery job {job_id} for these sources is already {existing_job.state}; attaching to it")
+                if not wait:
+                    return existing_job
+                load_job = wait_for_load_job(bq_client, existing_job, timeout, cancel_on_timeout=False)
+
+        if load_job is None:
+            load_job = _submit_load(
+                bq_client, gcs_uri, staging_ref or table_ref, is_header, override and staging_ref is None,
+                override, timeout, wait, schema, source_format, job_id, location, create_options
+            )
+        if staging_ref is not None:
+            # The staging step runs under a job ID derived from the load's, so a re-run after a crash
+            # applies it from the staging table left behind, and concurrent invocations share one job
+            if load_job.state == 'DONE' and not load_job.error_result:
+                try:
+                    staging_table = bigquery.Table(staging_ref)
+                    staging_table.expires = datetime.now(timezone.utc) + timedelta(days=1)
+                    bq_client.update_table(staging_table, ['expires'])
+                except Exception as e:
+                    logger.warning(f"Could not set expiration on staging table {staging_ref.table_id}: {str(e)}")
+            if merge_keys:
+                merge_staging_table(
+                    bq_client, staging_ref, table_ref, merge_keys, location, timeout,
+                    job_id=f"{load_job.job_id}_merge" if job_id else None
+                )
+            else:
+                replace_partitions(
+                    bq_client, staging_ref, table_ref, partition, location, timeout,
+                    job_id=f"{load_job.job_id}_replace" if job_id else None
+                )
+        return load_job
+        
+    except (DataLoadError, QuotaExceededError, InvalidCSVFormatError, PermissionError, ConfigValidationError):
+        raise
+    except (NotFound, Forbidden, GoogleCloudError, api_exceptions.ResourceExhausted) as e:
+        logger.error(f"BigQuery operation failed: {str(e)}")
+        if isinstance(e, (NotFound, Forbidden)):
+            invalidate_dataset_cache(dataset_id, project_id)
+        if is_quota_error(e):
+            raise QuotaExceededError(f"BigQuery quota exceeded: {str(e)}")
+        elif isinstance(e, Forbidden):
+            raise PermissionError(f"Permission denied for BigQuery operation: {str(e)}")
+        elif isinstance(e, NotFound):
+            raise ConfigValidationError(f"BigQuery resource not found: {str(e)}")
+        else:
+            raise DataLoadError(f"Google Cloud error during BigQuery load: {str(e)}")
+    except Exception as e:
+        logger.error(f"Unexpected error during BigQuery load: {str(e)}")
+        raise DataLoadError(f"Unexpected error during BigQuery load: {str(e)}")
+
+
+def _submit_load(
+    bq_client: bigquery.Client,
+    gcs_uri: Union[str, List[str]],
+    table_ref: bigquery.TableReference,
+    is_header: bool,
+    delete_first: bool,
+    override: bool,
+    timeout: int,
+    wait: bool,
+    schema: Optional[List[bigquery.SchemaField]],
+    source_format: str,
+    job_id: Optional[str],
+    location: Optional[str],
+    table_options: Optional[Dict[str, Any]] = None
+) -> bigquery.LoadJob:
+    """Build the job config for one load, replacing the table first if requested, and run it"""
+    dataset_id, table_name = table_ref.dataset_id, table_ref.table_id
+    if delete_first:
+        try:
+            bq_client.delete_table(table_ref, not_found_ok=True)
+            logger.info(f"Deleted existing table {dataset_id}.{table_name} for replacement (override=True)")
+        except Exception as e:
+            logger.warning(f"Could not delete table {dataset_id}.{table_name} before replacement: {str(e)}. Will use WRITE_TRUNCATE instead.")
+
+    skip_leading_rows = 1 if is_header else 0
+    write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE if override else bigquery.WriteDisposition.WRITE_APPEND
+    
+    if source_format == bigquery.SourceFormat.PARQUET:
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=write_disposition,
+        )
+    else:
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.CSV,
+            skip_leading_rows=skip_leading_rows,
+            autodetect=schema is None,
+            write_disposition=write_disposition,
+            max_bad_records=MAX_BAD_RECORDS,
+            ignore_unknown_values=False,
+            allow_quoted_newlines=True,
+            allow_jagged_rows=False,
+        )
+    if schema is not None and source_format != bigquery.SourceFormat.PARQUET:
+        job_config.schema = schema
+        logger.info(f"Using explicit schema for {dataset_id}.{table_name}: {[field.name for field in schema]}")
+    for option, value in (table_options or {}).items():
+        setattr(job_config, option, value)
+    if table_options:
+        logger.info(f"Creating {dataset_id}.{table_name} with {sorted(table_options)}")
+    
+    source_count = len(gcs_uri) if isinstance(gcs_uri, list) else 1
+    logger.info(f"Starting BigQuery load job for {source_count} source file(s) -> {dataset_id}.{table_name}")
+    
+    return _run_load_job(bq_client, gcs_uri, table_ref, job_config, timeout, wait, job_id, location)
+
+
+def _chunks(items: List[Any], size: int) -> List[List[Any]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def prefetch_blob_metadata(storage_client: storage.Client, locations: List[Tuple[str, str]]) -> None:
+    """Load metadata for uncached objects through batched requests"""
+    with _blob_cache_lock:
+        missing = [(b, p) for b, p in dict.fromkeys(locations) if f"gs://{b}/{p}" not in _blob_metadata_cache]
+    if len(missing) < 2:
+        return
+
+    for chunk in _chunks(missing, GCS_BATCH_SIZE):
+        blobs = []
+        count_gcs_call()
+        # Failed sub-requests (e.g. 404) leave the blob without a generation
+        with storage_client.batch(raise_exception=False):
+            for bucket_name, file_path in chunk:
+                blob = storage_client.bucket(bucket_name).blob(file_path)
+                blob.reload()
+                blobs.append((bucket_name, blob))
+        with _blob_cache_lock:
+            for bucket_name, blob in blobs:
+                _blob_metadata_cache[f"gs://{bucket_name}/{blob.name}"] = blob if blob.generation else None
+
+
+def _copy_object(storage_client: storage.Client, source_blob: storage.Blob, dest_bucket_name: str, dest_path: str) -> storage.Blob:
+    """Server-side copy pinned to the source generation. Large objects use resumable rewrite tokens."""
+    dest_bucket = storage_client.bucket(dest_bucket_name)
+    if (source_blob.size or 0) < REWRITE_THRESHOLD_MB * 1024 * 1024:
+        count_gcs_call()
+        return source_blob.bucket.copy_blob(
+            source_blob, dest_bucket, dest_path,
+            if_source_generation_match=source_blob.generation
+        )
+
+    dest_blob = dest_bucket.blob(dest_path)
+    token = None
+    while True:
+        count_gcs_call()
+        token, bytes_rewritten, total_bytes = dest_blob.rewrite(
+            source_blob, token=token,
+            if_source_generation_match=source_blob.generation
+        )
+        if token is None:
+            return dest_blob
+        logger.info(f"Rewrite of {source_blob.name} in progress: {bytes_rewritten}/{total_bytes} bytes")
+
+
+def move_files(
+    storage_client: storage.Client,
+    moves: List[Tuple[str, str, str, str]],
+    operation_name: str
+) -> None:
+    """Move (source bucket, source path, dest bucket, dest path) objects concurrently.
+
+    Copies run in parallel; metadata lookups and source deletes are batched.
+    Raises after all copies have finished if any of them failed.
+    """
+    if not moves:
+        return
+    prefetch_blob_metadata(storage_client, [(m[0], m[1]) for m in moves])
+
+    def copy_one(move: Tuple[str, str, str, str]) -> Optional[storage.Blob]:
+        bucket_name, source_path, dest_bucket_name, dest_path = move
+        source_blob = get_blob_metadata(storage_client, bucket_name, source_path)
+        if source_blob is None:
+            logger.warning(f"Source file does not exist: {source_path}, skipping move")
+            return None
+        try:
+            dest_blob = _copy_object(storage_client, source_blob, dest_bucket_name, dest_path)
+        except Forbidden:
+            raise PermissionError(f"Permission denied copying file to {dest_path}")
+        except (ConnectionError, TimeoutError, GoogleCloudError) as e:
+            raise FileProcessingError(f"Network error copying file: {str(e)}")
+        if not dest_blob.generation:
+            raise FileProcessingError(f"Failed to copy file to {dest_path} - destination not found")
+        invalidate_blob_metadata(dest_bucket_name, dest_path)
+        return source_blob
+
+    workers = max(1, min(MOVE_WORKERS, len(moves)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(copy_one, move) for move in moves]
+
+    copied = []
+    errors = []
+    for move, future in zip(moves, futures):
+        try:
+            source_blob = future.result()
+            if source_blob is not None:
+                copied.append((move, source_blob))
+        except Exception as e:
+            logger.error(f"Error moving file {move[1]} to {move[3]}: {str(e)}")
+            errors.append(e)
+
+    # Delete the copied sources; a failed delete leaves a duplicate but does not fail the move
+    for chunk in _chunks(copied, GCS_BATCH_SIZE):
+        try:
+            count_gcs_call()
+            with storage_client.batch(raise_exception=False):
+                for _, source_blob in chunk:
+                    source_blob.delete(if_generation_match=source_blob.generation)
+        except Forbidden:
+            logger.warning(f"Permission denied deleting {len(chunk)} source files")
+        except (ConnectionError, TimeoutError, GoogleCloudError) as e:
+            logger.warning(f"Network error deleting source files: {str(e)}")
+        except Exception as e:
+            logger.warning(f"Error deleting source files: {str(e)}")
+        for (bucket_name, source_path, _, _), _ in chunk:
+            invalidate_blob_metadata(bucket_name, source_path)
+
+    for (_, source_path, _, dest_path), _ in copied:
+        logger.info(f"Successfully moved file for {operation_name}: {source_path} -> {dest_path}")
+
+    if errors:
+        if len(errors) == 1 and isinstance(errors[0], (PermissionError, FileProcessingError)):
+            raise errors[0]
+        raise FileProcessingError(f"Failed to move {len(errors)} of {len(moves)} files: {str(errors[0])}")
+
+
+def move_file_safely(
+    storage_client: storage.Client,
+    bucket_name: str,
+    source_path: str,
+    dest_bucket: str,
+    dest_path: str,
+    operation_name: str
+) -> None:
+    """Safely move file with error handling"""
+    try:
+        move_files(storage_client, [(bucket_name, source_path, dest_bucket, dest_path)], operation_name)
+    except Exception as e:
+        logger.error(f"Error moving file {source_path} to {dest_path}: {str(e)}")
+        raise FileProcessingError(f"Failed to move file: {str(e)}")
+
+
+def tag_files_processed(storage_client: storage.Client, locations: List[Tuple[str, str]], table_id: str) -> None:
+    """Mark objects as processed in place with a metadata patch pinned to the loaded generation"""
+    processed_at = datetime.now(timezone.utc).isoformat()
+    cached = [(b, p, get_blob_metadata(storage_client, b, p)) for b, p in locations]
+    failed = []
+
+    for chunk in _chunks([c for c in cached if c[2] is not None], GCS_BATCH_SIZE):
+        patched = []
+        count_gcs_call()
+        with storage_client.batch(raise_exception=False):
+            for bucket_name, file_path, source_blob in chunk:
+                blob = storage_client.bucket(bucket_name).blob(file_path)
+                blob.metadata = {PROCESSED_MARKER_KEY: processed_at, PROCESSED_TABLE_KEY: table_id}
+                blob.patch(
+                    if_generation_match=source_blob.generation,
+                    if_metageneration_match=source_blob.metageneration
+                )
+                patched.append((bucket_name, file_path, blob))
+        # A failed sub-request replaces the blob properties with the error payload
+        for bucket_name, file_path, blob in patched:
+            invalidate_blob_metadata(bucket_name, file_path)
+            if not is_marked_processed(blob):
+                failed.append(f"gs://{bucket_name}/{file_path}")
+            else:
+                logger.info(f"Tagged as processed: gs://{bucket_name}/{file_path}")
+
+    for bucket_name, file_path, source_blob in cached:
+        if source_blob is None:
+            logger.warning(f"Source file does not exist: {file_path}, skipping tag")
+
+    if failed:
+        raise FileProcessingError(
+            f"Failed to tag {len(failed)} file(s) as processed (changed since load or permission denied): {', '.join(failed[:5])}"
+        )
+
+
+def check_archive_collisions(locations: List[Tuple[str, str]]) -> None:
+    """
+    Fail when two objects would be moved to the same processed/ path, since the later copy
+    would silently overwrite the earlier one before both sources are deleted
+    """
+    if ARCHIVE_MODE == 'tag':
+        return
+    seen: Dict[str, str] = {}
+    for b, p in locations:
+        destination = f"processed/{os.path.basename(p)}"
+        if destination in seen:
+            raise FileProcessingError(
+                f"gs://{b}/{p} and {seen[destination]} would both be archived to {destination}; "
+                f"rename one of them before loading"
+            )
+        seen[destination] = f"gs://{b}/{p}"
+
+
+def archive_files(
+    storage_client: storage.Client,
+    locations: List[Tuple[str, str]],
+    bucket_name: str,
+    table_id: str,
+    operation_name: str
+) -> None:
+    """Archive processed objects according to ARCHIVE_MODE: move them to processed/ or tag them in place"""
+    if ARCHIVE_MODE == 'tag':
+        tag_files_processed(storage_client, locations, table_id)
+        return
+    check_archive_collisions(locations)
+    move_files(
+        storage_client,
+        [(b, p, bucket_name, f"processed/{os.path.basename(p)}") for b, p in locations],
+        operation_name
+    )
+
+
+def _get_sendgrid_session() -> requests.Session:
+    """Return a shared keep-alive session for the SendGrid API. Secrets must already be loaded."""
+    global _sendgrid_session
+    with _notify_lock:
+        if _sendgrid_session is None:
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.headers.update({
+                'Authorization': f"Bearer {SENDGRID_API_KEY}",
+                'Content-Type': 'application/json',
+            })
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+            _sendgrid_session = session
+        return _sendgrid_session
+
+
+def _write_outbox(to_email: list, subject: str, content: str) -> None:
+    """Local SendGrid stand-in: write the message as a JSON file to NOTIFY_OUTBOX_DIR"""
+    os.makedirs(NOTIFY_OUTBOX_DIR, exist_ok=True)
+    path = os.path.join(NOTIFY_OUTBOX_DIR, f"{time.time_ns()}-{threading.get_ident()}.json")
+    with open(path, 'w') as f:
+        json.dump({'from': FROM_EMAIL, 'to': list(to_email), 'subject': subject, 'html': content}, f)
+    logger.info(f"Email written to outbox: {path}")
+
+
+def _deliver_email(to_email: list, subject: str, content: str, project_id: Optional[str] = None) -> None:
+    """Load secrets if needed and send one message through the pooled SendGrid session"""
+    if NOTIFY_OUTBOX_DIR:
+        _write_outbox(to_email, subject, content)
+        return
+
+    try:
+        _load_secrets(project_id)
+    except SecretError as e:
+        logger.error(f"Secret validation failed: {str(e)}")
+        raise SecretError("Secret validation failed from Secret Manager")
+
+    from sendgrid.helpers.mail import Mail
+
+    message = Mail(
+        from_email=FROM_EMAIL,
+        to_emails=to_email,
+        subject=subject,
+        html_content=content
+    )
+    response = _get_sendgrid_session().post(SENDGRID_SEND_URL, json=message.get(), timeout=SENDGRID_TIMEOUT_SECONDS)
+    if response.status_code >= 300:
+        raise RuntimeError(f"SendGrid returned {response.status_code}: {response.text[:200]}")
+    logger.info(f"Email sent via SendGrid. Status: {response.status_code}")
+
+
+def _record_send(started: float, enqueued_at: Optional[float], ok: bool, inline: bool = False) -> None:
+    send_ms = (time.monotonic() - started) * 1000
+    with _notify_lock:
+        _notify_stats['sent' if ok else 'failed'] += 1
+        if inline:
+            _notify_stats['sent_inline'] += 1
+        _notify_stats['total_send_ms'] += send_ms
+        _notify_stats['max_send_ms'] = max(_notify_stats['max_send_ms'], send_ms)
+        if enqueued_at is not None:
+            _notify_stats['total_wait_ms'] += (started - enqueued_at) * 1000
+
+
+def _notification_worker() -> None:
+    """Send queued notifications one at a time for the lifetime of the instance"""
+    while True:
+        item = _notify_queue.get()
+        started = time.monotonic()
+        try:
+            if item.get('to_email'):
+                _deliver_email(item['to_email'], item['subject'], item['content'], item['project_id'])
+                _record_send(started, item['enqueued_at'], ok=True)
+            else:
+                # Warm-up request: load secrets and open the session ahead of the first message
+                _load_secrets(item['project_id'])
+                _get_sendgrid_session()
+        except Exception as e:
+            if item.get('to_email'):
+                _record_send(started, item['enqueued_at'], ok=False)
+                logger.error(f"Error sending email notification: {str(e)}")
+            else:
+                logger.warning(f"Could not prepare email notifications: {str(e)}")
+        finally:
+            _notify_queue.task_done()
+
+
+def _ensure_notification_worker() -> None:
+    global _notify_worker
+    with _notify_lock:
+        if _notify_worker is None or not _notify_worker.is_alive():
+            _notify_worker = threading.Thread(target=_notification_worker, name='notification-dispatcher', daemon=True)
+            _notify_worker.start()
+
+
+def _enqueue_notification(item: Dict[str, Any]) -> bool:
+    """Queue a notification for the background worker. Returns False if the queue is full."""
+    _ensure_notification_worker()
+    item['enqueued_at'] = time.monotonic()
+    try:
+        _notify_queue.put_nowait(item)
+    except queue.Full:
+        return False
+    with _notify_lock:
+        if item.get('to_email'):
+            _notify_stats['enqueued'] += 1
+        _notify_stats['max_queue_depth'] = max(_notify_stats['max_queue_depth'], _notify_queue.qsize())
+    return True
+
+
+def warm_notifications(project_id: Optional[str] = None) -> None:
+    """Load SendGrid secrets and open the session in the background while the load runs"""
+    if EMAIL_ENABLED and NOTIFY_ASYNC and not (_secrets_loaded and _sendgrid_session is not None):
+        _enqueue_notification({'to_email': None, 'project_id': project_id})
+
+
+def drain_notifications(timeout: float = NOTIFY_DRAIN_SECONDS) -> bool:
+    """Wait until queued notifications are sent or the deadline passes. Returns True if the queue drained."""
+    deadline = time.monotonic() + timeout
+    flush_notification_digests()
+    hold_notification_digests()
+    with _notify_queue.all_tasks_done:
+        while _notify_queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                logger.warning(f"Notification drain deadline reached with {_notify_queue.unfinished_tasks} message(s) pending")
+                return False
+            _notify_queue.all_tasks_done.wait(remaining)
+    return True
+
+
+def _flush_at_exit() -> None:
+    if _digests:
+        flush_notification_digests(force=True)
+        drain_notifications()
+
+
+atexit.register(_flush_at_exit)
+
+
+def get_notification_stats() -> Dict[str, Any]:
+    """Return queue depth and send latency counters for the notification dispatcher"""
+    with _notify_lock:
+        stats = dict(_notify_stats)
+    attempts = stats['sent'] + stats['failed']
+    queued = stats['enqueued']
+    stats['queue_depth'] = _notify_queue.qsize()
+    with _digest_lock:
+        stats['pending_digest_messages'] = sum(len(d['items']) for d in _digests.values())
+    total_send_ms = stats.pop('total_send_ms')
+    total_wait_ms = stats.pop('total_wait_ms')
+    stats['avg_send_ms'] = round(total_send_ms / attempts, 1) if attempts else 0.0
+    stats['avg_queue_wait_ms'] = round(total_wait_ms / queued, 1) if queued else 0.0
+    stats['max_send_ms'] = round(stats['max_send_ms'], 1)
+    return stats
+
+
+def _take_send_token() -> bool:
+    """Token bucket refilled at NOTIFY_RATE_PER_MINUTE. Returns False when outbound sends are rate limited."""
+    global _rate_tokens, _rate_updated_at
+    if NOTIFY_RATE_PER_MINUTE <= 0:
+        return True
+    now = time.monotonic()
+    _rate_tokens = min(float(NOTIFY_RATE_PER_MINUTE), _rate_tokens + (now - _rate_updated_at) * NOTIFY_RATE_PER_MINUTE / 60.0)
+    _rate_updated_at = now
+    if _rate_tokens < 1:
+        return False
+    _rate_tokens -= 1
+    return True
+
+
+def _admit_notification(to_email: list, subject: str, content: str, category: Optional[str]) -> bool:
+    """
+    Decide whether a message goes out now. Duplicates are dropped; repeats of the same
+    (recipients, category) inside an open window, and messages over the rate limit, are held for a digest.
+    """
+    now = time.monotonic()
+    recipients = tuple(sorted(e.lower() for e in to_email))
+    fingerprint = hashlib.sha256(f"{recipients}|{subject}|{content}".encode()).hexdigest()
+    with _digest_lock:
+        while _recent_fingerprints and next(iter(_recent_fingerprints.values())) <= now - NOTIFY_DEDUP_SECONDS:
+            _recent_fingerprints.popitem(last=False)
+        if fingerprint in _recent_fingerprints:
+            stat = 'deduplicated'
+        else:
+            _recent_fingerprints[fingerprint] = now
+            key = (recipients, category or 'other')
+            digest = _digests.get(key)
+            if category and digest is not None and now < digest['window_end']:
+                stat = 'digested'
+            elif _take_send_token():
+                if category:
+                    _digests[key] = {'window_end': now + NOTIFY_DIGEST_WINDOW_SECONDS, 'items': []}
+                return True
+            elif not category:
+                return True  # uncategorised messages are never held back
+            else:
+                stat = 'rate_limited'
+                if digest is None:
+                    digest = _digests[key] = {'window_end': now + NOTIFY_DIGEST_WINDOW_SECONDS, 'items': []}
+            if stat != 'deduplicated':
+                _digests[key]['items'].append({'subject': subject, 'at': datetime.now(timezone.utc).isoformat()})
+    with _notify_lock:
+        _notify_stats[stat] += 1
+    logger.info(f"Email {stat} for {len(recipients)} recipient(s): {subject}")
+    return False
+
+
+def _digest_body(category: str, items: List[Dict[str, Any]], window_seconds: int) -> str:
+    rows = "".join(f"<tr><td>{item['at']}</td><td>{item['subject']}</td></tr>" for item in items)
+    return f"""<html>
+        <body>
+        <h2>{len(items)} further notification(s): {category}</h2>
+        <p>These messages were collapsed into one digest (window: {window_seconds} seconds).
+           Please check the Cloud Function logs for details of each one.</p>
+        <table border="1" cellpadding="4">
+        <tr><th>Time (UTC)</th><th>Subject</th></tr>
+        {rows}
+        </table>
+        </body>
+        </html>"""
+
+
+def _digest_record_path(recipients: Tuple[str, ...], category: str) -> str:
+    return f"{NOTIFY_DIGEST_PREFIX}{hashlib.sha256(f'{recipients}|{category}'.encode()).hexdigest()[:32]}.json"
+
+
+def _list_digest_records() -> List[str]:
+    if NOTIFY_DIGEST_DIR:
+        directory = os.path.join(NOTIFY_DIGEST_DIR, NOTIFY_DIGEST_PREFIX)
+        return [f"{NOTIFY_DIGEST_PREFIX}{name}" for name in os.listdir(directory)] if os.path.isdir(directory) else []
+    count_gcs_call()
+    return [blob.name for blob in get_storage_client().list_blobs(NOTIFY_DIGEST_BUCKET, prefix=NOTIFY_DIGEST_PREFIX)]
+
+
+def hold_notification_digests() -> None:
+    """
+    Move messages held in open digest windows out of process memory before the request returns:
+    into NOTIFY_DIGEST_BUCKET (or NOTIFY_DIGEST_DIR), or straight out as a digest when neither is set.
+    """
+    with _digest_lock:
+        held = [(key, d['window_end'], d['items']) for key, d in _digests.items() if d['items']]
+        for key, _, _ in held:
+            _digests[key]['items'] = []
+    if not held:
+        return
+    unsaved = []
+    for (recipients, category), window_end, items in held:
+        closes_at = time.time() + max(0.0, window_end - time.monotonic())
+
+        def add(record: Dict[str, Any]) -> None:
+            if not record.get('items'):
+                record.update(recipients=list(recipients), category=category, window_end=closes_at, items=[])
+            record['window_end'] = min(record['window_end'], closes_at)
+            record['items'].extend(items)
+
+        if not (NOTIFY_DIGEST_BUCKET or NOTIFY_DIGEST_DIR) or _update_json_record(
+            NOTIFY_DIGEST_BUCKET, NOTIFY_DIGEST_DIR, _digest_record_path(recipients, category), add
+        ) is None:
+            unsaved.append(((recipients, category), items))
+    _send_digests(unsaved, None)
+
+
+def _claim_persisted_digests() -> List[Tuple[Tuple[Tuple[str, ...], str], List[Dict[str, Any]]]]:
+    """Take the items of every persisted digest whose window has closed, so only one request sends each"""
+    if not (NOTIFY_DIGEST_BUCKET or NOTIFY_DIGEST_DIR):
+        return []
+    ready = []
+    try:
+        paths = _list_digest_records()
+    except Exception as e:
+        logger.warning(f"Could not list persisted notification digests: {str(e)}")
+        return []
+    for path in paths:
+        record = _read_json_record(NOTIFY_DIGEST_BUCKET, NOTIFY_DIGEST_DIR, path)
+        if not record.get('items') or record['window_end'] > time.time():
+            continue
+        claimed: Dict[str, Any] = {}
+
+        def take(record: Dict[str, Any]) -> None:
+            if record.get('items') and record['window_end'] <= time.time():
+                claimed.update(record)
+                record['items'] = []
+
+        if _update_json_record(NOTIFY_DIGEST_BUCKET, NOTIFY_DIGEST_DIR, path, take) is not None and claimed:
+            ready.append(((tuple(claimed['recipients']), claimed['category']), claimed['items']))
+    return ready
+
+
+def flush_notification_digests(force: bool = False, project_id: Optional[str] = None, persisted: bool = False) -> int:
+    """
+    Send a digest for every window that has closed (or all of this process's windows if force).
+    With persisted, closed windows held in storage by earlier requests on any instance are claimed and
+    sent too; only the scheduled run_scheduled_maintenance does that, so load events never list them.
+    Returns the number sent.
+    """
+    now = time.monotonic()
+    with _digest_lock:
+        due = [key for key, d in _digests.items() if force or now >= d['window_end']]
+        ready = [(key, _digests.pop(key)['items']) for key in due]
+    if persisted:
+        ready += _claim_persisted_digests()
+    return _send_digests(ready, project_id)
+
+
+def _send_digests(ready: List[Tuple[Tuple[Tuple[str, ...], str], List[Dict[str, Any]]]], project_id: Optional[str]) -> int:
+    sent = 0
+    for (recipients, category), items in ready:
+        if not items:
+            continue
+        subject = f"BigQuery Load Digest - {len(items)} x {category}"
+        _dispatch_email(list(recipients), subject, _digest_body(category, items, NOTIFY_DIGEST_WINDOW_SECONDS), project_id)
+        sent += 1
+    if sent:
+        with _notify_lock:
+            _notify_stats['digests_sent'] += sent
+    return sent
+
+
+def _dispatch_email(to_email: list, subject: str, content: str, project_id: Optional[str]) -> None:
+    """Hand a message to the background dispatcher, or send it inline if async is off or the queue is full"""
+    if NOTIFY_ASYNC:
+        item = {'to_email': list(to_email), 'subject': subject, 'content': content, 'project_id': project_id}
+        if _enqueue_notification(item):
+            logger.info(f"Email queued for {len(item['to_email'])} recipient(s): {subject}")
+            return
+        logger.warning("Notification queue is full; sending inline")
+
+    started = time.monotonic()
+    try:
+        _deliver_email(to_email, subject, content, project_id)
+        _record_send(started, None, ok=True, inline=True)
+    except SecretError:
+        raise
+    except Exception as e:
+        _record_send(started, None, ok=False, inline=True)
+        logger.error(f"Error sending email notification: {str(e)}")
+
+
+@retry_on_failure(max_retries=1, delay=5)
+def send_email_notifications(
+    to_email: list,
+    subject: str,
+    content: str,
+    is_error: bool = False,
+    project_id: Optional[str] = None,
+    category: Optional[str] = None
+) -> None:
+    """
+    Send email notification about the Cloud Function execution status.
+    Messages with a category (e.g. the error class) are deduplicated, rate limited and digested per recipient list.
+    """
+    if not EMAIL_ENABLED:
+        logger.info("Skipping email send (EMAIL_ENABLED is False).")
+        return
+    
+    if not to_email:
+        logger.warning("Skipping email send (no recipient email provided).")
+        return
+
+    if not _admit_notification(to_email, subject, content, category):
+        return
+    _dispatch_email(to_email, subject, content, project_id)
+
+
+def resolve_source_files(storage_client: storage.Client, file_location: Union[str, List[str]], data_file_name: str) -> List[List[str]]:
+    """Resolve and validate the data files for one load. Returns [bucket, path] pairs."""
+    if is_multi_source(file_location):
+        try:
+            data_blobs = expand_source_uris(storage_client, file_location)
+            if not data_blobs:
+                raise FileNotFoundError(f"No data files matched file_location: {file_location}")
+            
+            for data_blob in data_blobs:
+                check_file_size(data_blob, max_size_mb=MAX_ACCEPTED_FILE_SIZE_MB)
+            
+            try:
+                validate_csv_basic_format(data_blobs[0])
+            except InvalidCSVFormatError as e:
+                raise e
+            except Exception as e:
+                logger.warning(f"CSV format validation warning: {str(e)}")
+            
+            check_archive_collisions([(b.bucket.name, b.name) for b in data_blobs])
+            total_mb = sum(b.size for b in data_blobs) / (1024 * 1024)
+            logger.info(f"Data files validated: {len(data_blobs)} files ({total_mb:.2f} MB)")
+            
+        except Exception as e:
+            logger.error(f"Error accessing data files: {str(e)}")
+            raise
+        
+        return [[data_blob.bucket.name, data_blob.name] for data_blob in data_blobs]
+
+    data_bucket_name, data_file_path = parse_gcs_uri(file_location)
+    
+    logger.info(f"Data bucket: {data_bucket_name}")
+    logger.info(f"Data file path: {data_file_path}")
+    logger.info(f"Data file name: {data_file_name}.csv")
+    
+    if data_file_path and not data_file_path.endswith('/'):
+        data_file_path += '/'
+    
+    try:
+        check_bucket_exists(storage_client, data_bucket_name)
+        
+        data_file_full_path = f"{data_file_path}{data_file_name}.csv"
+        
+        check_file_permissions(storage_client, data_bucket_name, data_file_full_path)
+        
+        data_blob = get_blob_metadata(storage_client, data_bucket_name, data_file_full_path)
+        
+        if data_blob is None:
+            raise FileNotFoundError(f"Data file not found: {data_file_full_path} in bucket {data_bucket_name}")
+        if is_marked_processed(data_blob):
+            raise FileNotFoundError(f"Data file already processed: {data_file_full_path} in bucket {data_bucket_name}")
+        
+        logger.info(
+            f"Data file exists: gs://{data_bucket_name}/{data_file_full_path} "
+            f"(generation: {data_blob.generation}, crc32c: {data_blob.crc32c})"
+        )
+        
+        check_file_size(data_blob, max_size_mb=MAX_ACCEPTED_FILE_SIZE_MB)
+        
+        try:
+            validate_csv_basic_format(data_blob)
+        except InvalidCSVFormatError as e:
+            raise e
+        except Exception as e:
+            logger.warning(f"CSV format validation warning: {str(e)}")
+        
+        logger.info(f"Data file validated: {data_file_name}.csv ({data_blob.size / (1024*1024):.2f} MB)")
+        
+    except Exception as e:
+        logger.error(f"Error accessing data file: {str(e)}")
+        raise 
+    
+    return [[data_bucket_name, data_file_full_path]]
+
+
+def content_fingerprint(blobs: List[storage.Blob]) -> Optional[str]:
+    """Digest of the source objects' sizes and checksums, independent of their names. None if a checksum is missing."""
+    parts = []
+    for blob in blobs:
+        if not blob.crc32c and not blob.md5_hash:
+            return None
+        parts.append(f"{blob.size}:{blob.crc32c or ''}:{blob.md5_hash or ''}")
+    return hashlib.sha256("|".join(sorted(parts)).encode()).hexdigest()
+
+
+def _ledger_path(full_table_id: str, fingerprint: str) -> str:
+    return f"{LOAD_LEDGER_PREFIX}{full_table_id}/{fingerprint}.json"
+
+
+def find_ledger_entry(storage_client: storage.Client, ledger_bucket: str, full_table_id: str, fingerprint: str) -> Optional[Dict[str, str]]:
+    """Look up an earlier load of identical content into the same table. Reads object metadata only."""
+    path = _ledger_path(full_table_id, fingerprint)
+    if LOAD_LEDGER_DIR:
+        local_path = os.path.join(LOAD_LEDGER_DIR, path)
+        if not os.path.exists(local_path):
+            return None
+        with open(local_path) as f:
+            return json.load(f)
+    blob = get_blob_metadata(storage_client, ledger_bucket, path)
+    return dict(blob.metadata or {}) if blob is not None else None
+
+
+def list_ledger_entries(storage_client: storage.Client, ledger_bucket: str, full_table_id: str) -> List[str]:
+    """Paths of every load recorded for a table since it was last replaced"""
+    prefix = f"{LOAD_LEDGER_PREFIX}{full_table_id}/"
+    if LOAD_LEDGER_DIR:
+        directory = os.path.join(LOAD_LEDGER_DIR, prefix)
+        return [f"{prefix}{name}" for name in sorted(os.listdir(directory))] if os.path.isdir(directory) else []
+    count_gcs_call()
+    return [blob.name for blob in storage_client.list_blobs(ledger_bucket, prefix=prefix)]
+
+
+def clear_ledger_entries(storage_client: storage.Client, ledger_bucket: str, full_table_id: str) -> None:
+    """Forget every load recorded for a table, once a load has replaced its contents"""
+    try:
+        for path in list_ledger_entries(storage_client, ledger_bucket, full_table_id):
+            if LOAD_LEDGER_DIR:
+                os.remove(os.path.join(LOAD_LEDGER_DIR, path))
+            else:
+                count_gcs_call()
+                storage_client.bucket(ledger_bucket).blob(path).delete()
+                invalidate_blob_metadata(ledger_bucket, path)
+    except Exception as e:
+        logger.warning(f"Could not clear dedup ledger entries for {full_table_id}: {str(e)}")
+
+
+def record_ledger_entry(storage_client: storage.Client, load_context: Dict[str, Any], load_job: bigquery.LoadJob) -> None:
+    """
+    Record a finished load in the dedup ledger. The first writer for a fingerprint wins.
+    A load that replaced the table first drops the entries for content it overwrote.
+    """
+    fingerprint = load_context.get('content_fingerprint')
+    if not fingerprint:
+        return
+    full_table_id = load_context['full_table_id']
+    if load_context.get('replaces_table'):
+        clear_ledger_entries(storage_client, load_context['ledger_bucket'], full_table_id)
+    entry = {
+        'job_id': str(load_job.job_id),
+        'rows': str(load_job.output_rows),
+        'loaded_at': datetime.now(timezone.utc).isoformat(),
+        'config_file': load_context['config_file_name'],
+        'sources': ", ".join(f"gs://{b}/{p}" for b, p in load_context['source_files'])[:1000],
+    }
+    path = _ledger_path(full_table_id, fingerprint)
+    try:
+        if LOAD_LEDGER_DIR:
+            local_path = os.path.join(LOAD_LEDGER_DIR, path)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            try:
+                with open(local_path, 'x') as f:
+                    json.dump(entry, f)
+            except FileExistsError:
+                logger.info(f"Dedup ledger already has {fingerprint[:12]} for {full_table_id}")
+                return
+        else:
+            blob = storage_client.bucket(load_context['ledger_bucket']).blob(path)
+            blob.metadata = entry
+            count_gcs_call()
+            blob.upload_from_string(json.dumps(entry), content_type='application/json', if_generation_match=0)
+        logger.info(f"Recorded load of {fingerprint[:12]} into {full_table_id} in the dedup ledger")
+    except api_exceptions.PreconditionFailed:
+        logger.info(f"Dedup ledger already has {fingerprint[:12]} for {full_table_id}")
+    except Exception as e:
+        logger.warning(f"Could not record dedup ledger entry for {full_table_id}: {str(e)}")
+
+
+def check_duplicate_load(
+    storage_client: storage.Client,
+    source_files: List[List[str]],
+    full_table_id: str,
+    ledger_bucket: str,
+    force_reload: bool = False,
+    replaces_table: bool = False
+) -> Tuple[Optional[str], Optional[Dict[str, str]]]:
+    """
+    Fingerprint the sources and look them up in the ledger. Returns (fingerprint, earlier entry or None).
+    A load that replaces the table is only a duplicate when the table holds exactly that content.
+    """
+    if not LOAD_DEDUP_ENABLED or not (LOAD_LEDGER_BUCKET or LOAD_LEDGER_DIR):
+        return None, None
+    blobs = [get_blob_metadata(storage_client, b, p) for b, p in source_files]
+    fingerprint = content_fingerprint([b for b in blobs if b is not None]) if all(blobs) else None
+    if fingerprint is None or force_reload:
+        return fingerprint, None
+    entry = find_ledger_entry(storage_client, ledger_bucket, full_table_id, fingerprint)
+    if entry is not None and replaces_table:
+        if list_ledger_entries(storage_client, ledger_bucket, full_table_id) != [_ledger_path(full_table_id, fingerprint)]:
+            logger.info(f"{full_table_id} was loaded with other content since {fingerprint[:12]}; replacing it")
+            return fingerprint, None
+    if entry is not None:
+        logger.info(
+            f"Identical content was already loaded into {full_table_id} by job {entry.get('job_id')} "
+            f"at {entry.get('loaded_at')}; skipping load"
+        )
+    return fingerprint, entry
+
+
+def acknowledge_duplicate_load(
+    storage_client: storage.Client,
+    config_file_name: str,
+    bucket_name: str,
+    source_files: List[List[str]],
+    full_table_id: str,
+    ledger_entry: Dict[str, str],
+    email_list: List[str],
+    project_id: str
+) -> None:
+    """Archive the files of a duplicate upload without loading them and tell the recipients"""
+    try:
+        archive_files(storage_client, [tuple(f) for f in source_files], bucket_name, full_table_id, "duplicate data file")
+        archive_files(storage_client, [(bucket_name, config_file_name)], bucket_name, full_table_id, "duplicate config file")
+    except (FileProcessingError, PermissionError) as e:
+        logger.error(f"Failed to archive duplicate upload {config_file_name}: {str(e)}")
+
+    subject = f"BigQuery Data Load Skipped (duplicate) - {full_table_id}"
+    body = f"""<html>
+        <body>
+        <h2>BigQuery Data Load Skipped: Content Already Loaded</h2>
+        <p><strong>Table:</strong> {full_table_id}</p>
+        <p><strong>Config File:</strong> {config_file_name}</p>
+        <p><strong>Source Files:</strong> {", ".join(f"gs://{b}/{p}" for b, p in source_files)}</p>
+        <p><strong>Previous Job ID:</strong> {ledger_entry.get('job_id')}</p>
+        <p><strong>Previously Loaded At:</strong> {ledger_entry.get('loaded_at')}</p>
+        <p>Set "force_reload": true in the config to load it again.</p>
+        </body>
+        </html>"""
+    try:
+        send_email_notifications(email_list, subject, body, is_error=False, project_id=project_id, category='DuplicateSkipped')
+    except Exception as email_e:
+        logger.error(f"CRITICAL: Failed to send duplicate load notification: {str(email_e)}")
+
+
+def _checkpoint_path(bucket_name: str, config_file_name: str, generation: Any) -> str:
+    return f"{CHECKPOINT_PREFIX}{bucket_name}/{config_file_name}.{generation}.json"
+
+
+def load_checkpoint(storage_client: storage.Client, bucket_name: str, config_file_name: str, generation: Any) -> Optional[Dict[str, Any]]:
+    """
+    Read the stage checkpoint for one config generation, or start an empty one. None without a generation
+    or when neither CHECKPOINT_BUCKET nor CHECKPOINT_DIR is set.
+    """
+    if not generation or not (CHECKPOINT_BUCKET or CHECKPOINT_DIR):
+        return None
+    path = _checkpoint_path(bucket_name, config_file_name, generation)
+    checkpoint = {'config_file_name': config_file_name, 'generation': str(generation), 'stages': {},
+                  '_bucket': CHECKPOINT_BUCKET, '_path': path, '_object_generation': 0}
+    try:
+        if CHECKPOINT_DIR:
+            local_path = os.path.join(CHECKPOINT_DIR, path)
+            if os.path.exists(local_path):
+                with open(local_path) as f:
+                    checkpoint.update(json.load(f))
+        else:
+            blob = get_blob_metadata(storage_client, checkpoint['_bucket'], path)
+            if blob is not None:
+                count_gcs_call()
+                checkpoint.update(json.loads(blob.download_as_text()))
+                checkpoint['_object_generation'] = blob.generation
+    except Exception as e:
+        logger.warning(f"Could not read checkpoint {path}; starting from the first stage: {str(e)}")
+    done = [stage for stage in CHECKPOINT_STAGES if stage in checkpoint['stages']]
+    if done:
+        logger.info(f"Checkpoint for {config_file_name}#{generation}: completed stages {done}")
+    return checkpoint
+
+
+def stage_done(checkpoint: Optional[Dict[str, Any]], stage: str) -> bool:
+    return checkpoint is not None and stage in checkpoint['stages']
+
+
+def mark_stage(storage_client: storage.Client, checkpoint: Optional[Dict[str, Any]], stage: str, **details: Any) -> None:
+    """Persist a completed stage. A failed write only means the stage may run again on a re-run."""
+    if checkpoint is None:
+        return
+    checkpoint['stages'][stage] = {'completed_at': datetime.now(timezone.utc).isoformat(), **details}
+    record = {k: v for k, v in checkpoint.items() if not k.startswith('_')}
+    try:
+        if CHECKPOINT_DIR:
+            local_path = os.path.join(CHECKPOINT_DIR, checkpoint['_path'])
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'w') as f:
+                json.dump(record, f)
+        else:
+            blob = storage_client.bucket(checkpoint['_bucket']).blob(checkpoint['_path'])
+            count_gcs_call()
+            blob.upload_from_string(
+                json.dumps(record), content_type='application/json',
+                if_generation_match=checkpoint['_object_generation']
+            )
+            checkpoint['_object_generation'] = blob.generation
+    except Exception as e:
+        logger.warning(f"Could not save checkpoint stage '{stage}' for {checkpoint['config_file_name']}: {str(e)}")
+
+
+def clear_checkpoint(storage_client: storage.Client, checkpoint: Optional[Dict[str, Any]]) -> None:
+    """Remove a checkpoint that is no longer needed"""
+    if checkpoint is None:
+        return
+    try:
+        if CHECKPOINT_DIR:
+            os.remove(os.path.join(CHECKPOINT_DIR, checkpoint['_path']))
+        elif checkpoint['_object_generation']:
+            count_gcs_call()
+            storage_client.bucket(checkpoint['_bucket']).blob(checkpoint['_path']).delete()
+    except (FileNotFoundError, NotFound):
+        pass
+    except Exception as e:
+        logger.warning(f"Could not remove checkpoint {checkpoint['_path']}: {str(e)}")
+
+
+def finalize_load(
+    storage_client: storage.Client,
+    load_context: Dict[str, Any],
+    load_job: bigquery.LoadJob,
+    checkpoint: Optional[Dict[str, Any]] = None
+) -> None:
+    """Run the post-load stages: move the data and config files to processed/ and send the success email.
+    Stages already recorded in the config generation's checkpoint are skipped."""
+    config_file_name = load_context['config_file_name']
+    bucket_name = load_context['bucket_name']
+    source_files = load_context['source_files']
+    full_table_id = load_context['full_table_id']
+    gcs_uri = load_context['gcs_uri']
+    email_list = load_context['email_list']
+    project_id = load_context['project_id']
+    if checkpoint is None:
+        checkpoint = load_checkpoint(storage_client, bucket_name, config_file_name, load_context.get('config_generation'))
+
+    if not stage_done(checkpoint, 'load'):
+        logger.info(f"BigQuery load from {gcs_uri} to {full_table_id} completed successfully.")
+        logger.info(f"BigQuery job state: {load_job.state}")
+        reconcile_row_count(load_job, load_context.get('expected_rows'))
+        if not load_context.get('micro_batch'):
+            record_load_stats(storage_client, full_table_id, load_context, load_job)
+        record_ledger_entry(storage_client, load_context, load_job)
+        
+        delete_staging_files(storage_client, load_context.get('staging_files', []))
+        mark_stage(storage_client, checkpoint, 'load', job_id=load_job.job_id, location=load_job.location,
+                   project=load_job.project, context=load_context)
+    
+    try:
+        if not stage_done(checkpoint, 'move_data'):
+            logger.info(f"Archiving {len(source_files)} data file(s) ({ARCHIVE_MODE})")
+            archive_files(
+                storage_client, [tuple(f) for f in source_files], bucket_name, full_table_id, "data file processing"
+            )
+            mark_stage(storage_client, checkpoint, 'move_data')
+        
+        if not stage_done(checkpoint, 'move_config'):
+            logger.info(f"Archiving config file ({ARCHIVE_MODE}): {config_file_name}")
+            archive_files(
+                storage_client, [(bucket_name, config_file_name)], bucket_name, full_table_id, "config file processing"
+            )
+            logger.info(f"Config file archived: gs://{bucket_name}/{config_file_name}")
+            mark_stage(storage_client, checkpoint, 'move_config')
+        
+    except (FileProcessingError, PermissionError) as e:
+        logger.error(f"Failed to move files to processed folder: {str(e)}. "
+                     "Data load was successful, but files require manual cleanup.")
+
+        subject = f"Warning: BQ Load Success, Cleanup Failed - {full_table_id}"
+        body = f"""<html>
+            <body>
+            <h2>BigQuery Data Load Completed, but File Cleanup Failed</h2>
+            <p><strong>Table:</strong> {full_table_id}</p>
+            <p><strong>CSV File Path:</strong> {gcs_uri}</p>
+            <p><strong>Config File:</strong> {config_file_name}</p>
+            <p><strong>Error:</strong> Failed to move files to 'processed' folder: {str(e)}</p>
+            <p>The data load was successful, but the original config and data files
+               may still be in their original locations. Manual cleanup is recommended
+               to prevent duplicate processing if this function is re-run on them.</p>
+            </body>
+            </html>"""
+        #send_email_notifications(email, subject, body, is_error=True, project_id=project_id)
+
+        try:
+            # Use fallback email logic
+            # recipient_email = email if email else FROM_EMAIL
+            if not email_list:
+                logger.error(f"No recipient email (config or FROM_EMAIL) found. Cannot send cleanup failure warning.")
+            else:
+                send_email_notifications(email_list, subject, body, is_error=True, project_id=project_id,
+                                         category=f"CleanupFailed:{type(e).__name__}")
+        except Exception as email_e:
+            logger.error(f"CRITICAL: Failed to send cleanup failure notification: {str(email_e)}")
+            logger.error(f"Original file move error was: {str(e)}")
     
+    subject = f"BigQuery Data Load Success - {full_table_id}"
+    body = f"""<html>
+        <body>
+        <h2>BigQuery Data Load Completed Successfully</h2>
+        <p><strong>Table:</strong> {full_table_id}</p>
+        <p><strong>CSV File Path:</strong> {gcs_uri}</p>
+        <p><strong>Config File:</strong> {config_file_name}</p>
+        <p><strong>Rows Loaded:</strong> {load_job.output_rows}</p>
+        <p><strong>Job ID:</strong> {load_job.job_id}</p>
+        </body>
+        </html>"""
     
-    message = Mail(
-        from_email=FROM_EMAIL,
-        to_emails=to_email,
-        subject=subject,
-        html_content=content
+    if not stage_done(checkpoint, 'notify'):
+        send_email_notifications(email_list, subject, body, is_error=False, project_id=project_id, category='LoadSuccess')
+        mark_stage(storage_client, checkpoint, 'notify')
+
+
+def _load_target(
+    storage_client: storage.Client,
+    bq_client: bigquery.Client,
+    target: Dict[str, Any],
+    defaults: Dict[str, Any],
+    project_id: str
+) -> Dict[str, Any]:
+    """Resolve, validate and load one target of a multi-table config. Never raises; errors are reported in the result."""
+    dataset_id = target.get('dataset') or defaults['dataset']
+    table_name = validate_table_name(target['tablename'].replace('-', '_').replace(' ', '_'))
+    result = {
+        'table': f"{dataset_id}.{table_name}",
+        'status': 'FAILED',
+        'source_files': [],
+        'rows': None,
+        'job_id': None,
+        'error': None,
+    }
+    started = time.monotonic()
+    load_sources = None
+    try:
+        source_files = resolve_source_files(storage_client, target['file_location'], target['tablename'])
+        fingerprint, ledger_entry = check_duplicate_load(
+            storage_client, source_files, result['table'], defaults['ledger_bucket'],
+            target.get('force_reload', defaults['force_reload']),
+            target.get('override', defaults['override']) and not target.get('merge_keys', defaults['merge_keys'])
+        )
+        if ledger_entry is not None:
+            result.update(status='DUPLICATE', source_files=source_files, job_id=ledger_entry.get('job_id'))
+            result['duration_seconds'] = round(time.monotonic() - started, 2)
+            return result
+        schema = resolve_table_schema(storage_client, table_name, target.get('schema'))
+        is_header = target.get('is_header', defaults['is_header'])
+        data_blobs = [get_blob_metadata(storage_client, b, p) for b, p in source_files]
+        expected_rows = validate_csv_files(
+            data_blobs, schema=schema, is_header=is_header, full=target.get('full_validation', defaults['full_validation'])
+        )
+        transcode = target.get('transcode_parquet', defaults['transcode_parquet'])
+        load_sources = prepare_load_sources(storage_client, source_files, schema, is_header, transcode)
+        load_uris = load_sources['uris']
+        load_job = load_data_to_bigquery(
+            bq_client=bq_client,
+            gcs_uri=load_uris if len(load_uris) > 1 else load_uris[0],
+            dataset_id=dataset_id,
+            table_name=table_name,
+            project_id=project_id,
+            is_header=is_header,
+            override=target.get('override', defaults['override']),
+            timeout=TIMEOUT_SECONDS,
+            schema=schema,
+            source_format=load_sources['source_format'],
+            job_id=deterministic_job_id(
+                storage_client, source_files, result['table'],
+                salt=datetime.now(timezone.utc).isoformat() if target.get('force_reload', defaults['force_reload']) else ''
+            ),
+            merge_keys=target.get('merge_keys', defaults['merge_keys']),
+            table_options=resolve_table_options(
+                storage_client, table_name, target.get('table_options', defaults['table_options']), target.get('schema')
+            )
+        )
+        reconcile_row_count(load_job, expected_rows)
+        record_ledger_entry(storage_client, {
+            'content_fingerprint': fingerprint,
+            'full_table_id': result['table'],
+            'config_file_name': defaults['config_file_name'],
+            'source_files': source_files,
+            'ledger_bucket': defaults['ledger_bucket'],
+            'replaces_table': target.get('override', defaults['override']) and not target.get('merge_keys', defaults['merge_keys']),
+        }, load_job)
+        result.update(status='SUCCESS', source_files=source_files, rows=load_job.output_rows, job_id=load_job.job_id)
+    except Exception as e:
+        logger.error(f"Load failed for target {result['table']}: {str(e)}")
+        result['error'] = f"{type(e).__name__}: {str(e)}"
+    finally:
+        if load_sources is not None:
+            delete_staging_files(storage_client, load_sources['staging_files'])
+    result['duration_seconds'] = round(time.monotonic() - started, 2)
+    return result
+
+
+def process_multi_table_config(
+    storage_client: storage.Client,
+    bq_client: bigquery.Client,
+    config: Dict[str, Any],
+    config_file_name: str,
+    bucket_name: str,
+    project_id: str,
+    email_list: List[str]
+) -> List[Dict[str, Any]]:
+    """
+    Load every target of a multi-table config concurrently and send one combined notification.
+    Targets are recorded in a checkpoint once loaded and archived. A re-run after a partial failure skips
+    those whose recorded sources are no longer in place, and the record is dropped once every target succeeds.
+    """
+    targets = config['targets']
+    defaults = {
+        'dataset': config.get('dataset'),
+        'override': config.get('override', True),
+        'is_header': config.get('is_header', True),
+        'full_validation': config.get('full_validation', CSV_FULL_VALIDATION),
+        'transcode_parquet': config.get('transcode_parquet', PARQUET_TRANSCODE_ENABLED),
+        'force_reload': config.get('force_reload', False),
+        'merge_keys': config.get('merge_keys'),
+        'table_options': config.get('table_options'),
+        'ledger_bucket': LOAD_LEDGER_BUCKET,
+        'config_file_name': config_file_name,
+    }
+    workers = max(1, min(MAX_PARALLEL_LOADS, len(targets)))
+    logger.info(f"Loading {len(targets)} targets with {workers} parallel workers")
+
+    progress = load_checkpoint(storage_client, bucket_name, config_file_name, 'targets')
+
+    def run_target(target: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            table = f"{target.get('dataset') or defaults['dataset']}.{validate_table_name(target['tablename'].replace('-', '_').replace(' ', '_'))}"
+        except ConfigValidationError:
+            return _load_target(storage_client, bq_client, target, defaults, project_id)  # reports the bad name
+        done = progress['stages'].get(table) if progress is not None else None
+        if done and not any(get_blob_metadata(storage_client, b, p) for b, p in done['source_files']):
+            logger.info(f"{table} was loaded by an earlier run of {config_file_name} (job {done['job_id']}); skipping it")
+            return {'table': table, 'status': 'COMPLETED_EARLIER', 'source_files': [], 'rows': done['rows'],
+                    'job_id': done['job_id'], 'error': None, 'duration_seconds': 0}
+        return _load_target(storage_client, bq_client, target, defaults, project_id)
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(run_target, targets))
+    elapsed = time.monotonic() - started
+
+    def move_target_files(result: Dict[str, Any]) -> None:
+        try:
+            archive_files(
+                storage_client, [tuple(f) for f in result['source_files']], bucket_name,
+                result['table'], "data file processing"
+            )
+        except (FileProcessingError, PermissionError) as e:
+            logger.error(f"Failed to move files for {result['table']}: {str(e)}")
+            result['cleanup_error'] = str(e)
+
+    succeeded = [r for r in results if r['status'] in ('SUCCESS', 'DUPLICATE')]
+    if succeeded:
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_PARALLEL_LOADS, len(succeeded)))) as executor:
+            list(executor.map(move_target_files, succeeded))
+        for r in succeeded:
+            if not r.get('cleanup_error'):
+                mark_stage(storage_client, progress, r['table'], job_id=r['job_id'], rows=r['rows'], source_files=r['source_files'])
+
+    failed = [r for r in results if r['status'] not in ('SUCCESS', 'DUPLICATE', 'COMPLETED_EARLIER')]
+    if not failed:
+        try:
+            archive_files(
+                storage_client, [(bucket_name, config_file_name)], bucket_name,
+                ", ".join(r['table'] for r in results), "config file processing"
+            )
+        except (FileProcessingError, PermissionError) as e:
+            logger.error(f"Failed to archive config file: {str(e)}")
+        clear_checkpoint(storage_client, progress)
+    else:
+        logger.warning(f"{len(failed)} of {len(results)} targets failed; leaving config file in place")
+
+    logger.info(f"Multi-table load finished in {elapsed:.2f}s: " + ", ".join(
+        f"{r['table']}={r['status']} ({r['duration_seconds']}s)" for r in results
+    ))
+
+    if failed:
+        subject = f"BigQuery Multi-Table Load Partially Failed - {len(failed)} of {len(results)} tables failed"
+    else:
+        subject = f"BigQuery Multi-Table Load Success - {len(results)} tables"
+    rows = "".join(
+        f"<tr><td>{r['table']}</td><td>{r['status']}</td><td>{r['rows'] if r['rows'] is not None else ''}</td>"
+        f"<td>{r['job_id'] or ''}</td><td>{r['error'] or r.get('cleanup_error') or ''}</td></tr>"
+        for r in results
     )
+    body = f"""<html>
+        <body>
+        <h2>{subject}</h2>
+        <p><strong>Config File:</strong> {config_file_name}</p>
+        <p><strong>Elapsed:</strong> {elapsed:.2f} seconds</p>
+        <table border="1" cellpadding="4">
+        <tr><th>Table</th><th>Status</th><th>Rows Loaded</th><th>Job ID</th><th>Error</th></tr>
+        {rows}
+        </table>
+        </body>
+        </html>"""
+    try:
+        send_email_notifications(email_list, subject, body, is_error=bool(failed), project_id=project_id,
+                                 category='MultiTablePartialFailure' if failed else 'LoadSuccess')
+    except Exception as email_e:
+        logger.error(f"CRITICAL: Failed to send multi-table load notification: {str(email_e)}")
+
+    return results
+
+
+def _batch_write(storage_client: storage.Client, bucket_name: str, path: str, record: Dict[str, Any], create_only: bool = False) -> bool:
+    """Write a micro-batch record. With create_only, returns False when it already exists."""
+    if MICRO_BATCH_DIR:
+        local_path = os.path.join(MICRO_BATCH_DIR, path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        try:
+            with open(local_path, 'x' if create_only else 'w') as f:
+                json.dump(record, f)
+        except FileExistsError:
+            return False
+        return True
+    try:
+        count_gcs_call()
+        storage_client.bucket(bucket_name).blob(path).upload_from_string(
+            json.dumps(record), content_type='application/json', if_generation_match=0 if create_only else None
+        )
+    except api_exceptions.PreconditionFailed:
+        return False
+    return True
 
+
+def _batch_read(storage_client: storage.Client, bucket_name: str, path: str) -> Optional[Dict[str, Any]]:
     try:
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
-        logger.info(f"Email sent via SendGrid. Status: {response.status_code}")
+        if MICRO_BATCH_DIR:
+            with open(os.path.join(MICRO_BATCH_DIR, path)) as f:
+                return json.load(f)
+        count_gcs_call()
+        return json.loads(storage_client.bucket(bucket_name).blob(path).download_as_text())
+    except (FileNotFoundError, NotFound, json.JSONDecodeError):
+        return None
+
+
+def _batch_list(storage_client: storage.Client, bucket_name: str, prefix: str) -> List[Tuple[str, Dict[str, Any]]]:
+    """Return (path, record) for every micro-batch record under prefix, oldest name first"""
+    records = []
+    if MICRO_BATCH_DIR:
+        directory = os.path.join(MICRO_BATCH_DIR, prefix)
+        if not os.path.isdir(directory):
+            return []
+        for name in sorted(os.listdir(directory)):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    records.append((f"{prefix}{name}", json.load(f)))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue  # removed or still being written
+        return records
+    count_gcs_call()
+    for blob in storage_client.list_blobs(bucket_name, prefix=prefix):
+        try:
+            count_gcs_call()
+            records.append((blob.name, json.loads(blob.download_as_text())))
+        except (NotFound, json.JSONDecodeError):
+            continue
+    return records
+
 
+def _batch_delete(storage_client: storage.Client, bucket_name: str, path: str) -> None:
+    try:
+        if MICRO_BATCH_DIR:
+            os.remove(os.path.join(MICRO_BATCH_DIR, path))
+        else:
+            count_gcs_call()
+            storage_client.bucket(bucket_name).blob(path).delete()
+    except (FileNotFoundError, NotFound):
+        pass
     except Exception as e:
-        logger.error(f"Error sending email notification: {str(e)}")
+        logger.warning(f"Could not delete micro-batch record {path}: {str(e)}")
+
+
+def _acquire_batch_lock(storage_client: storage.Client, bucket_name: str, lock_path: str, window: int) -> bool:
+    """Become the flusher of a batch. A lock older than the window plus the function timeout is taken over."""
+    if _batch_write(storage_client, bucket_name, lock_path, {'acquired_at': datetime.now(timezone.utc).isoformat()}, create_only=True):
+        return True
+    held = _batch_read(storage_client, bucket_name, lock_path)
+    if held:
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(held['acquired_at'])
+        if age.total_seconds() > window + TIMEOUT_SECONDS:
+            logger.warning(f"Taking over stale micro-batch lock {lock_path} ({age.total_seconds():.0f}s old)")
+            _batch_delete(storage_client, bucket_name, lock_path)
+            return _batch_write(
+                storage_client, bucket_name, lock_path, {'acquired_at': datetime.now(timezone.utc).isoformat()}, create_only=True
+            )
+    return False
+
+
+def run_micro_batch(storage_client: storage.Client, bq_client: bigquery.Client, entries: List[Dict[str, Any]]) -> bool:
+    """
+    Load the sources of every queued config in one job, then run each config's own post-load stages
+    (archive, ledger, success email). On failure every contributing config is notified.
+    """
+    settings = entries[0]['settings']
+    contexts = [entry['context'] for entry in entries]
+    first = contexts[0]
+    full_table_id = first['full_table_id']
+    source_files = []
+    for context in contexts:
+        source_files.extend(f for f in context['source_files'] if f not in source_files)
+    logger.info(f"Micro-batch for {full_table_id}: {len(contexts)} configs, {len(source_files)} source files")
+
+    load_sources = None
+    try:
+        schema = resolve_table_schema(storage_client, first['table_name'], settings['schema'])
+        table_options = resolve_table_options(storage_client, first['table_name'], settings['table_options'], settings['schema'])
+        check_archive_collisions([tuple(f) for f in source_files])
+        data_blobs = [get_blob_metadata(storage_client, b, p) for b, p in source_files]
+        expected_rows = validate_csv_files(
+            data_blobs, schema=schema, is_header=settings['is_header'], full=settings['full_validation']
+        )
+        load_sources = prepare_load_sources(storage_client, source_files, schema, settings['is_header'], settings['transcode'])
+        load_uris = load_sources['uris']
+        load_job = load_data_to_bigquery(
+            bq_client=bq_client,
+            gcs_uri=load_uris if len(load_uris) > 1 else load_uris[0],
+            dataset_id=first['dataset_id'],
+            table_name=first['table_name'],
+            project_id=first['project_id'],
+            is_header=settings['is_header'],
+            override=settings['override'],
+            timeout=TIMEOUT_SECONDS,
+            schema=schema,
+            source_format=load_sources['source_format'],
+            job_id=deterministic_job_id(
+                storage_client, source_files, full_table_id,
+                salt=datetime.now(timezone.utc).isoformat() if settings['force_reload'] else ''
+            ),
+            merge_keys=settings['merge_keys'],
+            table_options=table_options
+        )
+        reconcile_row_count(load_job, expected_rows)
+        record_load_stats(storage_client, full_table_id, {
+            **first,
+            'source_format': load_sources['source_format'],
+            'input_bytes': load_sources['input_bytes'],
+            'transcode': load_sources['transcode'],
+        }, load_job)
+    except Exception as e:
+        logger.error(f"Micro-batch load into {full_table_id} failed: {str(e)}", exc_info=True)
+        for context in contexts:
+            replay_after = None
+            if isinstance(e, QuotaDeferredError):
+                replay_after = defer_config(context['bucket_name'], context['config_file_name'], full_table_id, e.until_reset)
+            subject = f"BigQuery Data Load {'Deferred' if replay_after else 'Failed'} - {full_table_id}"
+            next_step = (
+                f"The config will be loaded automatically after {replay_after} (UTC); there is no need to re-upload it."
+                if replay_after else "Please check the Cloud Function logs for more details."
+            )
+            body = f"""<html>
+                <body>
+                <h2>BigQuery Data Load {'Deferred' if replay_after else 'Failed'}</h2>
+                <p><strong>Error Type:</strong> {type(e).__name__}</p>
+                <p><strong>Config File:</strong> {context['config_file_name']}</p>
+                <p><strong>CSV File Path:</strong> {context['gcs_uri']}</p>
+                <p><strong>Target Table:</strong> {full_table_id}</p>
+                <p><strong>Batched With:</strong> {len(contexts) - 1} other config(s)</p>
+                <p><strong>Error:</strong> {str(e)}</p>
+                <p>{next_step}</p>
+                </body>
+                </html>"""
+            try:
+                if context['email_list']:
+                    send_email_notifications(context['email_list'], subject, body, is_error=True,
+                                             project_id=context['project_id'], category=type(e).__name__)
+            except Exception as email_e:
+                logger.error(f"CRITICAL: Failed to send failure notification: {str(email_e)}")
+        return False
+    finally:
+        if load_sources is not None:
+            delete_staging_files(storage_client, load_sources['staging_files'])
+
+    for context in contexts:
+        try:
+            finalize_load(storage_client, context, load_job)
+        except Exception as e:
+            logger.error(f"Post-load stages failed for {context['config_file_name']}: {str(e)}", exc_info=True)
+    logger.info(f"Micro-batch job {load_job.job_id} loaded {load_job.output_rows} rows for {len(contexts)} configs")
+    return True
+
+
+def enqueue_micro_batch(
+    storage_client: storage.Client,
+    bq_client: bigquery.Client,
+    load_context: Dict[str, Any],
+    settings: Dict[str, Any],
+    window: int,
+    max_configs: int
+) -> None:
+    """
+    Add a config to the pending list of its target table and load settings. The invocation that takes
+    the batch lock collects configs for up to window seconds or max_configs entries and loads them
+    together; the others return at once. Configs queued while a flush ran are picked up afterwards.
+    The lists live in MICRO_BATCH_BUCKET (or MICRO_BATCH_DIR), so writing them never fires the trigger.
+    """
+    bucket_name = MICRO_BATCH_BUCKET
+    settings_digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12]
+    batch_dir = f"{MICRO_BATCH_PREFIX}{load_context['full_table_id']}/{settings_digest}/"
+    entries_prefix = f"{batch_dir}entries/"
+    lock_path = f"{batch_dir}lock.json"
+    entry_id = hashlib.sha256(
+        f"{load_context['bucket_name']}/{load_context['config_file_name']}#{load_context['config_generation']}".encode()
+    ).hexdigest()[:24]
+    _batch_write(storage_client, bucket_name, f"{entries_prefix}{entry_id}.json", {
+        'queued_at': datetime.now(timezone.utc).isoformat(),
+        'settings': settings,
+        'context': {**load_context, 'micro_batch': batch_dir},
+    })
+    logger.info(f"Queued {load_context['config_file_name']} in micro-batch {batch_dir}")
+
+    while _acquire_batch_lock(storage_client, bucket_name, lock_path, window):
+        entries = []
+        try:
+            deadline = time.monotonic() + max(0.0, min(window, remaining_time() / 2))
+            entries = _batch_list(storage_client, bucket_name, entries_prefix)
+            while len(entries) < max_configs and time.monotonic() < deadline:
+                time.sleep(min(MICRO_BATCH_POLL_SECONDS, max(0.0, deadline - time.monotonic())))
+                entries = _batch_list(storage_client, bucket_name, entries_prefix)
+            entries = entries[:max_configs]
+            if entries:
+                run_micro_batch(storage_client, bq_client, [record for _, record in entries])
+        finally:
+            for path, _ in entries:
+                _batch_delete(storage_client, bucket_name, path)
+            _batch_delete(storage_client, bucket_name, lock_path)
+        if remaining_time() < window or not _batch_list(storage_client, bucket_name, entries_prefix):
+            break
+    logger.info(f"Micro-batch {batch_dir} handed off or flushed")
+
+
+def _pending_load_path(job_id: str) -> str:
+    return f"{PENDING_JOBS_PREFIX}{job_id}.json"
+
+
+def save_pending_load(storage_client: storage.Client, bucket_name: str, load_job: bigquery.LoadJob, load_context: Dict[str, Any]) -> str:
+    """Persist a submitted load job with its config context so a later step can finish it"""
+    record = {
+        'job_id': load_job.job_id,
+        'location': load_job.location,
+        'project_id': load_job.project,
+        'submitted_at': datetime.now(timezone.utc).isoformat(),
+        'context': load_context,
+    }
+    path = _pending_load_path(load_job.job_id)
+    try:
+        count_gcs_call()
+        storage_client.bucket(bucket_name).blob(path).upload_from_string(
+            json.dumps(record), content_type='application/json'
+        )
+    except Exception as e:
+        raise FileProcessingError(f"Failed to save pending load record for job {load_job.job_id}: {str(e)}")
+    logger.info(f"Saved pending load record: gs://{bucket_name}/{path}")
+    return path
+
+
+def _claim_pending_load(record_blob: storage.Blob) -> bool:
+    """Mark a pending record as being finalized. Returns False if another worker holds a fresh claim."""
+    claimed_at = (record_blob.metadata or {}).get('claimed_at')
+    if claimed_at:
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(claimed_at)
+        if age.total_seconds() < TIMEOUT_SECONDS:
+            return False
+    record_blob.metadata = {'claimed_at': datetime.now(timezone.utc).isoformat()}
+    try:
+        count_gcs_call()
+        record_blob.patch(if_metageneration_match=record_blob.metageneration)
+        return True
+    except api_exceptions.PreconditionFailed:
+        return False
+
+
+def complete_pending_load(storage_client: storage.Client, bq_client: bigquery.Client, record_blob: storage.Blob) -> str:
+    """Finish the post-load stages for a pending job once it is done. Returns the resulting status."""
+    count_gcs_call()
+    record = json.loads(record_blob.download_as_text())
+    job_id = record['job_id']
+    load_context = record['context']
+
+    load_job = bq_client.get_job(job_id, project=record.get('project_id'), location=record.get('location'))
+    if load_job.state != 'DONE':
+        logger.info(f"Pending BigQuery job {job_id} is still {load_job.state}")
+        return 'PENDING'
+    release_load_slot(record.get('project_id'), job_id)
+
+    if not _claim_pending_load(record_blob):
+        logger.info(f"Pending BigQuery job {job_id} is already being finalized")
+        return 'CLAIMED'
+
+    try:
+        verify_load_job(load_job)
+        finalize_load(storage_client, load_context, load_job)
+        status = 'DONE'
+    except (DataLoadError, QuotaExceededError, InvalidCSVFormatError) as e:
+        logger.error(f"Asynchronous BigQuery job {job_id} failed: {str(e)}")
+        subject = f"BigQuery Data Load Failed - {load_context['full_table_id']}"
+        body = f"""<html>
+            <body>
+            <h2>BigQuery Data Load Failed</h2>
+            <p><strong>Error Type:</strong> {type(e).__name__}</p>
+            <p><strong>Config File:</strong> {load_context['config_file_name']}</p>
+            <p><strong>CSV File Path:</strong> {load_context['gcs_uri']}</p>
+            <p><strong>Target Table:</strong> {load_context['full_table_id']}</p>
+            <p><strong>Job ID:</strong> {job_id}</p>
+            <p><strong>Error:</strong> {str(e)}</p>
+            <p>Please check the Cloud Function logs for more details.</p>
+            </body>
+            </html>"""
+        try:
+            if load_context['email_list']:
+                send_email_notifications(load_context['email_list'], subject, body, is_error=True,
+                                         project_id=load_context['project_id'], category=type(e).__name__)
+        except Exception as email_e:
+            logger.error(f"CRITICAL: Failed to send failure notification: {str(email_e)}")
+        status = 'FAILED'
+
+    try:
+        count_gcs_call()
+        record_blob.delete(if_generation_match=record_blob.generation)
+    except Exception as e:
+        logger.warning(f"Could not delete pending load record {record_blob.name}: {str(e)}")
+    return status
+
+
+@functions_framework.cloud_event
+def poll_pending_load_jobs(cloud_event):
+    """
+    Cloud Function triggered on a schedule (e.g. Cloud Scheduler via Pub/Sub).
+    Finishes every pending asynchronous load job that has completed.
+    """
+    reset_invocation_state()
+    if not PENDING_JOBS_BUCKET:
+        logger.error("PENDING_JOBS_BUCKET is not set; nothing to poll")
+        return 'OK'
+
+    storage_client = get_storage_client()
+    bq_client = get_bigquery_client()
+    statuses = {}
+    count_gcs_call()
+    for record_blob in storage_client.list_blobs(PENDING_JOBS_BUCKET, prefix=PENDING_JOBS_PREFIX):
+        if not record_blob.name.endswith('.json'):
+            continue
+        try:
+            status = complete_pending_load(storage_client, bq_client, record_blob)
+        except Exception as e:
+            logger.error(f"Error completing pending load {record_blob.name}: {str(e)}", exc_info=True)
+            status = 'ERROR'
+        statuses[status] = statuses.get(status, 0) + 1
+
+    drain_notifications()
+    logger.info(f"Pending load poll finished: {statuses}. GCS API calls: {get_gcs_call_count()}")
+    return 'OK'
+
+
+@functions_framework.cloud_event
+def run_scheduled_maintenance(cloud_event):
+    """
+    Cloud Function triggered on a schedule (Cloud Scheduler via Pub/Sub).
+    Replays configs deferred by the load-job quota once they are due and sends the held
+    notification digests whose window has closed.
+    """
+    reset_invocation_state()
+    replayed = replay_deferred_configs()
+    sent = flush_notification_digests(persisted=True)
+    drain_notifications()
+    logger.info(
+        f"Scheduled maintenance finished: {replayed} deferred config(s) replayed, {sent} digest(s) sent. "
+        f"GCS API calls: {get_gcs_call_count()}"
+    )
+    return 'OK'
+
+
+@functions_framework.cloud_event
+def process_load_job_completion(cloud_event):
+    """
+    Cloud Function triggered by a BigQuery job-completion audit log event.
+    Finishes the matching pending asynchronous load, if any.
+    """
+    reset_invocation_state()
+    data = cloud_event.data or {}
+    resource_name = data.get('protoPayload', {}).get('resourceName', '')
+    job_id = resource_name.rsplit('/', 1)[-1] if '/jobs/' in resource_name else None
+    if not job_id:
+        logger.warning(f"Skipping event without a BigQuery job resource: {resource_name}")
+        return 'OK'
+    if not PENDING_JOBS_BUCKET:
+        logger.error("PENDING_JOBS_BUCKET is not set; cannot look up pending load")
+        return 'OK'
+
+    storage_client = get_storage_client()
+    bq_client = get_bigquery_client()
+    record_blob = get_blob_metadata(storage_client, PENDING_JOBS_BUCKET, _pending_load_path(job_id))
+    if record_blob is None:
+        logger.info(f"No pending load record for job {job_id}, skipping")
+        return 'OK'
+
+    try:
+        status = complete_pending_load(storage_client, bq_client, record_blob)
+    finally:
+        drain_notifications()
+    logger.info(f"Pending load for job {job_id} finished with status {status}")
+    return 'OK'
 
 
 @functions_framework.cloud_event
@@ -663,11 +4326,14 @@ def process_config_file(cloud_event):
     config_file_name = None
     bucket_name = None
     email = None
+    email_list = []
     full_table_id = "N/A"
     gcs_uri = "N/A"
     project_id = None
     storage_client = None
     bq_client = None
+    unfinished_staging = []  # staging objects to remove if the load does not get to finalize_load
+    reset_invocation_state()
     
     try:
         if not cloud_event or not hasattr(cloud_event, 'data'):
@@ -692,37 +4358,45 @@ def process_config_file(cloud_event):
             logger.warning(f"Skipping processed file: {config_file_name}")
             return 'OK'
         
-        try:
-            credentials, project_id = default()
-            if hasattr(credentials, 'expired') and credentials.expired:
-                try:
-                    credentials.refresh(None)
-                except RefreshError as e:
-                    raise GoogleAuthError(f"Credentials expired and refresh failed: {str(e)}")
-        except GoogleAuthError as e:
-            raise GoogleAuthError(f"Failed to authenticate with GCP: {str(e)}")
-        except RefreshError as e:
-            raise GoogleAuthError(f"Failed to refresh expired credentials: {str(e)}")
+        _, project_id = get_gcp_credentials()
+        storage_client = get_storage_client(project_id)
+        bq_client = get_bigquery_client(project_id)
+        logger.info(f"GCP client stats: {get_client_stats()}")
+        warm_notifications(project_id)
         
-        try:
-            storage_client = storage.Client(project=project_id)
-            bq_client = bigquery.Client(project=project_id)
-        except Exception as e:
-            raise ConnectionError(f"Failed to initialize GCP clients: {str(e)}")
+        checkpoint = load_checkpoint(storage_client, bucket_name, config_file_name, data.get('generation'))
+        if all(stage_done(checkpoint, stage) for stage in CHECKPOINT_STAGES):
+            logger.info(f"All stages already completed for {config_file_name}#{checkpoint['generation']}; nothing to do")
+            return 'OK'
+        if stage_done(checkpoint, 'load'):
+            load_stage = checkpoint['stages']['load']
+            load_context = load_stage['context']
+            full_table_id, gcs_uri, email_list = load_context['full_table_id'], load_context['gcs_uri'], load_context['email_list']
+            load_job = bq_client.get_job(load_stage['job_id'], project=load_stage.get('project'), location=load_stage.get('location'))
+            logger.info(f"Resuming {config_file_name} after completed load job {load_job.job_id}")
+            finalize_load(storage_client, load_context, load_job, checkpoint)
+            logger.info(f"Successfully completed processing: {config_file_name}")
+            return 'OK'
         
         try:
             check_bucket_exists(storage_client, bucket_name)
             check_file_permissions(storage_client, bucket_name, config_file_name)
             
-            bucket = storage_client.bucket(bucket_name)
-            config_blob = bucket.blob(config_file_name)
+            config_blob = get_blob_metadata(storage_client, bucket_name, config_file_name)
             
-            if not config_blob.exists():
+            if config_blob is None:
                 raise FileNotFoundError(f"Config file not found: {config_file_name}")
             
+            if is_marked_processed(config_blob):
+                logger.warning(f"Skipping config file already tagged as processed: {config_file_name}")
+                return 'OK'
+            if checkpoint is None:
+                checkpoint = load_checkpoint(storage_client, bucket_name, config_file_name, config_blob.generation)
+            
             check_file_size(config_blob, max_size_mb=10)
             
             try:
+                count_gcs_call()
                 config_content = config_blob.download_as_text()
             except (Forbidden, ConnectionError, TimeoutError, MemoryError, OSError) as e:
                 raise FileProcessingError(f"Failed to read config file: {str(e)}")
@@ -758,17 +4432,36 @@ def process_config_file(cloud_event):
         if not dataset_id or not validate_dataset_name(dataset_id):
             raise ConfigValidationError(f"Invalid dataset name format: {dataset_id}")
     
+        if config.get('targets') is not None:
+            validate_config(config)
+            full_table_id = ", ".join(f"{t.get('dataset') or dataset_id}.{t.get('tablename')}" for t in config['targets'])
+            process_multi_table_config(
+                storage_client, bq_client, config, config_file_name, bucket_name, project_id, email_list
+            )
+            logger.info(f"Successfully completed processing: {config_file_name}")
+            return 'OK'
+    
         file_location = config.get('file_location')
-        if not file_location or not isinstance(file_location, str):
-            raise ConfigValidationError("file_location must be a non-empty string")
+        if not file_location or not isinstance(file_location, (str, list)):
+            raise ConfigValidationError("file_location must be a non-empty string or list of strings")
 
         override = config.get('override', True)
         tablename = config.get('tablename') or data_file_name
         is_header = config.get('is_header', True)
+        async_load = config.get('async_load', ASYNC_LOAD_ENABLED)
 
         # Validate config structure
         validate_config(config)
         
+        if async_load and not PENDING_JOBS_BUCKET:
+            logger.warning("async_load requested but PENDING_JOBS_BUCKET is not set; loading synchronously")
+            async_load = False
+        
+        merge_keys = config.get('merge_keys')
+        if async_load and merge_keys:
+            logger.warning("async_load is not supported with merge_keys; loading synchronously")
+            async_load = False
+        
         if not data_file_name:
             raise ConfigValidationError("Could not extract data file name from config file name")
         
@@ -782,147 +4475,152 @@ def process_config_file(cloud_event):
         logger.info(f"Full table ID: {full_table_id}")
         logger.info(f"Override: {override}")
         logger.info(f"Is header: {is_header}")
+        logger.info(f"Async load: {async_load}")
+        logger.info(f"Merge keys: {merge_keys}")
         
         
-        if file_location.startswith('gs://'):
-            file_location = file_location[5:]
-        
-        parts = file_location.split('/', 1)
-        if not parts or not parts[0]:
-            raise ConfigValidationError("Invalid file_location format: missing bucket name")
-        
-        data_bucket_name = parts[0]
-        data_file_path = parts[1] if len(parts) > 1 else ""
-        
-        logger.info(f"Data bucket: {data_bucket_name}")
-        logger.info(f"Data file path: {data_file_path}")
-        logger.info(f"Data file name: {data_file_name}.csv")
-        
-        if data_file_path and not data_file_path.endswith('/'):
-            data_file_path += '/'
+        source_files = resolve_source_files(storage_client, file_location, data_file_name)
+        source_uris = [f"gs://{b}/{p}" for b, p in source_files]
+        gcs_uri = source_uris[0] if len(source_uris) == 1 else f"{source_uris[0]} (+{len(source_uris) - 1} more)"
+        logger.info(f"Loading data from: {gcs_uri}")
         
-        try:
-            check_bucket_exists(storage_client, data_bucket_name)
-            
-            data_file_full_path = f"{data_file_path}{data_file_name}.csv"
-            
-            check_file_permissions(storage_client, data_bucket_name, data_file_full_path)
-            
-            data_bucket = storage_client.bucket(data_bucket_name)
-            data_blob = data_bucket.blob(data_file_full_path)
-            
-            if not data_blob.exists():
-                raise FileNotFoundError(f"Data file not found: {data_file_full_path} in bucket {data_bucket_name}")
-            
-            logger.info(f"Data file exists: gs://{data_bucket_name}/{data_file_full_path}")
-            
-            check_file_size(data_blob, max_size_mb=MAX_FILE_SIZE_MB)
-            
-            try:
-                validate_csv_basic_format(data_blob)
-            except InvalidCSVFormatError as e:
-                raise e
-            except Exception as e:
-                logger.warning(f"CSV format validation warning: {str(e)}")
-            
-            logger.info(f"Data file validated: {data_file_name}.csv ({data_blob.size / (1024*1024):.2f} MB)")
-            
-        except Exception as e:
-            logger.error(f"Error accessing data file: {str(e)}")
-            raise 
+        ledger_bucket = LOAD_LEDGER_BUCKET
+        content_digest, ledger_entry = check_duplicate_load(
+            storage_client, source_files, full_table_id, ledger_bucket, config.get('force_reload', False),
+            override and not merge_keys
+        )
+        if ledger_entry is not None:
+            acknowledge_duplicate_load(
+                storage_client, config_file_name, bucket_name, source_files, full_table_id,
+                ledger_entry, email_list, project_id
+            )
+            return 'OK'
         
-        gcs_uri = f'gs://{data_bucket_name}/{data_file_path}{data_file_name}.csv'
-        logger.info(f"Loading data from: {gcs_uri}")
+        batch_window = config.get('batch_window_seconds', MICRO_BATCH_WINDOW_SECONDS)
+        admission = quota_admission(project_id, full_table_id)
+        if admission == 'defer':
+            raise QuotaDeferredError(
+                f"Load into {full_table_id} deferred: today's load-job quota is nearly used; "
+                f"it resets at midnight Pacific time",
+                until_reset=True
+            )
+        if admission == 'coalesce' and batch_window == 0:
+            logger.info(f"Coalescing loads into {full_table_id} for {QUOTA_COALESCE_WINDOW_SECONDS}s to save load jobs")
+            batch_window = QUOTA_COALESCE_WINDOW_SECONDS
+        if batch_window > 0 and override and not merge_keys:
+            # Batched replacements would load as one WRITE_TRUNCATE of their union, not the last one's data
+            logger.info(f"{config_file_name} replaces {full_table_id}; loading it on its own, not in a micro-batch")
+            batch_window = 0
+        elif batch_window > 0 and not (MICRO_BATCH_BUCKET or MICRO_BATCH_DIR):
+            logger.warning(f"Micro-batching needs MICRO_BATCH_BUCKET or MICRO_BATCH_DIR; loading {config_file_name} now")
+            batch_window = 0
+        if batch_window > 0:
+            enqueue_micro_batch(storage_client, bq_client, {
+                'config_file_name': config_file_name,
+                'bucket_name': bucket_name,
+                'source_files': source_files,
+                'dataset_id': dataset_id,
+                'table_name': table_name,
+                'full_table_id': full_table_id,
+                'gcs_uri': gcs_uri,
+                'email_list': email_list,
+                'project_id': project_id,
+                'expected_rows': None,
+                'staging_files': [],
+                'content_fingerprint': content_digest,
+                'ledger_bucket': ledger_bucket,
+                'config_generation': checkpoint['generation'] if checkpoint else None,
+            }, {
+                'override': override,
+                'is_header': is_header,
+                'merge_keys': merge_keys,
+                'schema': config.get('schema'),
+                'table_options': config.get('table_options'),
+                'transcode': config.get('transcode_parquet', PARQUET_TRANSCODE_ENABLED),
+                'full_validation': config.get('full_validation', CSV_FULL_VALIDATION),
+                'force_reload': config.get('force_reload', False),
+            }, batch_window, config.get('batch_max_configs', MICRO_BATCH_MAX_CONFIGS))
+            return 'OK'
         
         try:
             validate_dataset_location(bq_client, dataset_id, project_id)
         except Exception as e:
             logger.warning(f"Dataset location validation warning: {str(e)}")
         
+        schema = resolve_table_schema(storage_client, table_name, config.get('schema'))
+        logger.info(f"Schema: {'explicit' if schema is not None else 'autodetect'}")
+        table_options = resolve_table_options(storage_client, table_name, config.get('table_options'), config.get('schema'))
+        if table_options:
+            logger.info(f"Table options: {sorted(table_options)}")
+        
+        source_generations = {
+            f"gs://{b}/{p}": str(get_blob_metadata(storage_client, b, p).generation) for b, p in source_files
+        }
+        validate_stage = checkpoint['stages'].get('validate') if checkpoint else None
+        if validate_stage and validate_stage.get('sources') == source_generations:
+            expected_rows = validate_stage.get('expected_rows')
+            logger.info(f"Validation already completed for these source generations; expected rows: {expected_rows}")
+        else:
+            data_blobs = [get_blob_metadata(storage_client, b, p) for b, p in source_files]
+            expected_rows = validate_csv_files(
+                data_blobs, schema=schema, is_header=is_header, full=config.get('full_validation', CSV_FULL_VALIDATION)
+            )
+            mark_stage(storage_client, checkpoint, 'validate', sources=source_generations, expected_rows=expected_rows)
+        
+        transcode = config.get('transcode_parquet', PARQUET_TRANSCODE_ENABLED)
+        load_sources = prepare_load_sources(storage_client, source_files, schema, is_header, transcode)
+        unfinished_staging = load_sources['staging_files']
+        
+        load_context = {
+            'config_file_name': config_file_name,
+            'bucket_name': bucket_name,
+            'source_files': source_files,
+            'dataset_id': dataset_id,
+            'table_name': table_name,
+            'full_table_id': full_table_id,
+            'gcs_uri': gcs_uri,
+            'email_list': email_list,
+            'project_id': project_id,
+            'expected_rows': expected_rows,
+            'source_format': load_sources['source_format'],
+            'input_bytes': load_sources['input_bytes'],
+            'staging_files': load_sources['staging_files'],
+            'transcode': load_sources['transcode'],
+            'content_fingerprint': content_digest,
+            'ledger_bucket': ledger_bucket,
+            'replaces_table': override and not merge_keys,
+            'config_generation': checkpoint['generation'] if checkpoint else None,
+        }
 
+        load_uris = load_sources['uris']
         load_job = load_data_to_bigquery(
             bq_client=bq_client,
-            gcs_uri=gcs_uri,
+            gcs_uri=load_uris if len(load_uris) > 1 else load_uris[0],
             dataset_id=dataset_id,
             table_name=table_name,
             project_id=project_id,
             is_header=is_header,
             override=override,
-            timeout=TIMEOUT_SECONDS
+            timeout=TIMEOUT_SECONDS,
+            wait=not async_load,
+            schema=schema,
+            source_format=load_sources['source_format'],
+            job_id=deterministic_job_id(
+                storage_client, source_files, full_table_id,
+                salt=datetime.now(timezone.utc).isoformat() if config.get('force_reload', False) else ''
+            ),
+            merge_keys=merge_keys,
+            table_options=table_options
         )
         
-        logger.info(f"BigQuery load from {gcs_uri} to {full_table_id} completed successfully.")
-        logger.info(f"BigQuery job state: {load_job.state}")
-        
-        try:
-            processed_data_path = f"processed/{data_file_name}.csv"
-            logger.info(f"Moving data file to processed folder: {processed_data_path}")
-            move_file_safely(
-                storage_client,
-                data_bucket_name,
-                f"{data_file_path}{data_file_name}.csv",
-                bucket_name,
-                processed_data_path,
-                "data file processing"
-            )
-            logger.info(f"Data file moved to: gs://{data_bucket_name}/{processed_data_path}")
-            
-            config_file = os.path.basename(config_file_name)
-            processed_config_path = f"processed/{config_file}"
-            logger.info(f"Moving config file to processed folder: {processed_config_path}")
-            move_file_safely(
-                storage_client,
-                bucket_name,
-                config_file_name,
-                bucket_name,
-                processed_config_path,
-                "config file processing"
-            )
-            logger.info(f"Config file moved to: gs://{bucket_name}/{processed_config_path}")
-            
-        except (FileProcessingError, PermissionError) as e:
-            logger.error(f"Failed to move files to processed folder: {str(e)}. "
-                         "Data load was successful, but files require manual cleanup.")
-
-            subject = f"Warning: BQ Load Success, Cleanup Failed - {full_table_id}"
-            body = f"""<html>
-                <body>
-                <h2>BigQuery Data Load Completed, but File Cleanup Failed</h2>
-                <p><strong>Table:</strong> {full_table_id}</p>
-                <p><strong>CSV File Path:</strong> {gcs_uri}</p>
-                <p><strong>Config File:</strong> {config_file_name}</p>
-                <p><strong>Error:</strong> Failed to move files to 'processed' folder: {str(e)}</p>
-                <p>The data load was successful, but the original config and data files
-                   may still be in their original locations. Manual cleanup is recommended
-                   to prevent duplicate processing if this function is re-run on them.</p>
-                </body>
-                </html>"""
-            #send_email_notifications(email, subject, body, is_error=True, project_id=project_id)
-
-            try:
-                # Use fallback email logic
-                # recipient_email = email if email else FROM_EMAIL
-                if not email_list:
-                    logger.error(f"No recipient email (config or FROM_EMAIL) found. Cannot send cleanup failure warning.")
-                else:
-                    send_email_notifications(email_list, subject, body, is_error=True, project_id=project_id)
-            except Exception as email_e:
-                logger.error(f"CRITICAL: Failed to send cleanup failure notification: {str(email_e)}")
-                logger.error(f"Original file move error was: {str(e)}")
-        
-        subject = f"BigQuery Data Load Success - {full_table_id}"
-        body = f"""<html>
-            <body>
-            <h2>BigQuery Data Load Completed Successfully</h2>
-            <p><strong>Table:</strong> {full_table_id}</p>
-            <p><strong>CSV File Path:</strong> {gcs_uri}</p>
-            <p><strong>Config File:</strong> {config_file_name}</p>
-            <p><strong>Rows Loaded:</strong> {load_job.output_rows}</p>
-            <p><strong>Job ID:</strong> {load_job.job_id}</p>
-            </body>
-            </html>"""
+        if async_load:
+            save_pending_load(storage_client, PENDING_JOBS_BUCKET or bucket_name, load_job, load_context)
+            unfinished_staging = []  # the pending load removes them once the job finishes
+            logger.info(f"Submitted BigQuery job {load_job.job_id} asynchronously for {config_file_name}")
+            return 'OK'
         
-        send_email_notifications(email_list, subject, body, is_error=False, project_id=project_id)
+        unfinished_staging = []  # finalize_load removes them
+        finalize_load(storage_client, load_context, load_job, checkpoint)
         
         logger.info(f"Successfully completed processing: {config_file_name}")
         
@@ -934,8 +4632,24 @@ def process_config_file(cloud_event):
         print
         logger.error(f"Error processing the file {config_file_name}: {error_msg}", exc_info=True)
         
+        replay_after = None
+        if isinstance(e, QuotaDeferredError) and full_table_id:
+            replay_after = defer_config(bucket_name, config_file_name, full_table_id, e.until_reset)
         subject = f"BigQuery Data Load Failed - {full_table_id or 'Unknown'}"
-        body = f"""<html>
+        if replay_after:
+            subject = f"BigQuery Data Load Deferred - {full_table_id}"
+            body = f"""<html>
+            <body>
+            <h2>BigQuery Data Load Deferred</h2>
+            <p><strong>Config File:</strong> {config_file_name}</p>
+            <p><strong>CSV File Path:</strong> {gcs_uri or 'Unknown'}</p>
+            <p><strong>Target Table:</strong> {full_table_id}</p>
+            <p><strong>Reason:</strong> {error_msg}</p>
+            <p>The config will be loaded automatically after {replay_after} (UTC); there is no need to re-upload it.</p>
+            </body>
+            </html>"""
+        else:
+            body = f"""<html>
             <body>
             <h2>BigQuery Data Load Failed</h2>
             <p><strong>Error Type:</strong> {type(e).__name__}</p>
@@ -961,7 +4675,8 @@ def process_config_file(cloud_event):
             if not recipient_email:
                 logger.error(f"No recipient email (from config or FROM_EMAIL) to send failure notification.")
             else:
-                send_email_notifications(email_list, subject, body, is_error=True, project_id=project_id)
+                send_email_notifications(email_list, subject, body, is_error=True, project_id=project_id,
+                                         category=type(e).__name__)
         except Exception as email_e:
             logger.error(f"CRITICAL: Failed to send failure notification: {str(email_e)}")
             logger.error(f"Original error was: {error_msg}")
@@ -1001,7 +4716,8 @@ def process_config_file(cloud_event):
             if not recipient_email:
                 logger.error(f"No recipient email (from config or FROM_EMAIL) to send failure notification.")
             else:
-                send_email_notifications(email_list, subject, body, is_error=True, project_id=project_id)
+                send_email_notifications(email_list, subject, body, is_error=True, project_id=project_id,
+                                         category=type(e).__name__)
 
         except Exception as email_e:
             # CRITICAL: Log the email-sending error, but do not re-raise.
@@ -1010,3 +4726,11 @@ def process_config_file(cloud_event):
             logger.error(f"Original error was: {error_msg}")
         
         return 'OK'
+
+    finally:
+        if unfinished_staging:
+            delete_staging_files(storage_client, unfinished_staging)
+        drain_notifications()
+        logger.info(f"GCS API calls this invocation: {get_gcs_call_count()}")
+        logger.info(f"Notification stats: {get_notification_stats()}")
+        logger.info(f"Retry stats: {get_retry_stats()}")
@@ -136,6 +136,18 @@ resource "google_storage_bucket" "trigger-bucket" {
   name                        = "eventarc-gp74"
   location                    = "us-central1" # The trigger must be in the same location as the bucket
   uniform_bucket_level_access = true
+
+  # Shards, compacted files and Parquet copies are removed after each load; this catches any left
+  # behind by an invocation that was killed before it could clean up
+  lifecycle_rule {
+    condition {
+      age            = 1
+      matches_prefix = ["staging/"]
+    }
+    action {
+      type = "Delete"
+    }
+  }
 }
 
 # Cloud Storage Bucket for Cloud Function source code
@@ -148,6 +160,28 @@ resource "google_storage_bucket" "function_source" {
 
 }
 
+# Bucket for the function's own state (stage checkpoints, held notification digests, micro-batch lists,
+# dedup and quota ledgers). Kept apart from the trigger bucket so writing it does not fire the Eventarc
+# trigger again.
+resource "google_storage_bucket" "function_state" {
+  name          = "${var.project_id}-cloud-function-state-${random_id.bucket_suffix.hex}"
+  location      = var.region
+  force_destroy = true
+
+  uniform_bucket_level_access = true
+
+  # The dedup ledger (load_ledger/) is kept: dropping an entry would let identical content load twice
+  lifecycle_rule {
+    condition {
+      age            = 30
+      matches_prefix = ["checkpoints/", "notify_digests/", "micro_batches/", "quota_ledger/"]
+    }
+    action {
+      type = "Delete"
+    }
+  }
+}
+
 # Random ID for bucket suffix
 resource "random_id" "bucket_suffix" {
   byte_length = 4
@@ -156,6 +190,32 @@ resource "random_id" "bucket_suffix" {
 # Local values for computed names
 locals {
   eventarc_trigger_name = var.eventarc_trigger_name != "" ? var.eventarc_trigger_name : "${var.cloud_function_name}-trigger"
+  schema_bucket         = var.schema_bucket != "" ? var.schema_bucket : google_storage_bucket.function_source.name
+
+  function_environment = {
+    SENDGRID_API_KEY     = var.sendgrid_api_key != "" ? var.sendgrid_api_key : ""
+    FROM_EMAIL           = var.from_email != "" ? var.from_email : ""
+    EMAIL_ENABLED        = var.email_enabled != "" ? var.email_enabled : ""
+    SCHEMA_BUCKET        = local.schema_bucket
+    SCHEMA_PATH          = var.schema_path
+    ARCHIVE_MODE         = var.archive_mode
+    TIMEOUT_SECONDS      = var.cloud_function_timeout
+    CHECKPOINT_BUCKET    = google_storage_bucket.function_state.name
+    NOTIFY_DIGEST_BUCKET = google_storage_bucket.function_state.name
+    MICRO_BATCH_BUCKET   = google_storage_bucket.function_state.name
+    LOAD_LEDGER_BUCKET   = google_storage_bucket.function_state.name
+    QUOTA_LEDGER_BUCKET  = google_storage_bucket.function_state.name
+  }
+}
+
+
+# Publish table schemas so the Cloud Function can load with explicit schemas
+resource "google_storage_bucket_object" "schemas" {
+  for_each = fileset("${path.module}/../schemas", "*.json")
+
+  name   = "${var.schema_path}/${each.value}"
+  bucket = local.schema_bucket
+  source = "${path.module}/../schemas/${each.value}"
 }
 
 
@@ -198,12 +258,58 @@ resource "google_cloudfunctions2_function" "gcs_to_bigquery" {
     available_memory      = var.cloud_function_memory
     timeout_seconds       = var.cloud_function_timeout
     service_account_email = data.google_service_account.cloud_function_sa_use.email
-    environment_variables = {
-      SENDGRID_API_KEY = var.sendgrid_api_key != "" ? var.sendgrid_api_key : ""
-      FROM_EMAIL       = var.from_email != "" ? var.from_email : ""
-      EMAIL_ENABLED    = var.email_enabled != "" ? var.email_enabled : ""
+    environment_variables = local.function_environment
+  }
+}
+
+
+# Scheduled maintenance: replays configs deferred by the load-job quota and sends held notification digests
+resource "google_pubsub_topic" "maintenance" {
+  name = "${var.cloud_function_name}-maintenance"
+}
+
+resource "google_cloud_scheduler_job" "maintenance" {
+  name     = "${var.cloud_function_name}-maintenance"
+  region   = var.region
+  schedule = var.maintenance_schedule
+
+  pubsub_target {
+    topic_name = google_pubsub_topic.maintenance.id
+    data       = base64encode("maintenance")
+  }
+}
+
+resource "google_cloudfunctions2_function" "maintenance" {
+  name        = "${var.cloud_function_name}-maintenance"
+  location    = var.region
+  description = "Scheduled maintenance for the GCS to BigQuery loader"
+
+  build_config {
+    runtime     = "python311"
+    entry_point = "run_scheduled_maintenance"
+    source {
+      storage_source {
+        bucket = google_storage_bucket.function_source.name
+        object = google_storage_bucket_object.function_source.name
+      }
     }
   }
+
+  service_config {
+    max_instance_count    = 1
+    available_memory      = var.cloud_function_memory
+    timeout_seconds       = var.cloud_function_timeout
+    service_account_email = data.google_service_account.cloud_function_sa_use.email
+    environment_variables = local.function_environment
+  }
+
+  event_trigger {
+    trigger_region        = var.region
+    event_type            = "google.cloud.pubsub.topic.v1.messagePublished"
+    pubsub_topic          = google_pubsub_topic.maintenance.id
+    retry_policy          = "RETRY_POLICY_DO_NOT_RETRY"
+    service_account_email = data.google_service_account.cloud_function_sa_use.email
+  }
 }
 
 
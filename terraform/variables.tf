@@ -112,7 +112,7 @@ variable "pubsub_topic_name" {
 }
 
 variable "schema_bucket" {
-  description = "GCS bucket name where schema files are stored (optional, defaults to gcs_source_bucket)"
+  description = "GCS bucket name where schema files are stored (optional, defaults to the function source bucket)"
   type        = string
   default     = ""
 }
@@ -123,6 +123,18 @@ variable "schema_path" {
   default     = "schemas"
 }
 
+variable "archive_mode" {
+  description = "How loaded files are archived: 'move' copies them to processed/, 'tag' marks them processed with object metadata"
+  type        = string
+  default     = "move"
+}
+
+variable "maintenance_schedule" {
+  description = "Cron schedule for the maintenance function that replays quota-deferred configs and sends held notification digests"
+  type        = string
+  default     = "*/5 * * * *"
+}
+
 variable "example_table_schema_file" {
   description = "Schema file name for example table (e.g., 'example_table_schema.json') from schemas folder"
   type        = string
@@ -0,0 +1,297 @@
+import contextlib
+import hashlib
+import io
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cloud-function'))
+
+import main  # noqa: E402
+from google.cloud import bigquery  # noqa: E402
+from google.api_core import exceptions as api_exceptions  # noqa: E402
+from google.cloud.exceptions import NotFound  # noqa: E402
+
+
+class FakeBlob:
+    """Just enough of google.cloud.storage.Blob, backed by FakeStorage.objects"""
+
+    def __init__(self, storage, bucket_name, name):
+        self._storage = storage
+        self.bucket = FakeBucket(storage, bucket_name)
+        self.name = name
+        self._metadata = None
+        self._loaded = None
+
+    @property
+    def _object(self):
+        return self._storage.objects.get((self.bucket.name, self.name))
+
+    def _current(self):
+        return self._loaded if self._loaded is not None else self._object
+
+    @property
+    def size(self):
+        obj = self._current()
+        return len(obj['data']) if obj else None
+
+    @property
+    def generation(self):
+        obj = self._current()
+        return obj['generation'] if obj else None
+
+    @property
+    def metageneration(self):
+        obj = self._current()
+        return obj['metageneration'] if obj else None
+
+    @property
+    def crc32c(self):
+        obj = self._current()
+        return hashlib.md5(obj['data']).hexdigest()[:8] if obj else None
+
+    @property
+    def md5_hash(self):
+        obj = self._current()
+        return hashlib.md5(obj['data']).hexdigest() if obj else None
+
+    @property
+    def metadata(self):
+        if self._metadata is not None:
+            return self._metadata
+        obj = self._current()
+        return dict(obj['metadata']) if obj and obj['metadata'] else None
+
+    @metadata.setter
+    def metadata(self, value):
+        self._metadata = value
+
+    def _check(self, if_generation_match=None, **kwargs):
+        obj = self._object
+        if if_generation_match is not None and (obj['generation'] if obj else 0) != if_generation_match:
+            raise api_exceptions.PreconditionFailed(f"{self.name} generation mismatch")
+
+    def _require(self):
+        if self._object is None:
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+        return self._object
+
+    def reload(self, **kwargs):
+        if self._object is None and not self._storage.in_batch:
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+        self._loaded = dict(self._object) if self._object else None
+
+    def exists(self, **kwargs):
+        return self._object is not None
+
+    def download_as_bytes(self, start=None, end=None, **kwargs):
+        self._check(**kwargs)
+        data = self._require()['data']
+        return data[start or 0:None if end is None else end + 1]
+
+    def download_as_text(self, **kwargs):
+        return self.download_as_bytes(**kwargs).decode()
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        self._check(**kwargs)
+        self._storage.put(self.bucket.name, self.name, data, self._metadata)
+        self._loaded = None
+
+    def open(self, mode='rb', **kwargs):
+        if mode.startswith('r'):
+            return io.BytesIO(self._require()['data'])
+        blob = self
+
+        class Writer(io.BytesIO):
+            def close(self):
+                if not self.closed:
+                    blob.upload_from_string(self.getvalue())
+                super().close()
+
+        return Writer()
+
+    def delete(self, **kwargs):
+        self._check(**kwargs)
+        self._require()
+        del self._storage.objects[(self.bucket.name, self.name)]
+
+    def patch(self, **kwargs):
+        obj = self._require()
+        obj['metadata'] = {**(obj['metadata'] or {}), **(self._metadata or {})}
+        obj['metageneration'] += 1
+
+    def compose(self, sources, **kwargs):
+        self._storage.put(self.bucket.name, self.name, b''.join(s._require()['data'] for s in sources))
+
+    def rewrite(self, source, token=None, **kwargs):
+        self._storage.put(self.bucket.name, self.name, source._require()['data'])
+        return None, source.size, source.size
+
+
+class FakeBucket:
+    def __init__(self, storage, name):
+        self._storage = storage
+        self.name = name
+
+    def blob(self, name):
+        return FakeBlob(self._storage, self.name, name)
+
+    def get_blob(self, name, **kwargs):
+        return self.blob(name) if (self.name, name) in self._storage.objects else None
+
+    def copy_blob(self, blob, destination_bucket, new_name, if_source_generation_match=None, **kwargs):
+        source = blob._require()
+        if if_source_generation_match is not None and source['generation'] != if_source_generation_match:
+            raise api_exceptions.PreconditionFailed(f"{blob.name} generation mismatch")
+        self._storage.put(destination_bucket.name, new_name, source['data'], source['metadata'])
+        return destination_bucket.blob(new_name)
+
+
+class FakeStorage:
+    """In-memory GCS: objects[(bucket, name)] = {'data', 'generation', 'metageneration', 'metadata'}"""
+
+    def __init__(self):
+        self.objects = {}
+        self.in_batch = False
+        self._generation = 0
+
+    def put(self, bucket, name, data, metadata=None):
+        self._generation += 1
+        self.objects[(bucket, name)] = {
+            'data': data.encode() if isinstance(data, str) else bytes(data),
+            'generation': self._generation,
+            'metageneration': 1,
+            'metadata': dict(metadata) if metadata else None,
+        }
+
+    def read(self, bucket, name):
+        return self.objects[(bucket, name)]['data'].decode()
+
+    def names(self, bucket):
+        return sorted(name for b, name in self.objects if b == bucket)
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket, prefix='', **kwargs):
+        bucket = getattr(bucket, 'name', bucket)
+        return [FakeBlob(self, bucket, name) for name in self.names(bucket) if name.startswith(prefix)]
+
+    @contextlib.contextmanager
+    def batch(self, raise_exception=True):
+        self.in_batch = True
+        try:
+            yield
+        finally:
+            self.in_batch = False
+
+
+class FakeJob:
+    """A finished (or running) BigQuery job as seen through get_job / query / load"""
+
+    def __init__(self, job_id, state='DONE', error_result=None, output_rows=1):
+        self.job_id = job_id
+        self.state = state
+        self.error_result = error_result
+        self.errors = None
+        self.output_rows = output_rows
+        self.num_dml_affected_rows = output_rows
+        self.location = 'US'
+        self.project = 'proj'
+        self.started = self.ended = None
+
+    def result(self, timeout=None):
+        self.state = 'DONE'
+        return self
+
+    def reload(self):
+        pass
+
+    def done(self):
+        return self.state == 'DONE'
+
+
+class FakeBigQuery:
+    """Records submitted jobs; jobs placed in `jobs` are what get_job finds"""
+
+    def __init__(self, tables=None):
+        self.jobs = {}
+        self.tables = dict(tables or {})
+        self.queries = []
+        self.loads = []
+        self.deleted = []
+
+    def dataset(self, dataset_id, project=None):
+        return bigquery.DatasetReference(project, dataset_id)
+
+    def get_job(self, job_id, project=None, location=None):
+        if job_id not in self.jobs:
+            raise NotFound(f"job {job_id}")
+        return self.jobs[job_id]
+
+    def get_table(self, table_ref):
+        if table_ref.table_id not in self.tables:
+            raise NotFound(f"table {table_ref.table_id}")
+        return self.tables[table_ref.table_id]
+
+    def update_table(self, table, fields):
+        return table
+
+    def delete_table(self, table_ref, not_found_ok=False):
+        self.deleted.append(table_ref.table_id)
+        self.tables.pop(table_ref.table_id, None)
+
+    def load_table_from_uri(self, uri, table_ref, job_id=None, job_config=None, location=None):
+        self.loads.append((uri, table_ref.table_id, job_id))
+        self.jobs[job_id] = FakeJob(job_id)
+        return self.jobs[job_id]
+
+    def query(self, sql, location=None, job_id=None):
+        self.queries.append((sql, job_id))
+        job = FakeJob(job_id or f"query_{len(self.queries)}")
+        if job_id:
+            self.jobs[job_id] = job
+        return job
+
+
+def table(name, *columns):
+    return bigquery.Table(
+        f"proj.ds.{name}", schema=[bigquery.SchemaField(c, 'STRING') for c in columns]
+    )
+
+
+@pytest.fixture(autouse=True)
+def invocation():
+    """Each test starts like a fresh invocation: empty blob cache and counters"""
+    main.reset_invocation_state()
+
+
+@pytest.fixture
+def bq(monkeypatch):
+    monkeypatch.setattr(main, 'check_dataset_exists', lambda *a: True)
+    monkeypatch.setattr(main, 'check_bigquery_permissions', lambda *a: True)
+    monkeypatch.setattr(main, 'get_cached_dataset', lambda *a: mock.Mock(location='US'))
+    monkeypatch.setattr(main.time, 'sleep', lambda s: None)
+    return FakeBigQuery()
+
+
+@pytest.fixture
+def gcs(monkeypatch, bq):
+    """Route process_config_file to in-memory GCS and BigQuery, capturing notifications in gcs.emails"""
+    storage = FakeStorage()
+    storage.emails = []
+    monkeypatch.setattr(main, 'get_gcp_credentials', lambda *a, **k: (None, 'proj'))
+    monkeypatch.setattr(main, 'get_storage_client', lambda *a, **k: storage)
+    monkeypatch.setattr(main, 'get_bigquery_client', lambda *a, **k: bq)
+    monkeypatch.setattr(main, 'warm_notifications', lambda *a, **k: None)
+    monkeypatch.setattr(
+        main, 'send_email_notifications', lambda to, subject, *a, **k: storage.emails.append(subject)
+    )
+    bq.tables.setdefault('sales', table('sales', 'id'))
+    return storage
+
+
+def event(name, bucket='bk'):
+    return mock.Mock(data={'bucket': bucket, 'name': name})
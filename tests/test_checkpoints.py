@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+import main
+from conftest import event
+
+
+@pytest.fixture
+def checkpoints(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'CHECKPOINT_DIR', str(tmp_path))
+    monkeypatch.setattr(main, 'LOAD_DEDUP_ENABLED', False)
+    return tmp_path
+
+
+def test_multi_table_rerun_skips_targets_loaded_earlier(gcs, bq, checkpoints):
+    config = {'dataset': 'ds', 'targets': [
+        {'tablename': '1-orders', 'file_location': 'gs://bk/in'},
+        {'tablename': 'returns', 'file_location': 'gs://bk/in'},
+    ]}
+    gcs.put('bk', 'in/m_config.json', json.dumps(config))
+    gcs.put('bk', 'in/1-orders.csv', 'id\n1\n')
+    main.process_config_file(event('in/m_config.json'))
+    assert [load[1] for load in bq.loads] == ['table_1_orders']
+    assert 'in/m_config.json' in gcs.names('bk')
+
+    gcs.put('bk', 'in/returns.csv', 'id\n2\n')
+    main.process_config_file(event('in/m_config.json'))
+    assert [load[1] for load in bq.loads] == ['table_1_orders', 'returns']
+    assert gcs.emails[-1] == 'BigQuery Multi-Table Load Success - 2 tables'
+    assert list(checkpoints.rglob('*.json')) == []
+
+
+def put_sales(gcs):
+    gcs.put('bk', 'in/sales.csv', 'id\n1\n')
+    gcs.put('bk', 'in/sales_config.json', json.dumps({
+        'file_location': 'gs://bk/in', 'tablename': 'sales', 'dataset': 'ds', 'email': 'ops@example.com'
+    }))
+    return gcs.objects[('bk', 'in/sales_config.json')]['generation']
+
+
+def test_checkpoints_are_off_without_a_location(gcs, monkeypatch):
+    monkeypatch.setattr(main, 'CHECKPOINT_BUCKET', '')
+    monkeypatch.setattr(main, 'CHECKPOINT_DIR', '')
+    assert main.load_checkpoint(gcs, 'bk', 'in/sales_config.json', 1) is None
+    assert not main.stage_done(None, 'load')
+
+
+def test_rerun_resumes_after_the_completed_load(gcs, bq, checkpoints, monkeypatch):
+    generation = put_sales(gcs)
+    archive_files = main.archive_files
+    failures = []
+
+    def fail_config_move_once(storage_client, files, bucket_name, full_table_id, description):
+        if description == 'config file processing' and not failures:
+            failures.append(description)
+            raise RuntimeError('instance stopped')
+        return archive_files(storage_client, files, bucket_name, full_table_id, description)
+
+    monkeypatch.setattr(main, 'archive_files', fail_config_move_once)
+    main.process_config_file(event('in/sales_config.json'))
+    assert len(bq.loads) == 1
+    assert 'in/sales_config.json' in gcs.names('bk')
+    stages = json.loads(next(checkpoints.rglob('*.json')).read_text())['stages']
+    assert sorted(stages) == ['load', 'move_data', 'validate']
+
+    rerun = event('in/sales_config.json')
+    rerun.data['generation'] = generation
+    main.process_config_file(rerun)
+    assert len(bq.loads) == 1
+    assert 'in/sales_config.json' not in gcs.names('bk')
+    assert gcs.emails.count('BigQuery Data Load Success - ds.sales') == 1
+
+    main.process_config_file(rerun)
+    assert len(bq.loads) == 1
+    assert gcs.emails.count('BigQuery Data Load Success - ds.sales') == 1
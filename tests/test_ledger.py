@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+import main
+from conftest import event
+
+
+@pytest.fixture(params=['dir', 'bucket'])
+def ledger(request, monkeypatch, tmp_path):
+    """The dedup ledger, kept locally or in a state bucket apart from the trigger bucket"""
+    if request.param == 'dir':
+        monkeypatch.setattr(main, 'LOAD_LEDGER_DIR', str(tmp_path))
+    else:
+        monkeypatch.setattr(main, 'LOAD_LEDGER_BUCKET', 'state')
+    return request.param
+
+
+def upload(gcs, data, **config):
+    gcs.put('bk', 'in/sales.csv', data)
+    gcs.put('bk', 'in/sales_config.json', json.dumps({
+        'file_location': 'gs://bk/in', 'tablename': 'sales', 'dataset': 'ds', 'email': 'ops@example.com', **config
+    }))
+    main.process_config_file(event('in/sales_config.json'))
+
+
+def test_identical_content_is_loaded_once(gcs, bq, ledger):
+    upload(gcs, 'id\n1\n')
+    upload(gcs, 'id\n1\n')
+    assert len(bq.loads) == 1
+    assert gcs.emails == ['BigQuery Data Load Success - ds.sales', 'BigQuery Data Load Skipped (duplicate) - ds.sales']
+    assert not any(name.startswith('load_ledger/') for name in gcs.names('bk'))
+
+
+def test_force_reload_loads_identical_content_again(gcs, bq, ledger):
+    upload(gcs, 'id\n1\n', override=False)
+    upload(gcs, 'id\n1\n', override=False, force_reload=True)
+    assert len(bq.loads) == 2
+
+
+def test_appended_content_is_a_duplicate_after_other_appends(gcs, bq, ledger):
+    upload(gcs, 'id\n1\n', override=False)
+    upload(gcs, 'id\n2\n', override=False)
+    upload(gcs, 'id\n1\n', override=False)
+    assert len(bq.loads) == 2
+
+
+def test_replacing_load_is_repeated_once_the_table_holds_other_content(gcs, bq, ledger):
+    upload(gcs, 'id\n1\n')
+    upload(gcs, 'id\n2\n')
+    upload(gcs, 'id\n1\n')
+    assert len(bq.loads) == 3
+    upload(gcs, 'id\n1\n')
+    assert len(bq.loads) == 3
+
+
+def test_without_a_ledger_location_nothing_is_deduplicated(gcs, bq, monkeypatch):
+    monkeypatch.setattr(main, 'LOAD_LEDGER_BUCKET', '')
+    monkeypatch.setattr(main, 'LOAD_LEDGER_DIR', '')
+    upload(gcs, 'id\n1\n')
+    upload(gcs, 'id\n1\n')
+    assert len(bq.loads) == 2
+    assert gcs.names('state') == []
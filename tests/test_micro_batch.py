@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+
+import pytest
+
+import main
+from conftest import event
+
+
+@pytest.fixture
+def micro_batch(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'MICRO_BATCH_DIR', str(tmp_path))
+    monkeypatch.setattr(main, 'MICRO_BATCH_POLL_SECONDS', 0.1)
+    monkeypatch.setattr(main, 'LOAD_DEDUP_ENABLED', False)
+    return tmp_path
+
+
+def upload(gcs, i, **config):
+    gcs.put('bk', f'in/s{i}.csv', f'id\n{i}\n')
+    gcs.put('bk', f'in/s{i}_config.json', json.dumps({
+        'file_location': 'gs://bk/in', 'tablename': 'sales', 'dataset': 'ds',
+        'email': f'u{i}@example.com', 'override': False, 'batch_window_seconds': 1, **config
+    }))
+
+
+def run_concurrently(count):
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=main.process_config_file, args=(event(f'in/s{i}_config.json'),))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.1)
+    for thread in threads:
+        thread.join()
+
+
+def test_configs_queued_in_one_window_load_as_one_job(gcs, bq, micro_batch):
+    for i in range(3):
+        upload(gcs, i)
+    run_concurrently(3)
+    assert len(bq.loads) == 1
+    assert sorted(bq.loads[0][0]) == [f'gs://bk/in/s{i}.csv' for i in range(3)]
+    assert sorted(gcs.emails) == ['BigQuery Data Load Success - ds.sales'] * 3
+    assert [name for name in gcs.names('bk') if not name.startswith('processed/')] == []
+    assert list(micro_batch.rglob('*.json')) == []
+
+
+def test_replacing_configs_are_never_combined(gcs, bq, micro_batch):
+    for i in range(2):
+        upload(gcs, i, override=True)
+    run_concurrently(2)
+    assert len(bq.loads) == 2
+    assert list(micro_batch.rglob('*.json')) == []
+
+
+def test_without_a_state_bucket_configs_load_at_once(gcs, bq, monkeypatch):
+    monkeypatch.setattr(main, 'MICRO_BATCH_DIR', '')
+    monkeypatch.setattr(main, 'MICRO_BATCH_BUCKET', '')
+    upload(gcs, 0)
+    main.process_config_file(event('in/s0_config.json'))
+    assert len(bq.loads) == 1
+    assert gcs.names('bk') == ['processed/s0.csv', 'processed/s0_config.json']
@@ -0,0 +1,97 @@
+import json
+import time
+from unittest import mock
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def digests(monkeypatch, tmp_path):
+    """Persist held digests under a temporary directory and capture what would be emailed"""
+    sent = []
+    monkeypatch.setattr(main, 'NOTIFY_DIGEST_DIR', str(tmp_path))
+    monkeypatch.setattr(main, '_digests', {})
+    monkeypatch.setattr(main, '_dispatch_email', lambda to, subject, content, project_id: sent.append((to, subject)))
+    return sent
+
+
+def hold(category, window_end, *subjects):
+    main._digests[(('ops@example.com',), category)] = {
+        'window_end': window_end, 'items': [{'subject': s, 'at': '2026-01-01T00:00:00+00:00'} for s in subjects]
+    }
+
+
+def test_open_window_is_persisted_and_not_sent_by_the_request(digests):
+    hold('failure', time.monotonic() + 300, 'load failed', 'load failed again')
+    main.drain_notifications()
+    assert digests == []
+    record = main._read_json_record('', main.NOTIFY_DIGEST_DIR, main._digest_record_path(('ops@example.com',), 'failure'))
+    assert [item['subject'] for item in record['items']] == ['load failed', 'load failed again']
+
+
+def test_drain_does_not_list_persisted_digests(digests, monkeypatch):
+    listed = mock.Mock(return_value=[])
+    monkeypatch.setattr(main, '_list_digest_records', listed)
+    main.drain_notifications()
+    listed.assert_not_called()
+
+
+def test_scheduled_maintenance_sends_closed_persisted_windows_once(digests):
+    hold('failure', time.monotonic() - 1, 'load failed')
+    main.hold_notification_digests()
+    main.run_scheduled_maintenance(mock.Mock(data={}))
+    main.run_scheduled_maintenance(mock.Mock(data={}))
+    assert digests == [(['ops@example.com'], 'BigQuery Load Digest - 1 x failure')]
+
+
+def test_scheduled_maintenance_leaves_open_windows_held(digests):
+    hold('failure', time.monotonic() + 300, 'load failed')
+    main.hold_notification_digests()
+    main.run_scheduled_maintenance(mock.Mock(data={}))
+    assert digests == []
+
+
+def test_rejected_event_makes_no_gcs_calls(monkeypatch):
+    monkeypatch.setattr(main, 'NOTIFY_DIGEST_BUCKET', 'state-bucket')
+    monkeypatch.setattr(main, 'get_storage_client', mock.Mock(side_effect=AssertionError('GCS was called')))
+    main.process_config_file(mock.Mock(data={'bucket': 'bk', 'name': 'data/foo.csv'}))
+    assert main.get_gcs_call_count() == 0
+
+
+@pytest.fixture
+def outbox(monkeypatch, tmp_path):
+    """Write messages to a temporary outbox; SendGrid secrets must never be needed"""
+    monkeypatch.setattr(main, 'NOTIFY_OUTBOX_DIR', str(tmp_path))
+    monkeypatch.setattr(main, 'EMAIL_ENABLED', True)
+    monkeypatch.setattr(main, 'NOTIFY_ASYNC', False)
+    monkeypatch.setattr(main, '_recent_fingerprints', main.OrderedDict())
+    monkeypatch.setattr(main, '_digests', {})
+    monkeypatch.setattr(main, '_load_secrets', mock.Mock(side_effect=AssertionError('SendGrid called')))
+    return tmp_path
+
+
+def messages(outbox):
+    return [json.loads(path.read_text()) for path in sorted(outbox.glob('*.json'))]
+
+
+def test_outbox_receives_the_message_instead_of_sendgrid(outbox):
+    main.send_email_notifications(['ops@example.com'], 'load done', '<p>ok</p>', category='LoadSuccess')
+    [message] = messages(outbox)
+    assert message['to'] == ['ops@example.com']
+    assert (message['subject'], message['html']) == ('load done', '<p>ok</p>')
+
+
+def test_identical_messages_are_written_once(outbox):
+    for _ in range(3):
+        main.send_email_notifications(['ops@example.com'], 'load failed', '<p>boom</p>')
+    assert len(messages(outbox)) == 1
+
+
+def test_repeats_in_an_open_window_are_held_for_the_digest(outbox):
+    main.send_email_notifications(['ops@example.com'], 'load failed - a', '<p>a</p>', category='DataLoadError')
+    main.send_email_notifications(['ops@example.com'], 'load failed - b', '<p>b</p>', category='DataLoadError')
+    assert [message['subject'] for message in messages(outbox)] == ['load failed - a']
+    [digest] = main._digests.values()
+    assert [item['subject'] for item in digest['items']] == ['load failed - b']
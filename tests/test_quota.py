@@ -0,0 +1,83 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import main
+from conftest import event
+
+
+@pytest.fixture
+def quota(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, 'QUOTA_LEDGER_DIR', str(tmp_path))
+    monkeypatch.setattr(main, 'QUOTA_ENABLED', True)
+    monkeypatch.setattr(main, 'TABLE_LOAD_JOBS_PER_DAY', 100)
+    monkeypatch.setattr(main, 'QUOTA_RESERVE_JOBS', 10)
+    monkeypatch.setattr(main, 'QUOTA_COALESCE_RATIO', 0.5)
+    monkeypatch.setattr(main, 'LOAD_DEDUP_ENABLED', False)
+    return tmp_path
+
+
+def set_table_jobs(jobs):
+    table_path, _, _ = main._quota_paths('proj', 'ds.sales')
+    main._update_quota_record(table_path, lambda record: record.update(jobs=jobs))
+
+
+def upload_config(gcs):
+    gcs.put('bk', 'in/sales.csv', 'id\n1\n')
+    gcs.put('bk', 'in/sales_config.json', json.dumps({
+        'file_location': 'gs://bk/in', 'tablename': 'sales', 'dataset': 'ds', 'email': 'ops@example.com'
+    }))
+
+
+def test_each_submission_is_counted_against_the_table_and_project(quota):
+    main.acquire_load_slot('proj', 'ds.sales', 'job-1')
+    main.acquire_load_slot('proj', 'ds.sales', 'job-2')
+    table_path, project_path, _ = main._quota_paths('proj', 'ds.sales')
+    assert main._read_quota_record(table_path) == {'jobs': 2}
+    assert main._read_quota_record(project_path) == {'jobs': 2}
+
+
+@pytest.mark.parametrize('jobs, decision', [(0, 'admit'), (50, 'coalesce'), (90, 'defer')])
+def test_admission_follows_todays_counts(quota, jobs, decision):
+    set_table_jobs(jobs)
+    assert main.quota_admission('proj', 'ds.sales') == decision
+
+
+def test_deferred_config_is_recorded_for_replay_after_the_reset(gcs, bq, quota):
+    set_table_jobs(95)
+    upload_config(gcs)
+    main.process_config_file(event('in/sales_config.json'))
+    assert bq.loads == []
+    assert gcs.emails == ['BigQuery Data Load Deferred - ds.sales']
+    record = main._read_quota_record(main._deferred_config_path('bk', 'in/sales_config.json'))
+    assert record['replay_after'] == main.next_quota_reset().isoformat()
+    assert 'in/sales_config.json' in gcs.names('bk')
+
+
+def test_due_deferred_config_is_rewritten_to_fire_the_trigger_again(gcs, quota):
+    upload_config(gcs)
+    generation = gcs.objects[('bk', 'in/sales_config.json')]['generation']
+    main.defer_config('bk', 'in/sales_config.json', 'ds.sales', until_reset=False)
+    assert main.replay_deferred_configs() == 1
+    assert gcs.objects[('bk', 'in/sales_config.json')]['generation'] > generation
+    assert list(quota.rglob('deferred/*.json')) == []
+
+
+def test_deferred_config_waits_for_its_replay_time(gcs, quota):
+    upload_config(gcs)
+    main.defer_config('bk', 'in/sales_config.json', 'ds.sales', until_reset=True)
+    assert main.replay_deferred_configs() == 0
+    assert len(list(quota.rglob('deferred/*.json'))) == 1
+
+
+def test_removed_deferred_config_is_forgotten(gcs, quota):
+    main.defer_config('bk', 'in/gone_config.json', 'ds.gone', until_reset=False)
+    assert main.replay_deferred_configs() == 0
+    assert list(quota.rglob('deferred/*.json')) == []
+
+
+def test_next_quota_reset_is_pacific_midnight():
+    reset = main.next_quota_reset().astimezone(main.QUOTA_TIMEZONE)
+    assert (reset.hour, reset.minute) == (0, 0)
+    assert reset > datetime.now(timezone.utc)
@@ -0,0 +1,81 @@
+import csv
+import io
+import json
+
+import pytest
+
+import main
+from conftest import FakeStorage, event
+
+ROWS = [['id', 'note']] + [[str(i), 'line\nbreak "q"' if i % 3 == 0 else 'x' * (i % 40 + 1)] for i in range(3000)]
+
+
+def csv_bytes(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerows(rows)
+    return buffer.getvalue().encode()
+
+
+@pytest.fixture
+def small_shards(monkeypatch):
+    plan = main.plan_csv_shards
+    monkeypatch.setattr(main, 'plan_csv_shards', lambda blob, size: plan(blob, 7000))
+    monkeypatch.setattr(main, 'MAX_FILE_SIZE_MB', 0)
+
+
+def staging_objects(storage):
+    return [name for name in storage.names('bk') if name.startswith('staging/')]
+
+
+def test_shards_hold_every_row_once_with_a_header_each(small_shards):
+    storage = FakeStorage()
+    storage.put('bk', 'in/big.csv', csv_bytes(ROWS))
+    sources = main.prepare_load_sources(storage, [['bk', 'in/big.csv']], None, True, False)
+    assert len(sources['uris']) > 3
+    rows = []
+    for bucket, path in sources['staging_files']:
+        shard = list(csv.reader(io.StringIO(storage.read(bucket, path))))
+        assert shard[0] == ROWS[0]
+        rows.extend(shard[1:])
+    assert rows == ROWS[1:]
+
+
+def test_split_that_cannot_finish_in_time_is_refused_before_writing(small_shards, monkeypatch):
+    monkeypatch.setattr(main, 'remaining_time', lambda: 0.0)
+    storage = FakeStorage()
+    storage.put('bk', 'in/big.csv', csv_bytes(ROWS))
+    with pytest.raises(main.DataLoadError, match='needs about'):
+        main.prepare_load_sources(storage, [['bk', 'in/big.csv']], None, True, False)
+    assert staging_objects(storage) == []
+
+
+def test_failed_split_removes_the_shards_it_wrote(small_shards, monkeypatch):
+    write_shard = main._write_shard
+
+    def fail_third(storage_client, blob, path, start, end, header):
+        if path.endswith('shard-00002.csv'):
+            raise ConnectionError('connection reset')
+        write_shard(storage_client, blob, path, start, end, header)
+
+    monkeypatch.setattr(main, '_write_shard', fail_third)
+    storage = FakeStorage()
+    storage.put('bk', 'in/big.csv', csv_bytes(ROWS))
+    with pytest.raises(ConnectionError):
+        main.prepare_load_sources(storage, [['bk', 'in/big.csv']], None, True, False)
+    assert staging_objects(storage) == []
+
+
+def test_failed_load_removes_its_staging_objects(gcs, bq, small_shards, monkeypatch):
+    monkeypatch.setattr(main, 'LOAD_DEDUP_ENABLED', False)
+
+    def reject(*args, **kwargs):
+        raise main.InvalidCSVFormatError('Schema mismatch')
+
+    bq.load_table_from_uri = reject
+    gcs.put('bk', 'in/sales.csv', csv_bytes(ROWS))
+    gcs.put('bk', 'in/sales_config.json', json.dumps({
+        'file_location': 'gs://bk/in', 'tablename': 'sales', 'dataset': 'ds', 'email': 'ops@example.com'
+    }))
+    main.process_config_file(event('in/sales_config.json'))
+    assert gcs.emails == ['BigQuery Data Load Failed - ds.sales']
+    assert staging_objects(gcs) == []
@@ -0,0 +1,156 @@
+from google.api_core import exceptions as api_exceptions
+
+import main
+from conftest import FakeJob, table
+
+LOAD_JOB_ID = 'gcs_load_0123456789abcdef'
+STAGING = f"sales__staging_{LOAD_JOB_ID[-12:]}"
+
+
+def load_with_merge(bq):
+    return main.load_data_to_bigquery(
+        bq, 'gs://bk/data/sales.csv', 'ds', 'sales', 'proj', True, False,
+        job_id=LOAD_JOB_ID, merge_keys=['id']
+    )
+
+
+def test_build_merge_sql_updates_non_key_columns_and_inserts_the_rest():
+    sql = main.build_merge_sql('`p.d.t`', '`p.d.s`', ['id', 'name'], ['id'])
+    assert sql.startswith('MERGE `p.d.t` T\nUSING `p.d.s` S\nON T.`id` = S.`id`\n')
+    assert 'WHEN MATCHED THEN UPDATE SET `name` = S.`name`' in sql
+    assert sql.endswith('WHEN NOT MATCHED THEN INSERT (`id`, `name`) VALUES (S.`id`, S.`name`)')
+
+
+def test_build_merge_sql_with_only_key_columns_has_no_update_clause():
+    sql = main.build_merge_sql('`p.d.t`', '`p.d.s`', ['id'], ['id'])
+    assert 'WHEN MATCHED' not in sql
+
+
+def test_merge_loads_into_staging_and_merges_under_derived_job_id(bq):
+    bq.tables.update({'sales': table('sales', 'id', 'name'), STAGING: table(STAGING, 'id', 'name')})
+    load_with_merge(bq)
+    assert [load[1] for load in bq.loads] == [STAGING]
+    assert [q[1] for q in bq.queries] == [f"{LOAD_JOB_ID}_merge"]
+    assert bq.queries[0][0].startswith('MERGE')
+    assert STAGING in bq.deleted
+
+
+def test_rerun_after_crash_merges_from_the_finished_staging_load(bq):
+    # The earlier invocation's load finished but it died before running the MERGE
+    bq.jobs[LOAD_JOB_ID] = FakeJob(LOAD_JOB_ID)
+    bq.tables.update({'sales': table('sales', 'id', 'name'), STAGING: table(STAGING, 'id', 'name')})
+    load_with_merge(bq)
+    assert bq.loads == []
+    assert [q[1] for q in bq.queries] == [f"{LOAD_JOB_ID}_merge"]
+    assert STAGING in bq.deleted
+
+
+def test_rerun_does_not_repeat_a_merge_that_already_succeeded(bq):
+    bq.jobs[LOAD_JOB_ID] = FakeJob(LOAD_JOB_ID)
+    bq.jobs[f"{LOAD_JOB_ID}_merge"] = FakeJob(f"{LOAD_JOB_ID}_merge")
+    bq.tables['sales'] = table('sales', 'id', 'name')  # staging already dropped
+    load_with_merge(bq)
+    assert bq.loads == []
+    assert bq.queries == []
+
+
+def test_concurrent_invocation_waits_on_the_running_merge(bq):
+    running = FakeJob(f"{LOAD_JOB_ID}_merge", state='RUNNING')
+
+    def conflict(sql, location=None, job_id=None):
+        bq.jobs[job_id] = running
+        raise api_exceptions.Conflict('Already Exists')
+
+    bq.jobs[LOAD_JOB_ID] = FakeJob(LOAD_JOB_ID)
+    bq.tables.update({'sales': table('sales', 'id', 'name'), STAGING: table(STAGING, 'id', 'name')})
+    bq.query = conflict
+    load_with_merge(bq)
+    assert running.state == 'DONE'
+
+
+def test_failed_merge_job_is_resubmitted_under_a_new_id(bq):
+    failed = FakeJob('q', error_result={'message': 'boom'})
+    submitted = []
+
+    def query(sql, location=None, job_id=None):
+        submitted.append(job_id)
+        if job_id == 'q':
+            raise api_exceptions.Conflict('Already Exists')
+        return FakeJob(job_id)
+
+    bq.jobs['q'] = failed
+    bq.query = query
+    main._run_query(bq, 'SELECT 1', 'US', 60, 'q')
+    assert submitted[0] == 'q' and submitted[1].startswith('q_')
+
+
+class RowsJob(FakeJob):
+    def __init__(self, job_id, rows):
+        super().__init__(job_id)
+        self.rows = rows
+
+    def result(self, timeout=None):
+        return [(value,) for value in self.rows]
+
+
+def partitioned(bq, partition_values):
+    from google.cloud import bigquery
+    target = table('events', 'id', 'day')
+    target.time_partitioning = bigquery.TimePartitioning(type_='DAY', field='day')
+    staging = bigquery.Table(f"proj.ds.events__staging_{LOAD_JOB_ID[-12:]}", schema=[
+        bigquery.SchemaField('id', 'STRING'), bigquery.SchemaField('day', 'DATE')
+    ])
+    bq.tables.update({'events': target, staging.table_id: staging})
+    plain_query = bq.query
+
+    def query(sql, location=None, job_id=None):
+        if sql.startswith('SELECT DISTINCT'):
+            bq.queries.append((sql, job_id))
+            return RowsJob('distinct', partition_values)
+        return plain_query(sql, location=location, job_id=job_id)
+
+    bq.query = query
+
+
+def override_partitioned(bq):
+    return main.load_data_to_bigquery(
+        bq, 'gs://bk/data/events.csv', 'ds', 'events', 'proj', True, True, job_id=LOAD_JOB_ID
+    )
+
+
+def test_partition_predicate_uses_typed_ranges_and_the_null_partition():
+    from datetime import date, datetime, timezone
+    assert main.partition_predicate('d', 'DATE', 'MONTH', [date(2024, 12, 1), None]) == (
+        "(`d` >= DATE '2024-12-01' AND `d` < DATE '2025-01-01') OR `d` IS NULL"
+    )
+    assert main.partition_predicate('t', 'TIMESTAMP', 'HOUR', [datetime(2024, 3, 1, 23, tzinfo=timezone.utc)]) == (
+        "(`t` >= TIMESTAMP '2024-03-01 23:00:00+00' AND `t` < TIMESTAMP '2024-03-02 00:00:00+00')"
+    )
+
+
+def test_override_replaces_only_loaded_partitions_without_wrapping_the_column(bq):
+    from datetime import date
+    partitioned(bq, [date(2024, 1, 2), None])
+    override_partitioned(bq)
+    transaction = [q for q in bq.queries if q[0].startswith('BEGIN')]
+    assert [q[1] for q in transaction] == [f"{LOAD_JOB_ID}_replace"]
+    assert "WHERE `day` IS NULL OR (`day` >= DATE '2024-01-02' AND `day` < DATE '2024-01-03');" in transaction[0][0]
+    assert 'FORMAT_' not in transaction[0][0]
+
+
+def test_rerun_replaces_partitions_from_the_finished_staging_load(bq):
+    from datetime import date
+    bq.jobs[LOAD_JOB_ID] = FakeJob(LOAD_JOB_ID)
+    partitioned(bq, [date(2024, 1, 2)])
+    override_partitioned(bq)
+    assert bq.loads == []
+    assert [q[1] for q in bq.queries if q[0].startswith('BEGIN')] == [f"{LOAD_JOB_ID}_replace"]
+
+
+def test_rerun_does_not_repeat_a_partition_replacement_that_succeeded(bq):
+    from datetime import date
+    bq.jobs[LOAD_JOB_ID] = FakeJob(LOAD_JOB_ID)
+    bq.jobs[f"{LOAD_JOB_ID}_replace"] = FakeJob(f"{LOAD_JOB_ID}_replace")
+    partitioned(bq, [date(2024, 1, 2)])
+    override_partitioned(bq)
+    assert bq.queries == []
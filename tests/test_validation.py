@@ -0,0 +1,41 @@
+import pytest
+
+import main
+from conftest import FakeStorage
+
+BODY = 'id,v\n' + ''.join(f'{i},x\n' for i in range(300000))
+
+
+@pytest.fixture
+def csv_blob(monkeypatch):
+    monkeypatch.setattr(main, 'CSV_VALIDATION_SAMPLE_MB', 1)
+    monkeypatch.setattr(main, 'CSV_VALIDATION_CHUNK_MB', 1)
+    storage = FakeStorage()
+
+    def make(data):
+        storage.put('bk', 'data.csv', data)
+        return storage.bucket('bk').blob('data.csv')
+
+    return make
+
+
+def test_full_validation_counts_rows(csv_blob):
+    assert main.validate_csv_files([csv_blob(BODY)], full=True) == 300000
+
+
+def test_sampled_validation_reads_only_head_and_tail(csv_blob):
+    blob = csv_blob(BODY.replace('150000,x\n', '150000,x,y,z\n'))
+    assert main.validate_csv_files([blob], full=False) is None
+
+
+def test_sampled_validation_rejects_bad_rows_it_confirms(csv_blob):
+    blob = csv_blob(BODY + ''.join(f'{i},x,extra\n' for i in range(20)))
+    with pytest.raises(main.InvalidCSVFormatError):
+        main.validate_csv_files([blob], full=False)
+
+
+def test_confirmation_pass_that_cannot_finish_in_time_leaves_rows_to_bigquery(csv_blob, monkeypatch, caplog):
+    monkeypatch.setattr(main, 'remaining_time', lambda: 0.0)
+    blob = csv_blob(BODY + ''.join(f'{i},x,extra\n' for i in range(20)))
+    assert main.validate_csv_files([blob], full=False) is None
+    assert "Could not re-validate data.csv" in caplog.text